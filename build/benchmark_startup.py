@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""启动耗时测试：模块导入耗时明细 + 从启动进程到窗口第一次画完的总耗时。
+
+用法：
+    python build/benchmark_startup.py                      # 测源码版
+    python build/benchmark_startup.py --exe 路径\\视频片头片尾批处理工具.exe
+                                                           # 测打包版，可分别对比 onefile / onedir
+
+窗口部分需要图形环境；程序读到环境变量 VIDEO_TOOL_STARTUP_BENCHMARK 时，
+会在窗口画完后把耗时写进该文件并自动退出。
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent.parent / "src" / "加片头片尾4.4_简洁高级分层_UI优化版.py"
+
+# 只导入模块、不启动界面；顺便量出模块本身（含顶层代码）的耗时。
+LOAD_SNIPPET = """
+import importlib.util, time
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location("video_tool", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(f"{{(time.perf_counter() - t0) * 1000:.1f}}")
+"""
+
+
+def import_breakdown(top):
+    """用 python -X importtime 列出耗时最多的顶层导入。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", LOAD_SNIPPET.format(path=str(SCRIPT))],
+        capture_output=True, text=True, encoding="utf-8", errors="replace",
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        # 缩进为 1 的是模块直接导入的包，更深的是它们内部的依赖。
+        if m and len(m.group(3)) == 1:
+            rows.append((int(m.group(2)) / 1000, m.group(4)))
+    rows.sort(reverse=True)
+    print(f"模块加载总耗时：{result.stdout.strip() or '?'} ms（含下面的导入）")
+    print("耗时最多的顶层导入（累计 ms）：")
+    for ms, name in rows[:top]:
+        print(f"  {ms:8.1f}  {name}")
+
+
+def window_startup(command, runs):
+    """从启动进程到窗口画完的墙钟时间，以及程序内部从 main() 到窗口画完的时间。"""
+    walls, inner = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / "startup.txt"
+            env = dict(os.environ, VIDEO_TOOL_STARTUP_BENCHMARK=str(report))
+            started = time.perf_counter()
+            process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            while not report.exists() and process.poll() is None and time.perf_counter() - started < 60:
+                time.sleep(0.005)
+            elapsed = (time.perf_counter() - started) * 1000
+            process.wait(timeout=30)
+            if not report.exists():
+                message = process.stderr.read().decode("utf-8", "replace").strip().splitlines()
+                print(f"窗口没有正常启动（没有图形环境？）：{message[-1] if message else process.returncode}")
+                return
+            walls.append(elapsed)
+            inner.append(float(report.read_text(encoding="utf-8")))
+    print(f"启动到窗口画完（{runs} 次取中位数）：{statistics.median(walls):.0f} ms，其中 main() 到窗口画完 {statistics.median(inner):.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量图形界面的启动耗时")
+    parser.add_argument("--exe", help="打包好的可执行文件；不填则测源码")
+    parser.add_argument("--runs", type=int, default=5, help="窗口启动测几次，默认 5")
+    parser.add_argument("--top", type=int, default=15, help="列出耗时最多的前几个导入")
+    args = parser.parse_args()
+
+    if not args.exe:
+        import_breakdown(args.top)
+    window_startup([args.exe] if args.exe else [sys.executable, str(SCRIPT)], args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""假的 ffmpeg / ffprobe：不解码也不编码，只模拟命令行为，用来测试和压测调度、重试、进度汇总。
+
+两种用法：
+1. 进程内替身（最快，几千个任务几秒跑完）：
+       backend = FakeBackend(FakeConfig(speed=0, failure="nvenc", failure_rate=0.05))
+       engine = VideoEngine("ffmpeg", "ffprobe", backend=backend)
+2. 真正的可执行文件（走完整的 subprocess 路径）：
+       python build/fake_ffmpeg.py --install 目录
+   会在目录里生成 ffmpeg / ffprobe 启动脚本，把目录放到 PATH 最前面或用 --ffmpeg 指定即可。
+   可执行文件模式用环境变量配置：FAKE_FFMPEG_SPEED、FAKE_FFMPEG_FAILURE、FAKE_FFMPEG_FAILURE_RATE、
+   FAKE_FFMPEG_FAILURE_MATCH、FAKE_FFMPEG_DURATION（含义同 FakeConfig 的字段）。
+
+模拟的行为：
+- 按 speed（素材时长的倍数，0 表示不等待）输出和真 ffmpeg 一样格式的进度行 `frame= ... time=... speed=...x`，
+  命令里带 `-progress pipe:1` 时另外输出 key=value 进度块；
+- 写出小的占位输出文件（JSON，记录时长和分辨率），假 ffprobe 读它们就能得到一致的时长；
+  真视频文件按 FakeConfig.duration 当作 1920x1080、30fps、带 AAC 音轨的素材；
+- HLS 输出同时写出分片和初始化段；
+- 响度测量、SSIM/PSNR/VMAF、`-encoders`/`-filters`/`-version` 的输出格式与真 ffmpeg 一致；
+- 按 failure / failure_rate / failure_match 注入失败：
+    nvenc      NVENC 初始化失败（退出码 1）
+    crash      缺少 DLL，退出码 3221225781（POSIX 上的可执行文件模式只能返回它的低 8 位）
+    disk_full  写到一半磁盘满（退出码 1，输出文件只写了一半）
+    invalid    输入文件损坏（退出码 1）
+"""
+
+import json
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+FAILURES = ("nvenc", "crash", "disk_full", "invalid")
+ENCODERS = ("libx264", "libx265", "h264_nvenc", "hevc_nvenc", "aac", "libopus", "png")
+FILTERS = (
+    "scale", "pad", "crop", "setsar", "fps", "format", "split", "concat", "trim", "atrim", "setpts", "asetpts",
+    "tpad", "apad", "xfade", "acrossfade", "overlay", "movie", "drawtext", "loudnorm", "aresample", "volume",
+    "ssim", "psnr", "libvmaf",
+)
+# 只有开关、后面不跟参数值的选项；其余以 - 开头的都当作带一个参数值。
+FLAG_OPTIONS = {
+    "-y", "-n", "-hide_banner", "-nostdin", "-nostats", "-stats", "-shortest", "-vn", "-an", "-sn", "-dn",
+    "-copyts", "-accurate_seek", "-noaccurate_seek", "-benchmark",
+}
+# 放在 -i 前面、作用于输入的选项。
+INPUT_OPTIONS = {"-ss", "-t", "-to", "-f", "-safe", "-stream_loop", "-r", "-itsoffset", "-re"}
+STUB_MARKER = "fake_ffmpeg_stub"
+PROGRESS_STEP = 0.5  # 每隔多少秒素材时长输出一行进度
+
+
+@dataclass
+class FakeConfig:
+    speed: float = 0.0           # 编码速度（素材时长的倍数）；0 表示立即完成
+    failure: str = ""            # 注入的失败类型，见 FAILURES
+    failure_rate: float = 1.0    # 命令命中 failure_match 后按这个概率失败
+    failure_match: str = ""      # 只有参数里含这段文字的命令才会失败；留空表示所有编码命令
+    duration: float = 10.0       # 非占位文件（真视频）的时长
+    ssim: float = 0.985
+    seed: int = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            speed=float(os.environ.get("FAKE_FFMPEG_SPEED") or 0),
+            failure=os.environ.get("FAKE_FFMPEG_FAILURE", ""),
+            failure_rate=float(os.environ.get("FAKE_FFMPEG_FAILURE_RATE") or 1),
+            failure_match=os.environ.get("FAKE_FFMPEG_FAILURE_MATCH", ""),
+            duration=float(os.environ.get("FAKE_FFMPEG_DURATION") or 10),
+        )
+
+
+class Stopped(Exception):
+    """模拟过程中收到 terminate/kill。"""
+
+
+def write_stub(path, duration, width=1920, height=1080, fps=30.0, audio=True, title=""):
+    """写一个占位媒体文件，假 ffprobe 能读出这些参数；压测用它生成输入文件。"""
+    data = {STUB_MARKER: True, "duration": round(duration, 3), "width": width, "height": height, "fps": fps, "audio": audio, "title": title}
+    Path(path).write_text(json.dumps(data), encoding="utf-8")
+
+
+def read_stub(path, config: FakeConfig):
+    """读占位文件的参数；HLS 播放列表按分片时长相加、分辨率取第一个分片（主播放列表取第一档）。"""
+    try:
+        with open(path, "rb") as f:
+            text = f.read(1 << 20).decode("utf-8")
+        if text.startswith("#EXTM3U"):
+            folder = os.path.dirname(path)
+            names = [line for line in text.splitlines() if line and not line.startswith("#")]
+            if "#EXT-X-STREAM-INF" in text and names:
+                return read_stub(os.path.join(folder, names[0]), config)
+            first = read_stub(os.path.join(folder, names[0]), config) if names else {}
+            duration = sum(float(m) for m in re.findall(r"#EXTINF:([\d.]+)", text))
+            return dict(first or {"width": 1920, "height": 1080, "fps": 30.0, "audio": True, "title": ""}, duration=duration)
+        data = json.loads(text)
+        if isinstance(data, dict) and data.get(STUB_MARKER):
+            return data
+    except (OSError, ValueError, UnicodeDecodeError):
+        pass
+    return {"duration": config.duration, "width": 1920, "height": 1080, "fps": 30.0, "audio": True, "title": ""}
+
+
+def _concat_list_duration(list_file, config):
+    total = 0.0
+    try:
+        lines = Path(list_file).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return 0.0
+    for line in lines:
+        m = re.match(r"file '(.*)'$", line.strip())
+        if m:
+            total += read_stub(m.group(1).replace("'\\''", "'"), config)["duration"]
+    return total
+
+
+def parse_command(argv):
+    """把 ffmpeg 参数拆成输入（路径、输入选项）和输出（路径、输出选项）。"""
+    inputs, outputs = [], []
+    pending = {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-i" and i + 1 < len(argv):
+            inputs.append((argv[i + 1], {k: v for k, v in pending.items() if k in INPUT_OPTIONS}))
+            pending = {}
+            i += 2
+        elif arg.startswith("-") and arg != "-" and arg not in FLAG_OPTIONS and i + 1 < len(argv):
+            pending[arg] = argv[i + 1]
+            i += 2
+        elif arg.startswith("-") and arg != "-":
+            i += 1
+        else:
+            outputs.append((arg, pending))
+            pending = {}
+            i += 1
+    return inputs, outputs
+
+
+class Simulation:
+    """模拟一次 ffmpeg / ffprobe 调用。emit(行, 是否 stdout) 输出一行，should_stop() 为真时尽快退出。"""
+
+    def __init__(self, argv, config: FakeConfig, emit, should_stop=lambda: False, cwd=None, rng=None):
+        self.argv = list(argv)
+        self.config = config
+        self.emit = emit
+        self.should_stop = should_stop
+        self.cwd = cwd
+        self.rng = rng or random.Random(config.seed)
+
+    def _path(self, path):
+        return path if os.path.isabs(path) or not self.cwd else os.path.join(self.cwd, path)
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while True:
+            if self.should_stop():
+                raise Stopped()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.05))
+
+    def run_ffprobe(self):
+        path = self._path(self.argv[-1])
+        if not os.path.isfile(path):
+            self.emit(f"{self.argv[-1]}: No such file or directory", False)
+            return 1
+        stub = read_stub(path, self.config)
+        streams = [{
+            "index": 0, "codec_type": "video", "codec_name": "h264", "width": stub["width"], "height": stub["height"],
+            "avg_frame_rate": f"{round(stub['fps'] * 1000)}/1000", "duration": str(stub["duration"]),
+        }]
+        if stub.get("audio"):
+            streams.append({
+                "index": 1, "codec_type": "audio", "codec_name": "aac", "profile": "LC", "sample_rate": "48000", "channels": 2,
+                "duration": str(stub["duration"]),
+            })
+        data = {"streams": streams, "format": {"duration": str(stub["duration"]), "tags": {"title": stub["title"]} if stub.get("title") else {}}}
+        for line in json.dumps(data, indent=2).splitlines():
+            self.emit(line, True)
+        return 0
+
+    def run_ffmpeg(self):
+        args = self.argv[1:]
+        if "-encoders" in args:
+            self.emit("Encoders:", True)
+            for name in ENCODERS:
+                self.emit(f" V....D {name:<20} {name} (fake)", True)
+            return 0
+        if "-filters" in args:
+            self.emit("Filters:", True)
+            for name in FILTERS:
+                self.emit(f" ... {name:<16} V->V       {name} (fake)", True)
+            return 0
+        if "-h" in args:
+            self.emit("Advanced per-stream options:", True)
+            self.emit("-fps_mode[:<stream_spec>]  set framerate mode for matching video streams; overrides vsync", True)
+            return 0
+        if "-version" in args:
+            self.emit("ffmpeg version fake-7.0 Copyright (c) 2000-2024 the FFmpeg developers", True)
+            self.emit("configuration: --enable-gpl --enable-libx264 --enable-libx265 --enable-libsoxr --enable-libvmaf", True)
+            return 0
+
+        inputs, outputs = parse_command(args)
+        durations = []
+        for path, options in inputs:
+            full = self._path(path)
+            if options.get("-f") == "concat":
+                durations.append(_concat_list_duration(full, self.config))
+                continue
+            if not os.path.isfile(full):
+                self.emit(f"{path}: No such file or directory", False)
+                return 1
+            duration = read_stub(full, self.config)["duration"]
+            start = float(options.get("-ss") or 0)
+            duration = max(0.0, duration - start)
+            if options.get("-t"):
+                duration = min(duration, float(options["-t"]))
+            durations.append(duration)
+        first = read_stub(self._path(inputs[0][0]), self.config) if inputs else {"width": 1920, "height": 1080, "fps": 30.0}
+
+        graph = " ".join(value for key, value in zip(args, args[1:]) if key in ("-filter_complex", "-vf", "-af"))
+        joined = "concat=" in graph or "xfade=" in graph or any(options.get("-f") == "concat" for _, options in inputs)
+        duration = sum(durations) if joined else max(durations, default=0.0)
+        for _, options in outputs:
+            if options.get("-t"):
+                duration = min(duration, float(options["-t"]))
+        failure = self._pick_failure()
+
+        if failure == "crash":
+            return 3221225781
+        if failure == "invalid":
+            self.emit(f"{inputs[0][0] if inputs else '?'}: Invalid data found when processing input", False)
+            return 1
+        if failure == "nvenc":
+            self.emit("[h264_nvenc @ 0x55d0c0a1e240] OpenEncodeSessionEx failed: unsupported device (2): (no details)", False)
+            self.emit("[h264_nvenc @ 0x55d0c0a1e240] No capable devices found", False)
+            self.emit("[vost#0:0/h264_nvenc @ 0x55d0c0a1d100] Error while opening encoder - maybe incorrect parameters such as bit_rate, rate, width or height.", False)
+            return 1
+
+        progress_pipe = "-progress" in args
+        fps = first.get("fps") or 30.0
+        position = 0.0
+        stop_at = duration / 2 if failure == "disk_full" else duration
+        try:
+            while position < stop_at:
+                step = min(PROGRESS_STEP, stop_at - position)
+                if self.config.speed > 0:
+                    self._sleep(step / self.config.speed)
+                elif self.should_stop():
+                    raise Stopped()
+                position += step
+                self._emit_progress(position, fps, progress_pipe, done=False)
+        except Stopped:
+            self.emit("Exiting normally, received signal 15.", False)
+            return 255
+
+        if failure == "disk_full":
+            self._write_outputs(outputs, position, first, partial=True)
+            name = outputs[0][0] if outputs else "output"
+            self.emit("[out#0/mp4 @ 0x55d0c0a20000] av_interleaved_write_frame(): No space left on device", False)
+            self.emit(f"[out#0/mp4 @ 0x55d0c0a20000] Error writing trailer of {name}: No space left on device", False)
+            return 1
+
+        self._write_outputs(outputs, duration, first)
+        self._emit_progress(duration, fps, progress_pipe, done=True)
+        self._emit_analysis(graph, duration)
+        kib = max(1, int(duration * 250))
+        self.emit(f"[out#0/mp4 @ 0x55d0c0a20000] video:{kib}KiB audio:{int(duration * 16)}KiB subtitle:0KiB other streams:0KiB "
+                  "global headers:0KiB muxing overhead: 0.512345%", False)
+        return 0
+
+    def _pick_failure(self):
+        config = self.config
+        if config.failure not in FAILURES:
+            return ""
+        command = " ".join(self.argv)
+        if config.failure_match and config.failure_match not in command:
+            return ""
+        if not config.failure_match and "-f null" in command and config.failure != "invalid":
+            # 分析类命令（响度、复杂度、画质校验）不注入编码失败。
+            return ""
+        return config.failure if self.rng.random() < config.failure_rate else ""
+
+    def _emit_progress(self, position, fps, progress_pipe, done):
+        frames = int(position * fps)
+        speed = self.config.speed or 100.0
+        stamp = f"{int(position // 3600):02d}:{int(position % 3600 // 60):02d}:{position % 60:05.2f}"
+        self.emit(
+            f"frame={frames:5d} fps={fps * speed:.0f} q=28.0 {'L' if done else ''}size={int(position * 266):8d}KiB "
+            f"time={stamp} bitrate=2180.3kbits/s speed={speed:.3g}x",
+            False,
+        )
+        if progress_pipe:
+            for line in (f"frame={frames}", f"out_time_us={int(position * 1e6)}", f"out_time={stamp}0000",
+                         f"speed={speed:.3g}x", f"progress={'end' if done else 'continue'}"):
+                self.emit(line, True)
+
+    def _emit_analysis(self, graph, duration):
+        ssim = self.config.ssim
+        if "loudnorm" in graph and "print_format=json" in graph:
+            self.emit("[Parsed_loudnorm_0 @ 0x55d0c0a30000] ", False)
+            for line in json.dumps({
+                "input_i": "-19.42", "input_tp": "-2.10", "input_lra": "6.30", "input_thresh": "-29.61",
+                "output_i": "-16.02", "output_tp": "-1.50", "output_lra": "5.10", "output_thresh": "-26.20",
+                "normalization_type": "dynamic", "target_offset": "0.02",
+            }, indent="\t").replace('": ', '" : ').splitlines():
+                self.emit(line, False)
+        if "ssim" in graph:
+            self.emit(f"[Parsed_ssim_2 @ 0x55d0c0a31000] SSIM Y:{ssim + 0.004:.6f} (20.0) U:{ssim:.6f} (19.0) V:{ssim:.6f} (19.0) All:{ssim:.6f} (18.5)", False)
+        if "psnr" in graph:
+            self.emit("[Parsed_psnr_3 @ 0x55d0c0a32000] PSNR y:41.20 u:44.10 v:44.30 average:42.02 min:38.11 max:47.90", False)
+        if "libvmaf" in graph:
+            self.emit(f"[Parsed_libvmaf_4 @ 0x55d0c0a33000] VMAF score: {ssim * 95:.6f}", False)
+
+    def _write_outputs(self, outputs, duration, first, partial=False):
+        for path, options in outputs:
+            if path == "-" or options.get("-f") == "null":
+                continue
+            target = self._path(path)
+            width, height = first.get("width", 1920), first.get("height", 1080)
+            scale = re.search(r"scale=(\d+):(\d+)", " ".join(options.values()))
+            if scale:
+                width, height = int(scale.group(1)), int(scale.group(2))
+            if options.get("-f") == "hls":
+                self._write_hls(target, options, duration, width, height)
+                continue
+            if partial:
+                Path(target).write_bytes(b"\0" * 1024)
+                continue
+            write_stub(target, duration, width, height, first.get("fps", 30.0), first.get("audio", True))
+
+    def _write_hls(self, playlist, options, duration, width, height):
+        seconds = float(options.get("-hls_time") or 6)
+        pattern = options.get("-hls_segment_filename") or os.path.splitext(playlist)[0] + "_%05d.ts"
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", f"#EXT-X-TARGETDURATION:{int(seconds)}", "#EXT-X-PLAYLIST-TYPE:VOD"]
+        if options.get("-hls_fmp4_init_filename"):
+            init = os.path.join(os.path.dirname(playlist), options["-hls_fmp4_init_filename"])
+            write_stub(init, 0.0, width, height)
+            lines.append(f'#EXT-X-MAP:URI="{os.path.basename(init)}"')
+        index, left = 0, duration
+        while left > 1e-6:
+            length = min(seconds, left)
+            segment = self._path(pattern % index)
+            write_stub(segment, length, width, height)
+            lines += [f"#EXTINF:{length:.6f},", os.path.basename(segment)]
+            index, left = index + 1, left - length
+        lines.append("#EXT-X-ENDLIST")
+        Path(playlist).write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def run(self):
+        name = os.path.basename(self.argv[0]).lower()
+        return self.run_ffprobe() if "ffprobe" in name else self.run_ffmpeg()
+
+
+class FakeProcess:
+    """进程内的“子进程”：在后台线程里跑 Simulation，接口与引擎用到的 subprocess.Popen 部分一致。"""
+
+    pid = 0
+
+    def __init__(self, argv, config: FakeConfig, cwd=None, rng=None):
+        self._lines = queue.Queue()
+        self._stop = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self.returncode = None
+        self.stdout = iter(self._lines.get, None)
+        self._thread = threading.Thread(target=self._run, args=(argv, config, cwd, rng), daemon=True)
+        self._thread.start()
+
+    def _run(self, argv, config, cwd, rng):
+        try:
+            code = Simulation(argv, config, lambda line, _stdout: self._lines.put(line + "\n"), self._should_stop, cwd, rng).run()
+        except Exception as exc:  # 替身自身出错也要让调用方看到，而不是卡住
+            self._lines.put(f"fake_ffmpeg internal error: {exc}\n")
+            code = 1
+        self.returncode = code
+        self._lines.put(None)
+
+    def _should_stop(self):
+        # 暂停时模拟的编码停在原地（相当于 SIGSTOP），恢复后接着跑。
+        self._running.wait()
+        return self._stop.is_set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise subprocess.TimeoutExpired("fake_ffmpeg", timeout)
+        return self.returncode
+
+    def terminate(self):
+        self._stop.set()
+        self._running.set()
+
+    kill = terminate
+
+    def suspend(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+
+class FakeBackend:
+    """引擎的进程后端替身（对应主程序里的 ProcessBackend），不启动任何真实进程。"""
+
+    def __init__(self, config: FakeConfig = None, can_suspend=True):
+        self.config = config or FakeConfig()
+        self.can_suspend = can_suspend
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self.commands = 0
+
+    def _child_rng(self):
+        # 每条命令一个独立的随机数发生器，固定 seed 时整批的失败分布可复现（与线程调度无关的部分）。
+        with self._rng_lock:
+            self.commands += 1
+            return random.Random(self._rng.random())
+
+    def popen(self, cmd, cwd=None):
+        return FakeProcess(cmd, self.config, cwd, self._child_rng())
+
+    def run(self, cmd, timeout=None):
+        out, err = [], []
+        code = Simulation(cmd, self.config, lambda line, stdout: (out if stdout else err).append(line), rng=self._child_rng()).run()
+        return subprocess.CompletedProcess(cmd, code, "\n".join(out) + "\n", "\n".join(err) + "\n")
+
+    def terminate(self, process):
+        process.terminate()
+
+    def kill(self, process):
+        process.kill()
+
+    def suspend(self, process):
+        """can_suspend 为假时模拟不能暂停进程的平台，引擎改为中止任务、重新排队。"""
+        if not self.can_suspend:
+            return False
+        process.suspend()
+        return True
+
+    def resume(self, process):
+        process.resume()
+
+
+def install(folder):
+    """在 folder 里生成 ffmpeg / ffprobe 启动脚本，指向本文件。"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    script = Path(__file__).resolve()
+    for name in ("ffmpeg", "ffprobe"):
+        if os.name == "nt":
+            (folder / f"{name}.cmd").write_text(f'@"{sys.executable}" "{script}" --as {name} %*\r\n', encoding="utf-8")
+        else:
+            path = folder / name
+            path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" --as {name} "$@"\n', encoding="utf-8")
+            path.chmod(0o755)
+    print(f"已生成假的 ffmpeg / ffprobe：{folder}")
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == "--install":
+        install(argv[1])
+        return 0
+    name = "ffmpeg"
+    if len(argv) >= 2 and argv[0] == "--as":
+        name, argv = argv[1], argv[2:]
+    stop = threading.Event()
+    try:
+        import signal
+
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    except (ImportError, ValueError):
+        pass
+
+    def emit(line, stdout):
+        stream = sys.stdout if stdout else sys.stderr
+        stream.write(line + "\n")
+        stream.flush()
+
+    code = Simulation([name, *argv], FakeConfig.from_env(), emit, stop.is_set).run()
+    # POSIX 的退出码只有 8 位，3221225781 这类 Windows 状态码只能保留低位。
+    return code if os.name == "nt" else code & 0xFF
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
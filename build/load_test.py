@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""调度压测：用假的 ffmpeg（build/fake_ffmpeg.py 的进程内替身）跑成千上万个模拟任务，
+检查并行调度、失败重试、断点续跑和进度汇总，几秒到几十秒就能跑完。
+
+用法：
+    python build/load_test.py                                   # 2000 个任务，三个场景都跑
+    python build/load_test.py -n 5000 -j 16 --scenario batch
+    python build/load_test.py --failure nvenc --failure-rate 0.05 --scenario farm
+    python build/load_test.py --speed 200                       # 按 200 倍速模拟编码耗时
+    python build/load_test.py --scenario urgent --no-suspend
+    python build/load_test.py --scenario service
+
+场景：
+    batch   VideoEngine.run_batch：进度事件、成功/失败数与监控指标是否一致
+    farm    FarmCoordinator + 多个工作线程：注入的失败按最大尝试次数重试
+    resume  FileJobQueue：跑到一半停掉所有工作进程、再留一个过期租约，换一批工作进程接着跑完
+    urgent  VideoEngine.add_to_batch：批处理进行中加急插入新文件、提前排队中的文件，加急的要先处理，
+            让位的任务（暂停或中止后重新排队，--no-suspend 模拟不能暂停进程的平台）最后也都完成
+    service JobService + HTTP 接口，只用本机 urllib 客户端：提交返回 202、排队满返回 429 和 Retry-After
+            （被拒的提交不建输出目录）、取消排队中和处理中的任务、SSE 事件顺序、/status 和 /metrics
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import replace
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SCRIPT = HERE.parent / "src" / "加片头片尾4.4_简洁高级分层_UI优化版.py"
+sys.path.insert(0, str(HERE))
+
+import fake_ffmpeg  # noqa: E402
+
+
+def load_tool():
+    spec = importlib.util.spec_from_file_location("video_tool", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Report:
+    def __init__(self, name):
+        self.name = name
+        self.problems = []
+
+    def check(self, ok, text):
+        print(f"  [{'通过' if ok else '不一致'}] {text}")
+        if not ok:
+            self.problems.append(text)
+
+
+def make_inputs(folder, count, duration_range, seed):
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        path = os.path.join(folder, f"clip_{i:05d}.mp4")
+        # 标题带序号，保证每个文件内容不同，不会被导入去重合并。
+        fake_ffmpeg.write_stub(path, rng.uniform(*duration_range), title=f"clip {i}")
+        files.append(path)
+    intro, outro = os.path.join(folder, "intro.mov"), os.path.join(folder, "outro.mov")
+    fake_ffmpeg.write_stub(intro, 3.0)
+    fake_ffmpeg.write_stub(outro, 2.0)
+    return files, intro, outro
+
+
+def new_engine(tool, backend, workdir, args, metrics=None, name="engine"):
+    def log(message, tag="info"):
+        if args.verbose or tag == "error" and args.show_errors:
+            print(f"    [{name}] {message}")
+
+    engine = tool.VideoEngine(
+        "ffmpeg", "ffprobe", log=log, backend=backend, metrics=metrics,
+        probe_index=tool.ProbeIndex(os.path.join(workdir, "probe_index.json")),
+        governor=tool.ResourceGovernor(args.ram_budget),
+    )
+    return engine
+
+
+def failure_summary(metrics):
+    return {dict(labels).get("category", "?"): int(value) for labels, value in metrics.series("video_tool_job_failures_total").items()}
+
+
+def scenario_batch(tool, backend, template, files, intro, outro, workdir, args):
+    report = Report("batch")
+    engine = new_engine(tool, backend, workdir, args)
+    events = {"start": 0, "done": 0, "failed": 0}
+    progress = []
+    lock = threading.Lock()
+
+    def on_event(event, _path, detail):
+        with lock:
+            if event == "progress":
+                progress.append(detail)
+            else:
+                events[event] += 1
+
+    output_dir = os.path.join(workdir, "out_batch")
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    succeeded = engine.run_batch(files, template, output_dir, intro, outro, jobs=args.parallel, on_event=on_event)
+    elapsed = time.perf_counter() - started
+    metrics = engine.metrics
+    print(f"  {len(files)} 个任务，{elapsed:.2f} 秒，{len(files) / elapsed:.0f} 个/秒；成功 {succeeded}，失败 {events['failed']}")
+    print(f"  失败原因：{failure_summary(metrics) or '无'}")
+    report.check(succeeded + events["failed"] == len(files), "成功数 + 失败数 = 任务数")
+    report.check(events["done"] == succeeded, "done 事件数 = 成功数")
+    report.check(sorted(progress) == list(range(1, len(files) + 1)), "progress 事件从 1 数到任务数，不重不漏")
+    report.check(metrics.value("video_tool_jobs_total", result="done") == succeeded, "监控指标 jobs_total{done} = 成功数")
+    report.check(sum(failure_summary(metrics).values()) == events["failed"], "按类别统计的失败数之和 = 失败数")
+    report.check(metrics.value("video_tool_queue_depth") == 0 and metrics.value("video_tool_jobs_running") == 0, "结束时排队数和处理中数都归零")
+    if args.failure:
+        report.check(events["failed"] > 0, "注入的失败确实出现了")
+    else:
+        report.check(succeeded == len(files), "没有注入失败时全部成功")
+    return report
+
+
+def run_workers(tool, backend, job_queue, workers, workdir, args, metrics, stop_after=None):
+    """起 workers 个工作线程领取任务；stop_after 是一个函数，返回真时停掉所有工作线程（模拟整批中断）。"""
+    engines = [new_engine(tool, backend, workdir, args, metrics, f"w{i}") for i in range(workers)]
+    threads = [
+        threading.Thread(target=tool.run_farm_worker, args=(job_queue, engine, f"worker-{i}"), kwargs={"poll_seconds": 0.05}, daemon=True)
+        for i, engine in enumerate(engines)
+    ]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        if stop_after is not None and stop_after():
+            for engine in engines:
+                engine.stop_event.set()
+                engine.terminate_processes()
+        time.sleep(0.02)
+
+
+def scenario_farm(tool, backend, template, files, intro, outro, workdir, args):
+    report = Report("farm")
+    metrics = tool.MetricsRegistry()
+    coordinator = tool.FarmCoordinator(lease_seconds=30, log=lambda *_: None)
+    coordinator.submit(tool.make_farm_jobs(files, template, os.path.join(workdir, "out_farm"), intro, outro))
+    started = time.perf_counter()
+    run_workers(tool, backend, coordinator, args.parallel, workdir, args, metrics)
+    elapsed = time.perf_counter() - started
+    status = coordinator.status()
+    attempts = sum(job["attempts"] for job in coordinator.jobs.values())
+    print(f"  {status['total']} 个任务，{elapsed:.2f} 秒；完成 {status['done']}，最终失败 {status['failed']}，共尝试 {attempts} 次")
+    report.check(status["finished"] and status["done"] + status["failed"] == status["total"], "所有任务都有结果")
+    report.check(all(job["attempts"] <= coordinator.max_attempts for job in coordinator.jobs.values()), "没有任务超过最大尝试次数")
+    report.check(all(job["attempts"] == coordinator.max_attempts for job in coordinator.jobs.values() if job["status"] == "failed"),
+                 "最终失败的任务都重试满了")
+    if args.failure and args.failure_rate < 1:
+        report.check(attempts > status["total"], "失败的任务被重新分配重试")
+    elif not args.failure:
+        report.check(status["done"] == status["total"], "没有注入失败时全部成功")
+    return report
+
+
+def scenario_resume(tool, backend, template, files, intro, outro, workdir, args):
+    report = Report("resume")
+    root = os.path.join(workdir, "queue")
+    metrics = tool.MetricsRegistry()
+    job_queue = tool.FileJobQueue(root, lease_seconds=3, log=lambda *_: None)
+    jobs = tool.make_farm_jobs(files, template, os.path.join(workdir, "out_resume"), intro, outro)
+    job_queue.submit(jobs)
+    half = len(jobs) // 2
+
+    started = time.perf_counter()
+    run_workers(tool, backend, job_queue, args.parallel, workdir, args, metrics, stop_after=lambda: job_queue.status()["done"] >= half)
+    first = job_queue.status()
+    print(f"  第一轮中断：完成 {first['done']}，待处理 {first['pending']}，处理中 {first['leased']}，失败 {first['failed']}")
+
+    # 模拟一个崩溃的工作进程：它领走的任务留在 leased/ 里，修改时间早已过期。
+    pending = sorted(Path(root, "jobs").glob("*.json"))
+    if pending:
+        stale = Path(root, "leased", pending[0].name)
+        os.rename(pending[0], stale)
+        os.utime(stale, (time.time() - 60, time.time() - 60))
+
+    resumed = tool.FileJobQueue(root, lease_seconds=3, log=lambda *_: None)
+    run_workers(tool, backend, resumed, args.parallel, workdir, args, metrics)
+    elapsed = time.perf_counter() - started
+    final = resumed.status()
+    print(f"  续跑后：完成 {final['done']}，失败 {final['failed']}，共 {elapsed:.2f} 秒")
+    report.check(first["done"] < len(jobs), "第一轮确实在中途停下")
+    report.check(final["finished"] and final["done"] + final["failed"] == len(jobs), "续跑后所有任务都有结果")
+    report.check(final["leased"] == 0, "过期租约被回收重跑")
+    done_ids = [path.stem for path in Path(root, "done").glob("*.json")]
+    report.check(len(done_ids) == len(set(done_ids)), "没有任务被重复记为完成")
+    return report
+
+
+def scenario_urgent(tool, backend, template, files, intro, outro, workdir, args):
+    report = Report("urgent")
+    # 要有任务正在编码才谈得上插队，没给 --speed 时按 400 倍速模拟。
+    config = backend.config
+    if not config.speed:
+        config = replace(config, speed=400)
+    urgent_backend = fake_ffmpeg.FakeBackend(config, can_suspend=not args.no_suspend)
+    engine = new_engine(tool, urgent_backend, workdir, args)
+    starts, progress, requeued, failed = [], [], [], []
+    lock = threading.Lock()
+
+    def on_event(event, path, detail):
+        with lock:
+            if event == "start":
+                starts.append(path)
+            elif event == "requeued":
+                requeued.append(path)
+            elif event == "failed":
+                failed.append(path)
+            elif event == "progress":
+                progress.append(detail)
+
+    urgent = []
+    for i in range(args.parallel):
+        path = os.path.join(workdir, f"urgent_{i}.mp4")
+        fake_ffmpeg.write_stub(path, 20.0, title=f"urgent {i}")
+        urgent.append(path)
+    promoted = files[-1]
+    output_dir = os.path.join(workdir, "out_urgent")
+    os.makedirs(output_dir, exist_ok=True)
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.setdefault("succeeded", engine.run_batch(files, template, output_dir, intro, outro, jobs=args.parallel, on_event=on_event)),
+        daemon=True,
+    )
+    started = time.perf_counter()
+    thread.start()
+    while len(progress) < len(files) // 4 and thread.is_alive():
+        time.sleep(0.01)
+    with lock:
+        before = len(starts)
+    accepted = engine.add_to_batch([promoted], tool.PRIORITY_URGENT)
+    for path in urgent:
+        accepted += engine.add_to_batch([path], tool.PRIORITY_URGENT, preempt=True)
+    thread.join()
+    elapsed = time.perf_counter() - started
+    backend.commands += urgent_backend.commands
+    total = len(files) + len(urgent)
+    preemptions = {dict(labels).get("mode", "?"): int(value) for labels, value in engine.metrics.series("video_tool_preemptions_total").items()}
+    print(f"  {total} 个任务，{elapsed:.2f} 秒；成功 {result.get('succeeded')}，让位 {preemptions or '无'}，重新排队 {len(requeued)} 次")
+    # 加急文件之前最多还能有“并行数”个普通文件开始（各路正在交接的那一刻），让位的任务重新开始不算。
+    firsts = {}
+    for index, path in enumerate(starts):
+        firsts.setdefault(path, index)
+    last_urgent = max(firsts.get(path, len(starts)) for path in [promoted, *urgent])
+    normal_between = sum(1 for path, index in firsts.items() if before <= index < last_urgent and path not in urgent and path != promoted)
+    report.check(len(accepted) == len(urgent) + 1, "批处理进行中加入和提前的文件都被接受")
+    report.check(result.get("succeeded", 0) + len(failed) == total, "成功数 + 失败数 = 原有文件数 + 加急文件数")
+    if not args.failure:
+        report.check(result.get("succeeded") == total, "没有注入失败时全部成功")
+    report.check(sorted(progress) == list(range(1, total + 1)), "progress 事件从 1 数到任务总数，不重不漏")
+    report.check(normal_between <= args.parallel, f"加急文件先处理（加入后又开始了 {normal_between} 个普通文件）")
+    report.check(engine.metrics.value("video_tool_queue_depth") == 0 and engine.metrics.value("video_tool_jobs_running") == 0, "结束时排队数和处理中数都归零")
+    report.check(not engine.add_to_batch([urgent[0]]), "批处理结束后不再接受新文件")
+    return report
+
+
+def http(base, method, path, data=None, timeout=30):
+    """本机 HTTP 请求，返回 (状态码, 响应头, 响应体)；4xx/5xx 不抛异常。"""
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    request = urllib.request.Request(base + path, data=body, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.headers, response.read().decode("utf-8")
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers, exc.read().decode("utf-8")
+
+
+def read_events(base, job_id, timeout=120):
+    """读完一个任务的 SSE 流（任务结束后服务端会关闭连接），返回事件名列表和对应的数据。"""
+    events = []
+    with urllib.request.urlopen(f"{base}/jobs/{job_id}/events", timeout=timeout) as response:
+        name = ""
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                name = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((name, json.loads(line[len("data: "):])))
+    return events
+
+
+def wait_status(base, job_id, statuses, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = json.loads(http(base, "GET", f"/jobs/{job_id}")[2]).get("status")
+        if status in statuses:
+            return status
+        time.sleep(0.02)
+    return status
+
+
+def scenario_service(tool, backend, template, files, intro, outro, workdir, args):
+    report = Report("service")
+    # 第一个任务要一直占着唯一的工作线程，后面的才会排队，没给 --speed 时按 400 倍速模拟。
+    config = backend.config
+    if not config.speed:
+        config = replace(config, speed=400)
+    service_backend = fake_ffmpeg.FakeBackend(config)
+    root = os.path.join(workdir, "out_service")
+    service = tool.JobService(
+        "ffmpeg", "ffprobe", tool.EncodeProfile(), os.path.join(root, "default"), intro, outro, workers=1, max_queue=2,
+        log=lambda message, tag="info": args.verbose and print(f"    [service] {message}"), backend=service_backend,
+        probe_index=tool.ProbeIndex(os.path.join(workdir, "probe_index.json")),
+    )
+    server = tool.start_job_service(service, port=0)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        def submit(name, inputs):
+            return http(base, "POST", "/jobs", {"inputs": inputs, "output_dir": os.path.join(root, name)})
+
+        long_job, single = files[:50], files[-1:]
+        code, _, body = submit("long", long_job)
+        report.check(code == 202, f"提交任务返回 202（实际 {code}）")
+        long_id = json.loads(body)["id"]
+        report.check(wait_status(base, long_id, ("running",)) == "running", "第一个任务开始执行")
+        queued = [submit(name, single) for name in ("first", "second")]
+        report.check([code for code, _, _ in queued] == [202, 202], "工作线程忙时后续任务排队，仍返回 202")
+        first_id, second_id = (json.loads(body)["id"] for _, _, body in queued)
+
+        code, headers, _ = submit("rejected", single)
+        report.check(code == 429 and headers.get("Retry-After") == "5", f"排队已满返回 429 和 Retry-After（实际 {code}）")
+        report.check(not os.path.exists(os.path.join(root, "rejected")), "被拒绝的提交没有建输出目录")
+        code, _, _ = http(base, "POST", "/jobs", {"inputs": []})
+        report.check(code == 400, f"参数无效返回 400（实际 {code}）")
+
+        code, _, body = http(base, "POST", f"/jobs/{second_id}/cancel")
+        report.check(code == 200 and json.loads(body)["status"] == "cancelled", "取消排队中的任务立即生效")
+        code, _, _ = http(base, "DELETE", f"/jobs/{long_id}")
+        report.check(code == 200 and wait_status(base, long_id, ("cancelled", "done", "failed")) == "cancelled", "取消处理中的任务")
+        code, _, _ = http(base, "GET", "/jobs/nosuchjob")
+        report.check(code == 404, "不存在的任务返回 404")
+
+        events = read_events(base, first_id)
+        names = [name for name, _ in events]
+        print(f"  第二个任务的事件：{'、'.join(dict.fromkeys(names))}")
+        report.check(names[:2] == ["queued", "running"], "SSE 先补发 queued，再是 running")
+        report.check(names and names[-1] in ("done", "failed") and names.count(names[-1]) == 1, "SSE 以一个结束事件收尾")
+        file_events = [(name, data["file"]) for name, data in events if name.startswith("file_")]
+        report.check(
+            len(file_events) == 2 and file_events[0] == ("file_start", single[0]) and file_events[1][1] == single[0]
+            and file_events[1][0] in ("file_done", "file_failed"),
+            "文件先 file_start 再 file_done/file_failed",
+        )
+        if not args.failure:
+            report.check(names[-1] == "done" and file_events[1][0] == "file_done", "没有注入失败时任务成功")
+        report.check(read_events(base, first_id) == events, "任务结束后订阅 SSE 会补发全部历史事件")
+
+        code, _, body = http(base, "GET", "/status")
+        counts = json.loads(body)["jobs"] if code == 200 else {}
+        report.check(counts.get("cancelled") == 2 and not counts.get("queued") and not counts.get("running"), f"/status 的任务计数正确：{counts}")
+        code, _, text = http(base, "GET", "/metrics")
+        report.check(code == 200 and "video_tool_service_jobs_queued 0" in text, "/metrics 里排队数归零")
+        report.check("video_tool_jobs_total" in text, "/metrics 里有任务计数")
+    finally:
+        service.shutdown()
+        server.shutdown()
+        server.server_close()
+        backend.commands += service_backend.commands
+    return report
+
+
+SCENARIOS = {"batch": scenario_batch, "farm": scenario_farm, "resume": scenario_resume, "urgent": scenario_urgent, "service": scenario_service}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用假的 ffmpeg 压测调度、重试、续跑和进度汇总")
+    parser.add_argument("-n", "--count", type=int, default=2000, help="模拟的任务数，默认 2000")
+    parser.add_argument("-j", "--parallel", type=int, default=8, help="并行任务数 / 工作线程数，默认 8")
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--speed", type=float, default=0, help="模拟的编码速度（素材时长倍数），0 表示不等待")
+    parser.add_argument("--duration", type=float, nargs=2, default=(5, 60), metavar=("最短", "最长"), help="模拟素材时长范围（秒）")
+    parser.add_argument("--failure", choices=fake_ffmpeg.FAILURES, help="注入的失败类型")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="编码命令失败的概率，默认 0.05")
+    parser.add_argument("--failure-match", default="", help="只让参数里含这段文字的命令失败")
+    parser.add_argument("--no-intro", action="store_true", help="不加片头片尾")
+    parser.add_argument("--no-suspend", action="store_true", help="urgent 场景模拟不能暂停进程的平台，让位的任务改为重新排队")
+    parser.add_argument("--ram-budget", type=int, default=1 << 20, metavar="MB", help="内存预算，默认放开，只测调度本身")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--show-errors", action="store_true", help="打印每个失败任务的错误")
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印引擎的全部日志")
+    args = parser.parse_args()
+
+    tool = load_tool()
+    config = fake_ffmpeg.FakeConfig(
+        speed=args.speed, failure=args.failure or "", failure_rate=args.failure_rate, failure_match=args.failure_match, seed=args.seed,
+    )
+    workdir = tempfile.mkdtemp(prefix="video_tool_load_")
+    problems = []
+    try:
+        files, intro, outro = make_inputs(workdir, args.count, args.duration, args.seed)
+        if args.no_intro:
+            intro = outro = ""
+        backend = fake_ffmpeg.FakeBackend(config)
+        template = new_engine(tool, backend, workdir, args).compile_profile(tool.EncodeProfile())
+        print(f"模拟 {args.count} 个任务，并行 {args.parallel}，编码器 {template.plan.encoder}，注入失败：{args.failure or '无'}")
+        for name, scenario in SCENARIOS.items():
+            if args.scenario not in ("all", name):
+                continue
+            print(f"\n== {name} ==")
+            commands = backend.commands
+            problems += scenario(tool, backend, template, files, intro, outro, workdir, args).problems
+            print(f"  模拟执行了 {backend.commands - commands} 条 ffmpeg/ffprobe 命令")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\n全部检查通过。" if not problems else f"\n{len(problems)} 项检查不一致。")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
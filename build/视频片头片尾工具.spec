@@ -1,7 +1,11 @@
 # -*- mode: python ; coding: utf-8 -*-
 # PyInstaller spec 文件
-# 打包模式：onefile（单文件 exe），FFmpeg 不内嵌，用户把 ffmpeg.exe/ffprobe.exe 丢同级目录即可
+# 打包模式：默认 onefile（单文件 exe），FFmpeg 不内嵌，用户把 ffmpeg.exe/ffprobe.exe 丢同级目录即可
+# 设置环境变量 VIDEO_TOOL_ONEDIR=1 改为 onedir（文件夹版）：每次启动不用先解压到临时目录，打开更快。
 
+import os
+
+ONEDIR = os.environ.get('VIDEO_TOOL_ONEDIR') == '1'
 block_cipher = None
 
 a = Analysis(
@@ -27,19 +31,12 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,      # onefile 模式：binaries 合入 exe
-    a.datas,         # onefile 模式：datas 合入 exe
-    [],
+exe_options = dict(
     name='视频片头片尾批处理工具',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
     upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
     console=False,               # 不显示命令行黑窗口
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -48,3 +45,32 @@ exe = EXE(
     entitlements_file=None,
     icon=r'C:\Users\王二狗\Documents\Codex\2026-04-25\nas\dist\NAS-TV-Organizer\_internal\assets\OIG.ico',
 )
+
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,   # onedir 模式：binaries/datas 放在 exe 旁边的文件夹里
+        **exe_options,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        name='视频片头片尾批处理工具',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,      # onefile 模式：binaries 合入 exe
+        a.datas,         # onefile 模式：datas 合入 exe
+        [],
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        **exe_options,
+    )
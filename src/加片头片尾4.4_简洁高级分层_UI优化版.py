@@ -18,25 +18,143 @@
 import os
 import re
 import sys
+import json
 import shlex
+import hashlib
+import heapq
+import itertools
+import argparse
 import shutil
 import signal
 import queue
 import tempfile
+import math
+import time
 import threading
 import subprocess
-from dataclasses import dataclass
+# 只在命令行批处理/渲染农场里用到的 concurrent.futures、http.server、urllib.request、socket
+# 放到用到的函数里再导入，图形界面启动时少加载几十毫秒。
+from dataclasses import asdict, dataclass, field, fields, replace
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+# tkinter 只在打开图形界面时由 _import_tk() 导入：命令行、--worker、--serve 不加载 Tk，
+# 没装 python3-tk 的 Linux 服务器上也能跑。
+tk = ttk = filedialog = messagebox = None
 
+try:
+    import tomllib
+except ImportError:  # Python 3.10 及以下没有 tomllib，只支持 JSON 配置
+    tomllib = None
 
-VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".flv", ".wmv", ".webm", ".m4v")
+try:
+    import psutil
+except ImportError:  # 可选：没有 psutil 时 Linux 读 /proc，Windows 不监控子进程内存
+    psutil = None
 
 
-@dataclass
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".flv", ".wmv", ".webm", ".m4v")
+PROFILE_VERSION = 1
+FIT_MODES = ("居中裁剪", "完整保留补黑边", "拉伸填满")
+CODECS = ("H.264 兼容优先", "H.265 体积更小")
+ACCEL_MODES = ("自动选择", "NVIDIA GPU", "AMD GPU", "Intel GPU", "CPU")
+RATE_MODES = ("智能动态码率", "固定码率 CBR", "平均码率 VBR", "恒定质量 CRF/CQ", "两遍编码 2-pass", "目标文件大小")
+AUDIO_MODES = ("AAC 立体声", "复制音频", "静音输出")
+TWO_PASS_MODES = ("两遍编码 2-pass", "目标文件大小")
+APP_CACHE_DIR = Path(
+    os.environ.get("VIDEO_TOOL_CACHE_DIR")
+    or Path(os.environ.get("LOCALAPPDATA") or Path.home() / ".cache") / "video_intro_outro"
+)
+# 响度统一（EBU R128）的真峰值上限和默认响度范围。
+LOUDNORM_TRUE_PEAK = -1.5
+LOUDNORM_RANGE = 11
+# x264/x265 各编码预设默认的前瞻帧数，用来估算编码器占用的内存。
+LOOKAHEAD_FRAMES = {
+    "libx264": {"速度优先": 10, "均衡": 40, "质量优先": 50},
+    "libx265": {"速度优先": 15, "均衡": 20, "质量优先": 25},
+}
+# 吞吐目标模式可切换的编码预设（从快到慢）及其大致的相对速度，某档还没实测时用来推算。
+PRESET_LADDER = ("速度优先", "均衡", "质量优先")
+PRESET_SPEED_RATIO = {"速度优先": 1.0, "均衡": 0.45, "质量优先": 0.25}
+# 导入时按内容去重：大小相同的文件先比较首尾各这么多字节的哈希，仍相同才读整个文件。
+DEDUP_PARTIAL_BYTES = 1 << 20
+# 每个输出目录下按行追加的处理记录（耗时、输出大小、画质校验结果等）。
+METRICS_FILE_NAME = "metrics.jsonl"
+# 没有历史记录时预估体积和耗时用的经验值：CRF/CQ 22 时每像素每帧大约多少比特（CRF 每加 6 码率约减半），
+# 以及 1080p30、“均衡”预设下单个任务大约几倍速。
+ESTIMATE_BITS_PER_PIXEL = {"libx264": 0.08, "libx265": 0.05, "h264": 0.1, "hevc": 0.065}
+ESTIMATE_REALTIME = {"libx264": 2.0, "libx265": 0.6, "nvenc": 8.0, "qsv": 6.0, "amf": 6.0}
+# 每个任务与时长无关的固定开销（秒）：探测、启动 FFmpeg、写封装等。
+ESTIMATE_JOB_OVERHEAD = 2.0
+# 磁盘剩余空间不够预估用量时拒绝开始；余量不到两成时只提醒（码率波动、容器开销都会让实际体积偏大）。
+ESTIMATE_SPACE_MARGIN = 1.2
+
+# 画面复杂度分级：(bpp 上限, 名称, CRF 调整, 最高码率倍数)。
+# bpp 是把采样片段缩到 320x320、15fps 后用 libx264 ultrafast CRF 23 试编码得到的每像素比特数。
+COMPLEXITY_LEVELS = [
+    (0.05, "静态", 2, 0.7),
+    (0.15, "普通", 0, 1.0),
+    (0.35, "动态", -1, 1.3),
+    (float("inf"), "高动态", -2, 1.6),
+]
+# 片头/正片/片尾之间的转场：xfade 的过渡效果名 → 界面上显示的名称。
+TRANSITIONS = {
+    "fade": "淡入淡出",
+    "fadeblack": "黑场过渡",
+    "fadewhite": "白场过渡",
+    "dissolve": "溶解",
+    "wipeleft": "向左擦除",
+    "slideleft": "向左滑动",
+    "circleopen": "圆形展开",
+}
+# 分段编码的固定关键帧间隔（秒）。片头/正片/片尾各自从关键帧开始、用封闭 GOP 编码，
+# 时间基统一为 90kHz，拼接时直接复制码流，不再整条重新编码。
+KEYFRAME_SECONDS = 2
+SEGMENT_TIMESCALE = 90000
+# 预览：每个拼接点前后各取几秒，按成品参数、“速度优先”预设渲染；按参数哈希缓存在缓存目录，最多保留这么多个。
+PREVIEW_SECONDS = 3
+PREVIEW_CACHE_LIMIT = 30
+# 封面和缩略图拼图：封面从正片约三分之一处起的若干帧里挑最有代表性的一帧；拼图按时长均匀取帧，每格宽度固定。
+THUMBNAIL_POSTER_AT = 1 / 3
+THUMBNAIL_CANDIDATES = 24
+THUMBNAIL_GRID = (4, 4)
+THUMBNAIL_TILE_WIDTH = 240
+# 批处理队列的优先级：数字大的先处理。加急的文件排到最前，各路都在忙时还会让一个普通任务暂时让位。
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = 10
+# 取消时先让 FFmpeg 的整个进程组正常退出，这么多秒还没退出就强制结束。
+TERMINATE_GRACE_SECONDS = 3
+# 系统临时目录里本程序建的目录：里面记下所属进程号，启动时清理进程已经不在的；
+# 保留临时文件时另放一个标记，不清理。没有进程号记录的（旧版本留下的）超过一天才清理。
+TEMP_DIR_PREFIXES = ("video_processor_", "concat_list_")
+TEMP_OWNER_FILE = ".owner"
+TEMP_KEEP_FILE = ".keep"
+TEMP_SWEEP_AGE = 24 * 3600
+# 成品的封装方式 → 界面上显示的名称。HLS 两种都在拼接（或一次性编码）时直接切片，不再单独打包。
+CONTAINER_MODES = {
+    "mp4": "MP4（faststart）",
+    "fmp4": "分片 MP4",
+    "hls": "HLS（TS 分片）",
+    "cmaf": "HLS/CMAF（fMP4 分片）",
+}
+# 水印位置 → overlay 的 x/y 表达式，边距取画面宽度的 1/40。
+WATERMARK_POSITIONS = {
+    "右上": ("W-w-W/40", "W/40"),
+    "左上": ("W/40", "W/40"),
+    "右下": ("W-w-W/40", "H-h-W/40"),
+    "左下": ("W/40", "H-h-W/40"),
+    "居中": ("(W-w)/2", "(H-h)/2"),
+}
+# 字幕模板里可用的占位符（见 VideoEngine._caption_text）。
+CAPTION_FIELDS = ("stem", "name", "parent", "title", "date")
+FIT_MODE_ALIASES = {
+    "裁剪": "居中裁剪", "crop": "居中裁剪",
+    "补黑边": "完整保留补黑边", "pad": "完整保留补黑边",
+    "拉伸": "拉伸填满", "stretch": "拉伸填满",
+}
+
+
+@dataclass(frozen=True)
 class EncodePlan:
     codec: str
     encoder: str
@@ -297,224 +415,4805 @@ class FFmpegErrorAnalyzer:
         return "\n".join(lines)
 
 
-class ScrollableFrame(ttk.Frame):
-    """一个可滚动的 ttk.Frame，用于小屏幕下防止按钮被挤出窗口。"""
+def parse_resolution(text):
+    parts = re.split(r"[xX*]", text.replace(" ", ""))
+    return int(parts[0]), int(parts[1])
+
+
+def _validate_resolution_text(res):
+    if not re.fullmatch(r"\d{2,5}\s*[xX*]\s*\d{2,5}", res):
+        return False, "分辨率格式不正确，请输入例如 1080x1920 或 1920x1080。"
+    w, h = parse_resolution(res)
+    if w < 64 or h < 64:
+        return False, "分辨率太小，宽高都建议不低于 64。"
+    if w % 2 != 0 or h % 2 != 0:
+        return False, "分辨率的宽和高必须是偶数，避免编码器报错。"
+    return True, "ok"
+
+
+def rendition_output_path(output_path, suffix):
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_{suffix}{ext}"
+
+
+def make_output_path(input_path, output_dir, overwrite=True, taken=(), ext=".mp4"):
+    """生成输出路径；taken 是同一批里已分配的路径，避免并行任务写到同一个文件。"""
+    stem = Path(input_path).stem
+    output_path = os.path.join(output_dir, f"processed_{stem}{ext}")
+    if (overwrite or not os.path.exists(output_path)) and output_path not in taken:
+        return output_path
+    counter = 1
+    while True:
+        candidate = os.path.join(output_dir, f"processed_{stem}_{counter}{ext}")
+        if (overwrite or not os.path.exists(candidate)) and candidate not in taken:
+            return candidate
+        counter += 1
+
+
+def thumbnail_paths(output_path):
+    """成品旁边的封面和缩略图拼图：processed_x.jpg 和 processed_x_sprite.jpg。"""
+    base = os.path.splitext(output_path)[0]
+    return f"{base}.jpg", f"{base}_sprite.jpg"
+
+
+def output_files(output_path):
+    """成品实际写出的文件：MP4 就是它本身，HLS 是播放列表加同名前缀的分片和初始化段；生成了封面和拼图时也算在内。"""
+    extras = [path for path in thumbnail_paths(output_path) if os.path.isfile(path)]
+    if not output_path.endswith(".m3u8"):
+        return [output_path] + extras
+    folder, base = os.path.split(output_path)
+    prefix = os.path.splitext(base)[0] + "_"
+    try:
+        names = sorted(
+            name for name in os.listdir(folder or ".")
+            if name.startswith(prefix) and re.fullmatch(r"(\d+\.(ts|m4s)|init\.mp4)", name[len(prefix):])
+        )
+    except OSError:
+        names = []
+    return [output_path] + [os.path.join(folder, name) for name in names] + extras
+
+
+def make_temp_dir(prefix):
+    """在系统临时目录建一个临时目录，记下当前进程号，供启动时的清理判断它是否已被遗弃。"""
+    folder = tempfile.mkdtemp(prefix=prefix)
+    Path(folder, TEMP_OWNER_FILE).write_text(str(os.getpid()), encoding="ascii")
+    return folder
+
+
+def keep_temp_dir(folder):
+    """用户要求保留的临时目录，启动清理时跳过。"""
+    try:
+        Path(folder, TEMP_KEEP_FILE).touch()
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    """进程是否还在；Windows 上没有 psutil 时判断不了，返回 None。"""
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    if os.name == "nt":
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return None
+    return True
+
+
+def sweep_orphaned_temp_dirs(log: Optional[Callable] = None, root=None):
+    """删除上次崩溃或被强制结束时遗留的临时目录，返回删除的个数。
+
+    所属进程已经不在的删除；没有进程号记录、或判断不了进程在不在的，超过 TEMP_SWEEP_AGE 才删除；
+    用户要求保留的不删。
+    """
+    log = log or _print_log
+    removed = 0
+    try:
+        entries = list(os.scandir(root or tempfile.gettempdir()))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.name.startswith(TEMP_DIR_PREFIXES):
+            continue
+        try:
+            if not entry.is_dir(follow_symlinks=False) or os.path.exists(os.path.join(entry.path, TEMP_KEEP_FILE)):
+                continue
+            try:
+                pid = int(Path(entry.path, TEMP_OWNER_FILE).read_text(encoding="ascii").strip())
+            except (OSError, ValueError):
+                pid = 0
+            alive = _pid_alive(pid) if pid > 0 else None
+            if pid == os.getpid() or alive or alive is None and time.time() - entry.stat().st_mtime < TEMP_SWEEP_AGE:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += not os.path.exists(entry.path)
+    if removed:
+        log(f"已清理上次异常退出遗留的 {removed} 个临时目录", "warning")
+    return removed
+
+
+def find_tool(name):
+    """先找程序所在目录（打包后的 exe 旁边），再找系统 PATH。"""
+    app_dir = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).resolve().parent
+    for candidate in (app_dir / f"{name}.exe", app_dir / name):
+        if candidate.is_file() and os.access(candidate, os.X_OK):
+            return str(candidate)
+    return shutil.which(name)
+
+
+def open_with_system(path):
+    """用系统默认程序打开文件或文件夹。"""
+    if os.name == "nt":
+        os.startfile(path)
+    elif os.name == "posix":
+        subprocess.Popen(["open" if sys.platform == "darwin" else "xdg-open", path])
+
+
+def default_caption_font():
+    """Windows 版 FFmpeg 的 drawtext 通常没有 fontconfig，默认用系统自带的中文字体；其他系统交给 fontconfig。"""
+    if os.name != "nt":
+        return ""
+    fonts = Path(os.environ.get("WINDIR", "C:/Windows")) / "Fonts"
+    return next((str(fonts / name) for name in ("msyh.ttc", "simhei.ttf", "simsun.ttc") if (fonts / name).is_file()), "")
+
+
+def collect_video_files(paths):
+    """展开文件/文件夹参数，返回去重后的视频文件列表（保持输入顺序）。"""
+    result = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = []
+            for root, _, files in os.walk(path):
+                for filename in files:
+                    if filename.lower().endswith(VIDEO_EXTENSIONS):
+                        candidates.append(os.path.join(root, filename))
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            candidate = os.path.normpath(candidate)
+            if candidate in seen or not os.path.isfile(candidate):
+                continue
+            if not candidate.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            seen.add(candidate)
+            result.append(candidate)
+    return result
+
+
+def _file_digest(path, partial=False):
+    """文件内容的哈希；partial 只读开头和结尾各 DEDUP_PARTIAL_BYTES 字节。"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        if partial:
+            digest.update(f.read(DEDUP_PARTIAL_BYTES))
+            if os.fstat(f.fileno()).st_size > 2 * DEDUP_PARTIAL_BYTES:
+                f.seek(-DEDUP_PARTIAL_BYTES, os.SEEK_END)
+                digest.update(f.read(DEDUP_PARTIAL_BYTES))
+        else:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicates(paths, index=None):
+    """找出内容完全相同的文件，返回重复组列表；每组按输入顺序排列，第一个是要编码的那份。
+
+    先按大小分组，大小相同才算首尾的部分哈希，部分哈希也相同才读整个文件。
+    index 是 ProbeIndex 时缓存整文件哈希，同一批文件再次导入不用重读。
+    """
+    def full_digest(path):
+        cached = index.get(path, "content_hash") if index is not None else None
+        if cached:
+            return cached
+        value = _file_digest(path)
+        if index is not None:
+            index.put(path, "content_hash", value)
+        return value
+
+    unique = list(dict.fromkeys(paths))
+    by_size = {}
+    for path in unique:
+        try:
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError:
+            continue
+    groups = []
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        # 不超过两段部分读取长度的小文件，部分哈希就等于整文件哈希，直接算整文件的。
+        small = size <= 2 * DEDUP_PARTIAL_BYTES
+        buckets = {}
+        for path in same_size:
+            try:
+                buckets.setdefault(full_digest(path) if small else _file_digest(path, partial=True), []).append(path)
+            except OSError:
+                continue
+        for candidates in buckets.values():
+            if len(candidates) < 2:
+                continue
+            if small:
+                groups.append(candidates)
+                continue
+            confirmed = {}
+            for path in candidates:
+                try:
+                    confirmed.setdefault(full_digest(path), []).append(path)
+                except OSError:
+                    continue
+            groups.extend(group for group in confirmed.values() if len(group) > 1)
+    order = {path: i for i, path in enumerate(unique)}
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def _link_or_copy(source, target):
+    """硬链接成品；跨盘或文件系统不支持硬链接时退回复制。"""
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _parse_encode_stats(lines):
+    """从 FFmpeg 输出的最后统计里取视频字节数和帧数，例如 `video:127KiB` 与 `frame=  90`。"""
+    size_bytes = frames = 0
+    units = {"kib": 1024, "kb": 1024, "mib": 1024 * 1024, "mb": 1024 * 1024}
+    for line in lines:
+        m = re.search(r"video:\s*([\d.]+)\s*(KiB|kB|MiB|mB)", line)
+        if m:
+            size_bytes = int(float(m.group(1)) * units[m.group(2).lower()])
+        m = re.search(r"frame=\s*(\d+)", line)
+        if m:
+            frames = int(m.group(1))
+    return size_bytes, frames
+
+
+def _parse_progress(line):
+    """解析 FFmpeg 进度行里的 `time=00:01:02.50 ... speed=2.3x`，返回 (已处理的素材秒数, 速度倍数)。"""
+    m = re.search(r"time=\s*(\d+):(\d+):([\d.]+).*speed=\s*([\d.]+)x", line)
+    if not m:
+        return None
+    hours, minutes, seconds, speed = m.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds), float(speed)
+
+
+def parse_deadline(text, now=None):
+    """把“18:30”（今天这个时刻，已经过了就算明天）或“90m”“2h”这样的时长换算成截止时间戳。"""
+    now = time.time() if now is None else now
+    text = text.strip().lower()
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smh])", text)
+    if m:
+        return now + float(m.group(1)) * {"s": 1, "m": 60, "h": 3600}[m.group(2)]
+    m = re.fullmatch(r"(\d{1,2})[:：](\d{2})", text)
+    if not m or int(m.group(1)) > 23 or int(m.group(2)) > 59:
+        raise ValueError(f"完成时间格式不正确：{text}，请填 18:30 这样的时刻，或 90m、2h 这样的时长。")
+    local = time.localtime(now)
+    deadline = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, int(m.group(1)), int(m.group(2)), 0, 0, 0, -1))
+    return deadline if deadline > now else deadline + 86400
+
+
+def _filter_path(path):
+    """把文件路径写进滤镜参数：先按选项值转义冒号/引号，再按滤镜图转义逗号、方括号等。
+    Windows 盘符的冒号、路径里的空格和中文都能原样传给 movie/drawtext。"""
+    value = str(path).replace("\\", "/")
+    for special in ("\\':", "\\'[],;"):
+        value = "".join("\\" + c if c in special else c for c in value)
+    return value
+
+
+def _print_log(message, tag="info"):
+    sys.stdout.write(f"[{tag}] {message}\n")  # 单次写入，并行任务的日志不会串行
+    sys.stdout.flush()
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    duration: float
+    width: int
+    height: int
+    fps: float
+    video_codec: str
+    has_audio: bool
+    audio_codec: str = ""
+    sample_rate: int = 0
+    channels: int = 0
+    audio_profile: str = ""
+    title: str = ""
+    video_duration: float = 0.0
+    audio_duration: float = 0.0
+
+
+@dataclass(frozen=True)
+class AudioPlan:
+    """单个片段预处理时的音频做法，由探测到的音轨信息决定。
+
+    copy：已经是 AAC-LC 48kHz 立体声、且和画面一样长，直接复制；encode：转成 AAC，filter 非空时先过滤镜
+    （重采样、响度统一）；silence：源没有音轨，生成等长静音。duration 是该片段画面的时长，
+    转码和静音都按它补齐/截断音频，拼接时各段音画同时结束。
+    """
+
+    action: str
+    duration: float = 0.0
+    filter: str = ""
+
+
+def _coerce_field(f, value):
+    if f.type is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on", "开启", "是")
+        return bool(value)
+    return str(value)
+
+
+def _parse_probe_json(data) -> Optional[MediaInfo]:
+    streams = data.get("streams") or []
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    if video is None:
+        return None
+    try:
+        num, _, den = str(video.get("avg_frame_rate") or video.get("r_frame_rate") or "0/1").partition("/")
+        fps = float(num) / float(den or 1) if float(den or 1) else 0.0
+    except ValueError:
+        fps = 0.0
+    try:
+        duration = float((data.get("format") or {}).get("duration") or video.get("duration") or 0)
+    except ValueError:
+        duration = 0.0
+
+    def stream_duration(stream):
+        try:
+            return float((stream or {}).get("duration") or 0)
+        except ValueError:
+            return 0.0
+
+    return MediaInfo(
+        duration=duration,
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        fps=fps,
+        video_codec=video.get("codec_name", ""),
+        has_audio=audio is not None,
+        audio_codec=(audio or {}).get("codec_name", ""),
+        sample_rate=int((audio or {}).get("sample_rate") or 0),
+        channels=int((audio or {}).get("channels") or 0),
+        audio_profile=(audio or {}).get("profile", ""),
+        title=next((value for key, value in ((data.get("format") or {}).get("tags") or {}).items() if key.lower() == "title"), ""),
+        video_duration=stream_duration(video),
+        audio_duration=stream_duration(audio),
+    )
+
+
+@dataclass(frozen=True)
+class OverlaySpec:
+    """一个文件的叠加层：预先缩放好的水印图片、套好模板的字幕文本文件，接在画面滤镜后面，
+    和正片在同一次编码里完成。"""
+
+    image: str = ""
+    position: str = "右上"
+    textfile: str = ""
+    font: str = ""
+
+    def apply(self, video_filter, tag="0"):
+        """把叠加层接到 video_filter 后面。水印需要第二路输入，用 movie 读入并带上 tag 区分标签，
+        同一个滤镜图里多次使用时标签不会冲突。"""
+        chain = video_filter
+        if self.image:
+            x, y = WATERMARK_POSITIONS.get(self.position, WATERMARK_POSITIONS["右上"])
+            chain = (
+                f"{chain}[ovbase{tag}];movie={_filter_path(self.image)},format=rgba[ovmark{tag}];"
+                f"[ovbase{tag}][ovmark{tag}]overlay=x={x}:y={y},format=yuv420p"
+            )
+        if self.textfile:
+            font = f":fontfile={_filter_path(self.font)}" if self.font else ""
+            chain += (
+                f",drawtext=textfile={_filter_path(self.textfile)}{font}:fontsize=h/24:fontcolor=white"
+                ":expansion=none:box=1:boxcolor=black@0.45:boxborderw=12:x=(w-text_w)/2:y=h-text_h-h/12"
+            )
+        return chain
 
-    def __init__(self, parent, height=None):
-        super().__init__(parent)
-        self.canvas = tk.Canvas(self, highlightthickness=0, borderwidth=0)
-        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas.yview)
-        self.inner = ttk.Frame(self.canvas)
-        self.window_id = self.canvas.create_window((0, 0), window=self.inner, anchor="nw")
 
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        if height:
-            self.canvas.configure(height=height)
+@dataclass(frozen=True)
+class Rendition:
+    """多规格输出中的一档：分辨率/适配方式/码率，码率留空则沿用配置里的值。"""
 
-        self.inner.bind("<Configure>", self._on_inner_configure)
-        self.canvas.bind("<Configure>", self._on_canvas_configure)
-        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel_windows)
-        self.canvas.bind_all("<Button-4>", self._on_mousewheel_linux)
-        self.canvas.bind_all("<Button-5>", self._on_mousewheel_linux)
+    resolution: str
+    fit_mode: str = "居中裁剪"
+    bitrate: str = ""
+    maxrate: str = ""
+    crf_cq: str = ""
+    suffix: str = ""
 
-    def _on_inner_configure(self, _event=None):
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+    @property
+    def output_suffix(self):
+        return self.suffix or self.resolution.replace(" ", "")
 
-    def _on_canvas_configure(self, event):
-        self.canvas.itemconfigure(self.window_id, width=event.width)
+    @classmethod
+    def from_dict(cls, data) -> "Rendition":
+        if not isinstance(data, dict) or not data.get("resolution"):
+            raise ValueError("多规格输出的每一档都必须填写 resolution。")
+        known = {f.name for f in fields(cls)}
+        values = {key: str(value) for key, value in data.items() if key in known}
+        values["fit_mode"] = FIT_MODE_ALIASES.get(values.get("fit_mode", ""), values.get("fit_mode", "居中裁剪"))
+        return cls(**values)
 
-    def _on_mousewheel_windows(self, event):
-        # 只在鼠标位于该控件内时滚动，避免影响 Treeview / Text。
-        widget = self.winfo_containing(event.x_root, event.y_root)
-        if widget and str(widget).startswith(str(self)):
-            self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+    @classmethod
+    def parse_spec(cls, text) -> List["Rendition"]:
+        """解析界面上的简写：`分辨率[:适配方式[:码率[:最高码率]]]`，多档用分号隔开。"""
+        rungs = []
+        for chunk in re.split(r"[;；\n]", text or ""):
+            parts = [part.strip() for part in chunk.strip().split(":")]
+            if not parts[0]:
+                continue
+            parts += [""] * (4 - len(parts))
+            fit = FIT_MODE_ALIASES.get(parts[1], parts[1]) or "居中裁剪"
+            rungs.append(cls(resolution=parts[0], fit_mode=fit, bitrate=parts[2], maxrate=parts[3]))
+        return rungs
+
+    @staticmethod
+    def format_spec(rungs) -> str:
+        items = []
+        for rung in rungs:
+            parts = [rung.resolution, rung.fit_mode, rung.bitrate, rung.maxrate]
+            while parts[-1] == "":
+                parts.pop()
+            items.append(":".join(parts))
+        return "; ".join(items)
 
-    def _on_mousewheel_linux(self, event):
-        widget = self.winfo_containing(event.x_root, event.y_root)
-        if not (widget and str(widget).startswith(str(self))):
-            return
-        if event.num == 4:
-            self.canvas.yview_scroll(-1, "units")
-        elif event.num == 5:
-            self.canvas.yview_scroll(1, "units")
 
+@dataclass
+class EncodeProfile:
+    """可保存、可分享的处理配置。
+
+    字段保存的是已经换算好的最终参数（小白模式的画质档位也会展开成具体码率），
+    所以同一份配置文件在 GUI 和命令行里得到的 FFmpeg 命令完全一致。
+    """
+
+    name: str = "默认配置"
+    resolution: str = "1080x1920"
+    fit_mode: str = "居中裁剪"
+    framerate: str = "30"
+    codec: str = "H.264 兼容优先"
+    accel: str = "自动选择"
+    rate_mode: str = "智能动态码率"
+    bitrate: str = "6000"
+    maxrate: str = "9000"
+    crf_cq: str = "22"
+    preset: str = "均衡"
+    audio_mode: str = "AAC 立体声"
+    audio_bitrate: str = "192"
+    extra_args: str = ""
+    target_size_mb: str = ""
+    scene_analysis: bool = False
+    loudnorm: bool = False
+    loudness_target: str = "-16"
+    verify_quality: bool = False
+    min_ssim: str = "0.95"
+    min_vmaf: str = "85"
+    transition: str = ""
+    transition_duration: str = "0.5"
+    watermark: str = ""
+    watermark_position: str = "右上"
+    watermark_scale: str = "0.15"
+    caption: str = ""
+    caption_font: str = ""
+    container: str = "mp4"
+    segment_seconds: str = "6"
+    thumbnails: bool = False
+    renditions: List[Rendition] = field(default_factory=list)
+    version: int = PROFILE_VERSION
+
+    FILE_TYPES = [("配置文件", "*.json *.toml"), ("所有文件", "*.*")]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
 
-class VideoProcessorApp:
-    def __init__(self, master):
-        self.master = master
-        self.master.title("专业视频片头片尾批处理工具 v4.4")
-        self.master.geometry("1180x760")
-        self.master.minsize(980, 640)
+    @classmethod
+    def from_dict(cls, data) -> "EncodeProfile":
+        if not isinstance(data, dict):
+            raise ValueError("配置文件内容必须是键值表。")
+        try:
+            version = int(data.get("version", PROFILE_VERSION))
+        except (TypeError, ValueError):
+            raise ValueError("配置文件的 version 必须是整数。")
+        if version > PROFILE_VERSION:
+            raise ValueError(f"配置文件版本 {version} 比本程序支持的版本 {PROFILE_VERSION} 新，请升级本工具。")
+        # 旧版本缺少的字段直接用默认值补齐，未知字段忽略，保证配置文件向前兼容。
+        known = {f.name: f for f in fields(cls) if f.name not in ("version", "renditions")}
+        values = {key: _coerce_field(known[key], value) for key, value in data.items() if key in known}
+        rungs = data.get("renditions") or []
+        if isinstance(rungs, str):
+            rungs = Rendition.parse_spec(rungs)
+        elif isinstance(rungs, list):
+            rungs = [Rendition.from_dict(item) for item in rungs]
+        else:
+            raise ValueError("renditions 必须是列表。")
+        return cls(renditions=rungs, **values)
 
-        self.file_list = []
-        self.processing_thread = None
-        self.stop_event = threading.Event()
-        self.log_queue = queue.Queue()
-        self.ui_queue = queue.Queue()
-        self.current_process = None
+    @classmethod
+    def load(cls, path) -> "EncodeProfile":
+        suffix = Path(path).suffix.lower()
+        try:
+            if suffix == ".toml":
+                if tomllib is None:
+                    raise ValueError("当前 Python 版本不支持 TOML，请改用 JSON 配置或升级到 Python 3.11+。")
+                with open(path, "rb") as f:
+                    data = tomllib.load(f)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+        except (OSError, ValueError) as exc:
+            raise ValueError(f"读取配置文件失败：{exc}") from exc
+        if isinstance(data, dict):
+            data.setdefault("name", Path(path).stem)
+        return cls.from_dict(data)
+
+    def save(self, path):
+        data = self.to_dict()
+        if Path(path).suffix.lower() == ".toml":
+            # 字段都是字符串/整数，JSON 的转义写法同样是合法的 TOML 基本字符串。
+            rungs = data.pop("renditions")
+            text = "".join(f"{key} = {json.dumps(value, ensure_ascii=False)}\n" for key, value in data.items())
+            for rung in rungs:
+                text += "\n[[renditions]]\n"
+                text += "".join(f"{key} = {json.dumps(value, ensure_ascii=False)}\n" for key, value in rung.items() if value)
+        else:
+            text = json.dumps(data, ensure_ascii=False, indent=2) + "\n"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def validate(self):
+        # 配置文件是手写或别人给的，取值不在选项里时直接报错，不悄悄换成默认值。
+        for label, value, choices in (
+            ("适配方式", self.fit_mode, FIT_MODES),
+            ("视频编码", self.codec, CODECS),
+            ("硬件加速", self.accel, ACCEL_MODES),
+            ("码率模式", self.rate_mode, RATE_MODES),
+            ("编码预设", self.preset, PRESET_LADDER),
+            ("音频处理", self.audio_mode, AUDIO_MODES),
+        ):
+            if value not in choices:
+                return False, f"{label}“{value}”无效，只能是 {' / '.join(choices)}。"
+
+        res = self.resolution.strip()
+        if res in ("跟随原视频", "自定义输入"):
+            if res == "自定义输入":
+                return False, "分辨率不能保留为“自定义输入”，请直接输入例如 1080x1920。"
+        else:
+            ok, msg = _validate_resolution_text(res)
+            if not ok:
+                return False, msg
 
-        self.ffmpeg_path = shutil.which("ffmpeg")
-        self.ffprobe_path = shutil.which("ffprobe")
+        for rung in self.renditions:
+            ok, msg = _validate_resolution_text(rung.resolution.strip())
+            if not ok:
+                return False, f"多规格输出 {rung.resolution}：{msg}"
+            if rung.fit_mode not in FIT_MODES:
+                return False, f"多规格输出 {rung.resolution}：适配方式只能是 {' / '.join(FIT_MODES)}。"
+            for value in (rung.bitrate, rung.maxrate, rung.crf_cq):
+                if value and not value.strip().isdigit():
+                    return False, f"多规格输出 {rung.resolution}：码率和 CRF 必须是数字。"
+        if self.renditions and self.rate_mode in TWO_PASS_MODES:
+            # 多规格输出一条命令编码所有档，没有第一遍分析，目标大小也没法分摊到各档，不能悄悄退回单遍编码。
+            return False, f"多规格输出不支持“{self.rate_mode}”，请改用平均码率 VBR、固定码率 CBR 或智能动态码率，并在各档填写码率。"
+        suffixes = [rung.output_suffix for rung in self.renditions]
+        if len(set(suffixes)) != len(suffixes):
+            return False, "多规格输出里有重复的分辨率/后缀，输出文件会互相覆盖。"
+
+        fps = self.framerate.strip()
+        if fps != "跟随原视频":
+            try:
+                val = float(fps)
+            except ValueError:
+                return False, "帧率必须是数字，例如 30，也可以选择“跟随原视频”。"
+            if val <= 0 or val > 240:
+                return False, "帧率范围建议在 1 到 240 之间。"
 
-        self._build_variables()
-        self._setup_styles()
-        self._build_ui()
-        self._bind_events()
-        self._refresh_mode_ui()
-        self._refresh_resolution_presets()
-        self.master.after(100, self._process_queues)
+        for label, value, min_val, max_val in [
+            ("目标码率", self.bitrate, 300, 200000),
+            ("最高码率", self.maxrate, 300, 300000),
+            ("音频码率", self.audio_bitrate, 32, 1024),
+        ]:
+            if self.rate_mode in ("恒定质量 CRF/CQ", "目标文件大小") and label in ("目标码率", "最高码率"):
+                continue
+            try:
+                intval = int(str(value).strip())
+            except ValueError:
+                return False, f"{label}必须是数字。"
+            if not (min_val <= intval <= max_val):
+                return False, f"{label}建议在 {min_val} 到 {max_val} 之间。"
 
-        if not self.ffmpeg_path:
-            self._show_ffmpeg_warning()
-        else:
-            self.log(f"检测到 FFmpeg：{self.ffmpeg_path}", "success")
+        if self.rate_mode == "目标文件大小":
+            try:
+                size = float(str(self.target_size_mb).strip())
+            except ValueError:
+                return False, "目标文件大小必须是数字（单位 MB）。"
+            if not (1 <= size <= 100000):
+                return False, "目标文件大小建议在 1 到 100000 MB 之间。"
 
-    # ------------------------------------------------------------------
-    # UI 初始化
-    # ------------------------------------------------------------------
-    def _build_variables(self):
-        self.mode_var = tk.StringVar(value="小白推荐")
-        self.process_type_var = tk.StringVar(value="同时添加")
-        self.aspect_var = tk.StringVar(value="9:16 竖屏")
-        self.resolution_var = tk.StringVar(value="1080x1920")
-        self.fit_mode_var = tk.StringVar(value="居中裁剪")
-        self.framerate_var = tk.StringVar(value="30")
-        self.quality_preset_var = tk.StringVar(value="高清推荐")
+        if self.loudnorm:
+            try:
+                target = float(str(self.loudness_target).strip())
+            except ValueError:
+                return False, "目标响度必须是数字，例如 -16（单位 LUFS）。"
+            if not (-70 <= target <= -5):
+                return False, "目标响度建议在 -70 到 -5 LUFS 之间，短视频平台常用 -14 到 -16。"
 
-        self.accel_var = tk.StringVar(value="自动选择")
-        self.codec_var = tk.StringVar(value="H.264 兼容优先")
-        self.rate_mode_var = tk.StringVar(value="智能动态码率")
-        self.bitrate_var = tk.StringVar(value="6000")
-        self.maxrate_var = tk.StringVar(value="9000")
-        self.crf_cq_var = tk.StringVar(value="22")
-        self.encoder_preset_var = tk.StringVar(value="均衡")
-        self.audio_bitrate_var = tk.StringVar(value="192")
-        self.audio_mode_var = tk.StringVar(value="AAC 立体声")
-        self.extra_args_var = tk.StringVar(value="")
-        self.log_expanded_var = tk.BooleanVar(value=False)
-        self.overwrite_var = tk.BooleanVar(value=True)
-        self.keep_temp_var = tk.BooleanVar(value=False)
+        if self.transition:
+            if self.transition not in TRANSITIONS:
+                return False, f"转场效果只能是 {' / '.join(TRANSITIONS)}，留空表示直接拼接。"
+            try:
+                seconds = float(str(self.transition_duration).strip())
+            except ValueError:
+                return False, "转场时长必须是数字（单位秒），例如 0.5。"
+            if not (0.1 <= seconds <= 5):
+                return False, "转场时长建议在 0.1 到 5 秒之间。"
+
+        if self.container not in CONTAINER_MODES:
+            return False, f"输出格式只能是 {' / '.join(CONTAINER_MODES)}。"
+        if self.container != "mp4":
+            try:
+                seconds = float(str(self.segment_seconds).strip())
+            except ValueError:
+                return False, "分片时长必须是数字（单位秒），例如 6。"
+            if not (1 <= seconds <= 60):
+                return False, "分片时长建议在 1 到 60 秒之间，HLS 常用 2 到 6 秒。"
+
+        if self.watermark:
+            if not os.path.isfile(self.watermark):
+                return False, f"水印图片不存在：{self.watermark}"
+            if self.watermark_position not in WATERMARK_POSITIONS:
+                return False, f"水印位置只能是 {' / '.join(WATERMARK_POSITIONS)}。"
+            try:
+                scale = float(str(self.watermark_scale).strip())
+            except ValueError:
+                return False, "水印大小必须是数字，表示占画面宽度的比例，例如 0.15。"
+            if not (0.01 <= scale <= 1):
+                return False, "水印大小建议在 0.01 到 1 之间（占画面宽度的比例）。"
+        if self.caption:
+            unknown = set(re.findall(r"\{(\w+)\}", self.caption)) - set(CAPTION_FIELDS)
+            if unknown:
+                names = "、".join("{" + name + "}" for name in sorted(unknown))
+                usable = "、".join("{" + name + "}" for name in CAPTION_FIELDS)
+                return False, f"字幕模板里的 {names} 无法识别，可用：{usable}。"
+            if self.caption_font and not os.path.isfile(self.caption_font):
+                return False, f"字幕字体文件不存在：{self.caption_font}"
+
+        if self.verify_quality:
+            for label, value, max_val in (("SSIM 下限", self.min_ssim, 1), ("VMAF 下限", self.min_vmaf, 100)):
+                if not str(value).strip():
+                    continue
+                try:
+                    bound = float(str(value).strip())
+                except ValueError:
+                    return False, f"{label}必须是数字，留空表示不检查。"
+                if not (0 <= bound <= max_val):
+                    return False, f"{label}应在 0 到 {max_val} 之间。"
 
-    def _setup_styles(self):
-        style = ttk.Style()
         try:
-            style.theme_use("clam")
-        except tk.TclError:
-            pass
+            q = int(str(self.crf_cq).strip())
+        except ValueError:
+            return False, "CRF/CQ 必须是数字。"
+        if not (0 <= q <= 51):
+            return False, "CRF/CQ 建议在 0 到 51 之间，数字越小质量越高、文件越大。"
+        return True, "ok"
 
-        style.configure("TFrame", background="#f4f6f8")
-        style.configure("Card.TFrame", background="#ffffff", relief="flat")
-        style.configure("TLabel", background="#f4f6f8", font=("微软雅黑", 9))
-        style.configure("Card.TLabel", background="#ffffff", font=("微软雅黑", 9))
-        style.configure("Hint.TLabel", background="#ffffff", foreground="#64748b", font=("微软雅黑", 8))
-        style.configure("Title.TLabel", background="#f4f6f8", font=("微软雅黑", 15, "bold"), foreground="#0f172a")
-        style.configure("Section.TLabel", background="#ffffff", font=("微软雅黑", 10, "bold"), foreground="#1e293b")
-        style.configure("TButton", font=("微软雅黑", 9), padding=(8, 4))
-        style.configure("Primary.TButton", font=("微软雅黑", 10, "bold"), padding=(12, 7))
-        style.configure("Danger.TButton", foreground="#b91c1c", font=("微软雅黑", 10, "bold"), padding=(12, 7))
-        style.configure("Small.TButton", font=("微软雅黑", 8), padding=(6, 2))
-        style.configure("TCheckbutton", background="#ffffff", font=("微软雅黑", 9))
-        style.configure("TRadiobutton", background="#ffffff", font=("微软雅黑", 9))
-        style.configure("TLabelframe", background="#ffffff")
-        style.configure("TLabelframe.Label", font=("微软雅黑", 10, "bold"), foreground="#334155")
 
-    def _build_ui(self):
-        root = ttk.Frame(self.master, padding=10)
-        root.pack(fill=tk.BOTH, expand=True)
+class ProbeIndex:
+    """持久化的探测索引：按（路径, 大小, 修改时间）缓存 ffprobe 结果和各类分析结果。
 
-        self._build_header(root)
+    每个文件一条记录，记录里按用途分区（probe / complexity 等），重复运行时直接命中，
+    文件被修改后大小或修改时间变化，旧记录自然失效。
+    """
 
-        body = ttk.PanedWindow(root, orient=tk.HORIZONTAL)
-        body.pack(fill=tk.BOTH, expand=True, pady=(8, 6))
+    MAX_ENTRIES = 50000
 
-        left = ttk.Frame(body)
-        right = ttk.Frame(body)
-        body.add(left, weight=3)
-        body.add(right, weight=2)
+    def __init__(self, path=None):
+        self.path = Path(path) if path else APP_CACHE_DIR / "probe_index.json"
+        self._lock = threading.Lock()
+        self._entries = None
+        self._dirty = set()
 
-        self._build_file_panel(left)
-        self._build_settings_panel(right)
-        self._build_bottom_bar(root)
-        self._build_log_panel(root)
+    def _loaded(self):
+        # 索引可能有几万条，第一次用到时才读盘，不拖慢启动。调用方持有 self._lock。
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f).get("entries", {})
+            except (OSError, ValueError, AttributeError):
+                self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def _key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def get(self, path, section):
+        key = self._key(path)
+        if key is None:
+            return None
+        with self._lock:
+            return (self._loaded().get(key) or {}).get(section)
+
+    def put(self, path, section, value):
+        key = self._key(path)
+        if key is None:
+            return
+        with self._lock:
+            entry = self._loaded().setdefault(key, {})
+            entry[section] = value
+            entry["t"] = time.time()
+            self._dirty.add(key)
+
+    def save(self):
+        """写回磁盘。先合并磁盘上的最新内容，多个进程共用同一个索引时不会互相覆盖。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    merged = json.load(f).get("entries", {})
+            except (OSError, ValueError, AttributeError):
+                merged = {}
+            for key in self._dirty:
+                merged[key] = {**merged.get(key, {}), **self._entries[key]}
+            if len(merged) > self.MAX_ENTRIES:
+                newest = sorted(merged.items(), key=lambda item: item[1].get("t", 0), reverse=True)
+                merged = dict(newest[: self.MAX_ENTRIES])
+            self._entries = merged
+            self._dirty.clear()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": 1, "entries": merged}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
 
-    def _build_header(self, parent):
-        header = ttk.Frame(parent)
-        header.pack(fill=tk.X)
 
-        ttk.Label(header, text="视频片头片尾批处理", style="Title.TLabel").pack(side=tk.LEFT)
+@dataclass(frozen=True)
+class CompiledRendition:
+    suffix: str
+    video_filter: str
+    output_args: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class CommandTemplate:
+    """配置编译后的不可变命令模板。
+
+    每批只编译一次，每个任务只往里填输入/输出路径；key 是参数的哈希，
+    同时用作片头片尾预处理结果等缓存的键。
+    """
+
+    profile: EncodeProfile
+    plan: EncodePlan
+    preprocess_args: Tuple[str, ...]
+    key: str
+    renditions: Tuple[CompiledRendition, ...] = ()
+    pass1_args: Tuple[str, ...] = ()
+    audio_args: Tuple[str, ...] = ()
+    resample_filter: str = "aresample=48000"
+    graph_args: Tuple[str, ...] = ()
+    # 固定输出帧率的选项名：FFmpeg 5.1 起是 -fps_mode，-vsync 已弃用（每条命令都会打印警告），老版本只认 -vsync。
+    fps_mode_option: str = "-fps_mode"
+
+    @property
+    def two_pass(self):
+        return bool(self.pass1_args)
+
+    @property
+    def output_ext(self):
+        return ".m3u8" if self.profile.container in ("hls", "cmaf") else ".mp4"
+
+    def container_args(self, output_path) -> List[str]:
+        """成品的封装参数，接在编码参数（或拼接时的复制参数）之后。编码时已按固定间隔插入关键帧，
+        分片边界和 GOP 对齐；HLS 的分片文件和播放列表同名前缀、放在同一目录。"""
+        container = self.profile.container
+        if container == "mp4":
+            return ["-movflags", "+faststart"]
+        seconds = str(self.profile.segment_seconds).strip()
+        args = []
+        if container == "fmp4":
+            # 边编码边写分片，不需要 faststart 结束时再整体搬一遍 moov。
+            # delay_moov 等第一个分片编好再写 moov，编辑列表能抵消 B 帧延迟，音画起点一致。
+            return args + ["-movflags", "+frag_keyframe+empty_moov+delay_moov+default_base_moof"]
+        base = os.path.splitext(output_path)[0]
+        args += ["-f", "hls", "-hls_time", seconds, "-hls_playlist_type", "vod", "-hls_flags", "independent_segments"]
+        if container == "cmaf":
+            return args + [
+                "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", f"{os.path.basename(base)}_init.mp4",
+                "-hls_segment_filename", f"{base}_%05d.m4s",
+            ]
+        return args + ["-hls_segment_filename", f"{base}_%05d.ts"]
+
+    def pass_args(self, pass_no, stats_name) -> List[str]:
+        """两遍编码的 pass 参数。统计文件用相对路径，由调用方把工作目录设到存放统计文件的目录。"""
+        # 第一遍输出到 null 时默认不补帧，两遍的帧数会对不上，统一固定为 CFR。
+        args = [self.fps_mode_option, "cfr"]
+        if self.plan.encoder == "libx265":
+            # libx265 不认 -pass/-passlogfile，只能走 x265-params；Windows 盘符里的冒号会破坏参数解析，所以用相对路径。
+            params = f"pass={pass_no}:stats={stats_name}"
+            if pass_no == 1:
+                params += ":slow-firstpass=0"
+            return args + ["-x265-params", params]
+        # libx264 的 fastfirstpass 默认开启，第一遍会自动降为快速分析。
+        return args + ["-pass", str(pass_no), "-passlogfile", stats_name]
+
+    @staticmethod
+    def thumbnail_graph(out_label, output_path, duration):
+        """封面和缩略图拼图分支，接在画面滤镜链末尾，和编码共用已经解码、规整好的帧。
+
+        返回 (替换原输出标签的 split、两路滤镜、两路的输出参数)；duration 是这段画面的时长。
+        """
+        poster_path, sheet_path = thumbnail_paths(output_path)
+        columns, rows = THUMBNAIL_GRID
+        interval = max(duration, 0.1) / (columns * rows)
+        graph = [
+            f"[thposter]select=gte(t\\,{duration * THUMBNAIL_POSTER_AT:.3f}),thumbnail=n={THUMBNAIL_CANDIDATES}[poster]",
+            f"[thsheet]select=isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f}),"
+            f"scale={THUMBNAIL_TILE_WIDTH}:-2,tile={columns}x{rows}[sheet]",
+        ]
+        args = [
+            "-map", "[poster]", "-frames:v", "1", "-update", "1", "-q:v", "2", poster_path,
+            "-map", "[sheet]", "-frames:v", "1", "-update", "1", "-q:v", "3", sheet_path,
+        ]
+        return f"split=3{out_label}[thposter][thsheet]", graph, args
+
+    def preprocess_command(
+        self, ffmpeg_path, input_path, output_path, audio: Optional[AudioPlan] = None, video_filter="", pass_no=0, stats_name="",
+        thumbnails: Optional[Tuple[str, float]] = None,
+    ) -> List[str]:
+        """分段编码命令，编码参数就是成品的参数，拼接时不再转码。
+
+        video_filter 非空时替换模板里的画面滤镜（正片叠加水印/字幕时使用）；pass_no=1/2 是两遍编码的第一遍/第二遍；
+        thumbnails 是 (成品路径, 画面时长)，给出时同一条命令顺带在成品旁边写出封面和缩略图拼图。
+        """
+        cmd = [ffmpeg_path, "-hide_banner", "-y", "-i", input_path]
+        preprocess_args = list(self.preprocess_args)
+        if video_filter and "-vf" in preprocess_args:
+            preprocess_args[preprocess_args.index("-vf") + 1] = video_filter
+        if pass_no == 1:
+            return cmd + [*preprocess_args, *self.pass_args(1, stats_name), "-an", "-f", "null", os.devnull]
+        if pass_no == 2:
+            preprocess_args += self.pass_args(2, stats_name)
+        video_map, extra_outputs = [], []
+        if thumbnails and "-vf" in preprocess_args:
+            index = preprocess_args.index("-vf")
+            chain = preprocess_args[index + 1]
+            del preprocess_args[index:index + 2]
+            split, graph, extra_outputs = self.thumbnail_graph("[vmain]", *thumbnails)
+            preprocess_args = ["-filter_complex", ";".join([f"[0:v]{chain},{split}", *graph]), *preprocess_args]
+            video_map = ["-map", "[vmain]"]
+        audio_map = [*video_map, "-map", "0:a:0?"] if video_map else []
+        action = audio.action if audio else "encode"
+        # 音频补静音再截到画面时长：各段音画同时结束，复制拼接时后一段的音频不会被前一段推后。
+        pad = f"apad=whole_dur={audio.duration:.6f},atrim=end={audio.duration:.6f}" if audio and audio.duration > 0 else ""
+        if self.profile.audio_mode == "静音输出":
+            audio_args = [*video_map, "-an"]
+        elif action == "copy":
+            audio_args = [*audio_map, "-c:a", "copy"]
+        elif action == "silence":
+            # 静音长度和片段时长一致，拼接时音画不会逐段错位。
+            cmd += ["-f", "lavfi", "-t", f"{audio.duration:.3f}", "-i", "anullsrc=r=48000:cl=stereo"]
+            audio_args = ["-map", video_map[1] if video_map else "0:v:0", "-map", "1:a:0", *self.audio_args]
+        else:
+            audio_filter = ",".join(item for item in (audio.filter if audio else "", pad) if item)
+            audio_args = audio_map + (["-af", audio_filter] if audio_filter else []) + list(self.audio_args)
+        return cmd + [*preprocess_args, *audio_args, output_path, *extra_outputs]
+
+    def concat_command(self, ffmpeg_path, list_file, output_path, overwrite=True) -> List[str]:
+        """各段编码参数、关键帧间隔和时间基一致，拼接只复制码流、写封装。"""
+        return [
+            ffmpeg_path,
+            "-hide_banner",
+            "-y" if overwrite else "-n",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_file,
+            "-map",
+            "0",
+            "-c",
+            "copy",
+            *self.container_args(output_path),
+            output_path,
+        ]
+
+    def _audio_source(self, index, info: Optional[MediaInfo], audio_filters=()):
+        """滤镜图里第 index 个输入的音频，统一成 48kHz 立体声 fltp。"""
+        if info is not None and not info.has_audio:
+            # 没有音轨的片段补一段等长静音，否则 concat 的音视频对不上。
+            audio_src = f"anullsrc=r=48000:cl=stereo,atrim=0:{info.duration:.3f}"
+        else:
+            pre_filter = audio_filters[index] if index < len(audio_filters) else ""
+            audio_src = f"[{index}:a]{pre_filter + ',' if pre_filter else ''}{self.resample_filter}"
+        return f"{audio_src},aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo"
+
+    def _transition_graph(self, video_pads, audio_pads, durations, out_v, out_a):
+        """用 xfade/acrossfade 依次衔接各段。第 k 个转场的起点是已衔接部分的时长减去转场时长，
+        durations 必须是对齐到帧的精确时长，否则转场位置会差一两帧。"""
+        seconds = float(self.profile.transition_duration)
+        graph = []
+        video, audio, length = video_pads[0], audio_pads[0] if audio_pads else "", durations[0]
+        for i in range(1, len(video_pads)):
+            last = i == len(video_pads) - 1
+            next_v, next_a = (out_v, out_a) if last else (f"[xv{out_v[1:-1]}_{i}]", f"[xa{out_v[1:-1]}_{i}]")
+            graph.append(
+                f"{video}{video_pads[i]}xfade=transition={self.profile.transition}:duration={seconds:g}:offset={length - seconds:.6f}{next_v}"
+            )
+            if audio_pads:
+                graph.append(f"{audio}{audio_pads[i]}acrossfade=d={seconds:g}{next_a}")
+            video, audio, length = next_v, next_a, length + durations[i] - seconds
+        return graph
+
+    @staticmethod
+    def _trim_video(duration, fps):
+        # 补帧再裁到精确时长，视频流比封装时长略短时也不会让转场错位；setpts 会清掉帧率，
+        # xfade 要求恒定帧率，所以 fps 放在最后。
+        return f"tpad=stop_mode=clone:stop_duration={duration:.3f},trim=duration={duration:.6f},setpts=PTS-STARTPTS,fps={fps:g}"
+
+    @staticmethod
+    def _trim_audio(duration):
+        return f"apad,atrim=duration={duration:.6f},asetpts=PTS-STARTPTS"
+
+    def transition_command(
+        self, ffmpeg_path, sources, output_path, video_filter, durations, fps, overwrite=True, audio_filters=(), pass_no=0, stats_name="", overlays=(),
+        thumbnail_index=-1,
+    ) -> List[str]:
+        """转场输出命令：片头/正片/片尾在同一个滤镜图里规整后用 xfade/acrossfade 衔接，整条只解码、编码一次。
+
+        durations 与 sources 一一对应，是对齐到帧的时长；pass_no=1/2 是两遍编码的第一遍/第二遍；
+        overlays 也与 sources 对应，是各段的叠加层（通常只有正片有）；thumbnail_index 是要顺带出封面和拼图的段（正片）。
+        """
+        with_audio = self.profile.audio_mode != "静音输出" and pass_no != 1
+        cmd = [ffmpeg_path, "-hide_banner", "-y" if overwrite else "-n"]
+        graph, extra_outputs = [], []
+        for i, (path, info) in enumerate(sources):
+            cmd += ["-i", path]
+            overlay = overlays[i] if i < len(overlays) else None
+            source_filter = overlay.apply(video_filter, str(i)) if overlay else video_filter
+            if i == thumbnail_index and pass_no != 1:
+                split, thumbnail_graph, extra_outputs = self.thumbnail_graph(f"[v{i}]", output_path, durations[i])
+                graph.append(f"[{i}:v]{source_filter},{self._trim_video(durations[i], fps)},{split}")
+                graph += thumbnail_graph
+            else:
+                graph.append(f"[{i}:v]{source_filter},{self._trim_video(durations[i], fps)}[v{i}]")
+            if with_audio:
+                graph.append(f"{self._audio_source(i, info, audio_filters)},{self._trim_audio(durations[i])}[a{i}]")
+        count = len(sources)
+        graph += self._transition_graph(
+            [f"[v{i}]" for i in range(count)], [f"[a{i}]" for i in range(count)] if with_audio else [], durations, "[vout]", "[aout]"
+        )
+        cmd += ["-filter_complex", ";".join(graph), "-map", "[vout]"]
+        if pass_no == 1:
+            return cmd + [*self.pass1_args, *self.pass_args(1, stats_name), "-an", "-f", "null", os.devnull]
+        if with_audio:
+            cmd += ["-map", "[aout]"]
+        cmd += self.graph_args
+        if pass_no == 2:
+            cmd += self.pass_args(2, stats_name)
+        return cmd + self.container_args(output_path) + [output_path] + extra_outputs
+
+    def preview_command(self, ffmpeg_path, pieces, output_path, video_filter, fps) -> List[str]:
+        """预览命令：pieces 是 [(路径, MediaInfo 或 None, 起点, 时长, 叠加层, 组号)]。
+
+        每段只读入需要的几秒，按模板的画面滤镜规整、裁到精确时长；同组的段按成品的方式衔接
+        （配置了转场时用 xfade/acrossfade，否则直接相接），各组再依次相接。编码参数同转场输出，封装固定为 MP4。
+        """
+        with_audio = self.profile.audio_mode != "静音输出"
+        cmd = [ffmpeg_path, "-hide_banner", "-y"]
+        graph, groups = [], {}
+        for i, (path, info, start, duration, overlay, group) in enumerate(pieces):
+            cmd += ["-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", path]
+            source_filter = overlay.apply(video_filter, str(i)) if overlay else video_filter
+            graph.append(f"[{i}:v]{source_filter},{self._trim_video(duration, fps)}[v{i}]")
+            if with_audio:
+                piece_info = replace(info, duration=duration) if info is not None else None
+                graph.append(f"{self._audio_source(i, piece_info)},{self._trim_audio(duration)}[a{i}]")
+            groups.setdefault(group, []).append((i, duration))
+
+        joined = []
+        for group, members in groups.items():
+            video_pads = [f"[v{i}]" for i, _ in members]
+            audio_pads = [f"[a{i}]" for i, _ in members] if with_audio else []
+            out_v, out_a = f"[gv{group}]", f"[ga{group}]"
+            if self.profile.transition and len(members) > 1:
+                graph += self._transition_graph(video_pads, audio_pads, [duration for _, duration in members], out_v, out_a)
+            else:
+                pads = "".join(v + (audio_pads[k] if with_audio else "") for k, v in enumerate(video_pads))
+                graph.append(f"{pads}concat=n={len(members)}:v=1:a={1 if with_audio else 0}{out_v}" + (out_a if with_audio else ""))
+            joined.append(out_v + (out_a if with_audio else ""))
+        graph.append(f"{''.join(joined)}concat=n={len(joined)}:v=1:a={1 if with_audio else 0}[vout]" + ("[aout]" if with_audio else ""))
+
+        cmd += ["-filter_complex", ";".join(graph), "-map", "[vout]"]
+        if with_audio:
+            cmd += ["-map", "[aout]"]
+        return cmd + [*self.graph_args, "-movflags", "+faststart", output_path]
+
+    def ladder_command(
+        self, ffmpeg_path, sources, output_paths, overwrite=True, audio_filters=(), durations=(), fps=0.0, overlays=(), thumbnails=None
+    ) -> List[str]:
+        """多规格输出命令：每个源只解码一次，split 到各档滤镜链，再按档拼接、编码。
+
+        sources 是 [(路径, MediaInfo 或 None)]，按片头/正片/片尾顺序排列；
+        audio_filters 与 sources 一一对应，是重采样前要先做的音频滤镜（如响度统一）。
+        配置了转场时 durations/fps 同 transition_command，各档用 xfade 衔接而不是 concat。
+        overlays 与 sources 对应，每项是各档的叠加层列表或 None（水印按各档宽度分别缩放）。
+        thumbnails 是 (正片序号, 主输出路径, 正片时长)，给出时从正片第一档的画面顺带出封面和拼图。
+        """
+        count = len(self.renditions)
+        with_audio = self.profile.audio_mode != "静音输出"
+        transition = bool(self.profile.transition and durations and len(sources) > 1)
+        cmd = [ffmpeg_path, "-hide_banner", "-y" if overwrite else "-n"]
+        graph, extra_outputs = [], []
+        for i, (path, info) in enumerate(sources):
+            cmd += ["-i", path]
+            trim_v = f",{self._trim_video(durations[i], fps)}" if transition else ""
+            graph.append(f"[{i}:v]split={count}" + "".join(f"[s{i}_{r}]" for r in range(count)))
+            rung_overlays = overlays[i] if i < len(overlays) and overlays[i] else [None] * count
+            for r, rung in enumerate(self.renditions):
+                rung_filter = rung_overlays[r].apply(rung.video_filter, f"{i}_{r}") if rung_overlays[r] else rung.video_filter
+                if thumbnails and thumbnails[0] == i and r == 0:
+                    split, thumbnail_graph, extra_outputs = self.thumbnail_graph(f"[v{i}_{r}]", *thumbnails[1:])
+                    graph.append(f"[s{i}_{r}]{rung_filter}{trim_v},{split}")
+                    graph += thumbnail_graph
+                    continue
+                graph.append(f"[s{i}_{r}]{rung_filter}{trim_v}[v{i}_{r}]")
+            if with_audio:
+                trim_a = f",{self._trim_audio(durations[i])}" if transition else ""
+                graph.append(
+                    f"{self._audio_source(i, info, audio_filters)}{trim_a},asplit={count}"
+                    + "".join(f"[a{i}_{r}]" for r in range(count))
+                )
+
+        for r in range(count):
+            if transition:
+                graph += self._transition_graph(
+                    [f"[v{i}_{r}]" for i in range(len(sources))],
+                    [f"[a{i}_{r}]" for i in range(len(sources))] if with_audio else [],
+                    durations, f"[vout{r}]", f"[aout{r}]",
+                )
+                continue
+            pads = "".join(f"[v{i}_{r}]" + (f"[a{i}_{r}]" if with_audio else "") for i in range(len(sources)))
+            graph.append(f"{pads}concat=n={len(sources)}:v=1:a={1 if with_audio else 0}[vout{r}]" + (f"[aout{r}]" if with_audio else ""))
+
+        cmd += ["-filter_complex", ";".join(graph)]
+        for r, (rung, output_path) in enumerate(zip(self.renditions, output_paths)):
+            cmd += ["-map", f"[vout{r}]"]
+            if with_audio:
+                cmd += ["-map", f"[aout{r}]"]
+            cmd += [*rung.output_args, *self.container_args(output_path), output_path]
+        return cmd + extra_outputs
+
+
+class MemoryPressureError(RuntimeError):
+    """系统内存吃紧时被资源调度器中止的任务，稍后会重新排队。"""
+
+
+def _memory_status_mb():
+    """返回 (总内存, 可用内存)，单位 MB；取不到时返回 (0, None)。"""
+    if psutil is not None:
+        vm = psutil.virtual_memory()
+        return vm.total // 2**20, vm.available // 2**20
+    if os.path.exists("/proc/meminfo"):
+        values = {}
+        with open("/proc/meminfo", encoding="ascii", errors="replace") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                values[key] = int(rest.split()[0]) // 1024 if rest.split() else 0
+        return values.get("MemTotal", 0), values.get("MemAvailable", values.get("MemFree"))
+    if os.name == "nt":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)] + [
+                (name, ctypes.c_ulonglong)
+                for name in ("ullTotalPhys", "ullAvailPhys", "ullTotalPageFile", "ullAvailPageFile",
+                             "ullTotalVirtual", "ullAvailVirtual", "ullAvailExtendedVirtual")
+            ]
 
-        mode_box = ttk.Frame(header)
-        mode_box.pack(side=tk.RIGHT)
-        ttk.Label(mode_box, text="操作模式：").pack(side=tk.LEFT, padx=(0, 4))
-        self.mode_combo = ttk.Combobox(
-            mode_box,
-            textvariable=self.mode_var,
-            values=["小白推荐", "半专业调节"],
-            state="readonly",
-            width=14,
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys // 2**20, status.ullAvailPhys // 2**20
+    return 0, None
+
+
+def _process_rss_mb(pid):
+    """子进程常驻内存（MB）。Windows 上需要安装 psutil，否则返回 0。"""
+    try:
+        if psutil is not None:
+            return psutil.Process(pid).memory_info().rss // 2**20
+        with open(f"/proc/{pid}/status", encoding="ascii", errors="replace") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) // 1024
+    except Exception:
+        pass
+    return 0
+
+
+def _gpu_memory_total_mb():
+    """用 nvidia-smi 读第一块 NVIDIA 显卡的显存总量，没有时返回 0。"""
+    nvidia_smi = shutil.which("nvidia-smi")
+    if not nvidia_smi:
+        return 0
+    try:
+        result = subprocess.run(
+            [nvidia_smi, "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10,
         )
-        self.mode_combo.pack(side=tk.LEFT)
+        return int(result.stdout.split()[0])
+    except Exception:
+        return 0
+
+
+class ResourceGovernor:
+    """内存/显存预算调度：按探测到的分辨率、编码器和前瞻帧数估算每个任务的占用，
+    装得下才放行；运行中按子进程实际内存修正估算，系统可用内存过低时暂停放行新任务，
+    再低就中止最后放行的任务让它重新排队。只剩一个任务时总是放行，避免整批卡死。
+    """
+
+    def __init__(self, ram_budget_mb=0, vram_budget_mb=0, reserve_mb=0):
+        total, _ = _memory_status_mb()
+        self.ram_budget_mb = ram_budget_mb or int(total * 0.75)
+        self.vram_budget_mb = vram_budget_mb
+        self.reserve_mb = reserve_mb or max(512, int(total * 0.05))
+        self._cond = threading.Condition()
+        self._running = {}
+        self._suspended = {}
+        self._preempted = set()
+        self._vram_detected = bool(vram_budget_mb)
+
+    def estimate(self, template: CommandTemplate, info: Optional[MediaInfo]) -> Tuple[int, int]:
+        """估算一个任务的 (内存, 显存) 占用，单位 MB。"""
+        plan = template.plan
+        src_w, src_h = (info.width, info.height) if info and info.width else (1920, 1080)
+        res = template.profile.resolution.strip()
+        out_w, out_h = parse_resolution(res) if res != "跟随原视频" else (src_w, src_h)
+        for rung in template.profile.renditions:
+            rw, rh = parse_resolution(rung.resolution)
+            out_w, out_h = max(out_w, rw), max(out_h, rh)
+        src_frame = src_w * src_h * 1.5 / 2**20
+        out_frame = out_w * out_h * 1.5 / 2**20
+        # 解码端：多线程解码在途的帧 + 参考帧；HEVC/VP9/AV1 解码更吃内存。
+        decode = 150 + src_frame * 16 * (1.5 if info and info.video_codec in ("hevc", "vp9", "av1") else 1.0)
+        encoders = max(1, len(template.renditions))
+        lookahead = _lookahead_frames(plan)
+        if plan.encoder in ("libx264", "libx265"):
+            factor = 2.5 if plan.encoder == "libx265" else 1.0
+            return int(decode + encoders * factor * (50 + out_frame * (lookahead + 24))), 0
+        # 硬件编码：帧缓冲和前瞻都在显存里，内存只留上传用的几帧。
+        return int(decode + encoders * (100 + out_frame * 8)), int(encoders * (300 + out_frame * (lookahead + 16)))
+
+    def _fits(self, ram, vram):
+        if not self._running:
+            return True
+        used_ram = sum(need[0] for need in self._running.values())
+        used_vram = sum(need[1] for need in self._running.values())
+        if self.ram_budget_mb and used_ram + ram > self.ram_budget_mb:
+            return False
+        if self.vram_budget_mb and vram and used_vram + vram > self.vram_budget_mb:
+            return False
+        _, available = _memory_status_mb()
+        return available is None or available - ram >= self.reserve_mb
+
+    def acquire(self, need, stop_event=None, log: Optional[Callable] = None):
+        """阻塞到放得下为止。need 是 estimate() 的结果，令牌就是当前线程。"""
+        ram, vram = need
+        if vram and not self._vram_detected:
+            self._vram_detected = True
+            self.vram_budget_mb = int(_gpu_memory_total_mb() * 0.8)
+        token = threading.get_ident()
+        waited = False
+        with self._cond:
+            while not self._fits(ram, vram):
+                if stop_event is not None and stop_event.is_set():
+                    raise RuntimeError("用户已停止任务")
+                if not waited and log:
+                    used = sum(item[0] for item in self._running.values())
+                    log(f"内存/显存不够，任务排队等待：预计需要 {ram} MB，已占用 {used}/{self.ram_budget_mb} MB", "warning")
+                    waited = True
+                self._cond.wait(timeout=1.0)
+            self._running[token] = (ram, vram)
+            self._preempted.discard(token)
+        return token
+
+    def release(self, token):
+        with self._cond:
+            self._running.pop(token, None)
+            self._suspended.pop(token, None)
+            self._cond.notify_all()
+
+    def suspend(self, token):
+        """任务被暂停让位：暂停的进程可以换出到磁盘，先不计它的占用，恢复时再记回来。"""
+        with self._cond:
+            if token in self._running:
+                self._suspended[token] = self._running.pop(token)
+                self._cond.notify_all()
+
+    def resume(self, token):
+        with self._cond:
+            need = self._suspended.pop(token, None)
+            if need is not None:
+                self._running.setdefault(token, need)
+
+    def observe(self, token, rss_mb):
+        """实际占用超过估算时按实际值记账，后续放行更保守。"""
+        with self._cond:
+            if token in self._running and rss_mb > self._running[token][0]:
+                self._running[token] = (rss_mb, self._running[token][1])
+
+    def check_pressure(self):
+        """可用内存低于保留值且不止一个任务在跑时，挑最后放行的任务中止，返回它的令牌。"""
+        _, available = _memory_status_mb()
+        with self._cond:
+            if available is None or available >= self.reserve_mb or len(self._running) <= 1:
+                return None
+            victim = [token for token in self._running if token not in self._preempted][-1:]
+            if not victim:
+                return None
+            self._preempted.add(victim[0])
+            return victim[0]
+
+    def take_preempted(self, token):
+        with self._cond:
+            if token in self._preempted:
+                self._preempted.discard(token)
+                return True
+            return False
+
+
+class ThroughputController:
+    """吞吐目标调度：按截止时间或实时倍数，给后续任务挑赶得上进度的最高质量编码预设。
+
+    每个任务结束后，用 FFmpeg 进度行里的 time=/speed= 算出它的编码耗时，得到该预设下
+    单个任务每秒能处理多少秒素材；并行 N 个任务时整批吞吐按 N 倍计。还没跑过的预设
+    按 PRESET_SPEED_RATIO 从已实测的预设推算。配置里选的编码预设是质量上限，只会往更快的档位调。
+    """
+
+    SAFETY = 1.1  # 留一成余量，抵消估算误差和片头片尾等额外开销
+
+    def __init__(self, deadline=None, realtime=0.0, log: Optional[Callable] = None):
+        self.deadline = deadline
+        self.realtime = float(realtime or 0)
+        self.log = log or _print_log
+        self.jobs = 1
+        self.remaining = 0.0
+        self._ladder = PRESET_LADDER
+        self._speeds = {}
+        self._current = None
+        self._lock = threading.Lock()
 
-    def _build_file_panel(self, parent):
-        card = ttk.Frame(parent, style="Card.TFrame", padding=10)
-        card.pack(fill=tk.BOTH, expand=True)
+    @classmethod
+    def from_text(cls, text, log: Optional[Callable] = None) -> Optional["ThroughputController"]:
+        """界面上的写法：“4x” 是实时倍数，其余按完成时间解析；留空返回 None。"""
+        text = (text or "").strip().lower()
+        if not text:
+            return None
+        m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*[x×倍]", text)
+        if m:
+            if float(m.group(1)) <= 0:
+                raise ValueError("实时倍数必须大于 0。")
+            return cls(realtime=float(m.group(1)), log=log)
+        return cls(deadline=parse_deadline(text), log=log)
+
+    def describe(self):
+        if self.realtime:
+            return f"{self.realtime:g} 倍实时"
+        return time.strftime("%m-%d %H:%M 前完成", time.localtime(self.deadline))
+
+    def start(self, media_seconds, jobs, preset):
+        """开始一批：media_seconds 是整批素材总时长，preset 是配置里的编码预设（质量上限）。"""
+        with self._lock:
+            self.remaining = media_seconds
+            self.jobs = max(1, int(jobs))
+            self._ladder = PRESET_LADDER[: PRESET_LADDER.index(preset) + 1] if preset in PRESET_LADDER else (preset,)
+            self._current = self._ladder[-1]
+        self.log(f"吞吐目标：{self.describe()}，素材共 {media_seconds / 60:.1f} 分钟，编码预设在 {' / '.join(self._ladder)} 之间自动调整")
+
+    def required_rate(self):
+        """整批需要达到的吞吐：每秒墙钟时间要处理多少秒素材。"""
+        if self.realtime:
+            return self.realtime
+        left = self.deadline - time.time()
+        return float("inf") if left <= 0 else self.remaining / left
+
+    def _rate(self, preset):
+        if preset in self._speeds:
+            return self._speeds[preset]
+        estimates = [speed * PRESET_SPEED_RATIO[preset] / PRESET_SPEED_RATIO[name] for name, speed in self._speeds.items()]
+        return sum(estimates) / len(estimates) if estimates else 0.0
+
+    def choose(self):
+        """返回下一个任务用的编码预设。"""
+        with self._lock:
+            if not self._speeds or len(self._ladder) == 1:
+                return self._current
+            need = self.required_rate() * self.SAFETY
+            # 从最快的档位往上找，取吞吐仍然够用的最高质量档位；都不够时用最快的。
+            choice = self._ladder[0]
+            for preset in self._ladder[1:]:
+                if self._rate(preset) * self.jobs >= need:
+                    choice = preset
+            if choice != self._current:
+                self.log(
+                    f"吞吐目标：需要 {need / self.SAFETY:.2f} 倍实时，{self._current} 预计 {self._rate(self._current) * self.jobs:.2f} 倍，"
+                    f"后续任务改用 {choice}（预计 {self._rate(choice) * self.jobs:.2f} 倍）",
+                    "warning" if PRESET_LADDER.index(choice) < PRESET_LADDER.index(self._current) else "info",
+                )
+                self._current = choice
+            return choice
+
+    def observe(self, preset, media_seconds, encode_seconds):
+        """记录一个任务的实测速度，同一预设取滑动平均。"""
+        if preset not in PRESET_SPEED_RATIO or media_seconds <= 0 or encode_seconds <= 0:
+            return
+        speed = media_seconds / encode_seconds
+        with self._lock:
+            old = self._speeds.get(preset)
+            self._speeds[preset] = speed if old is None else old * 0.7 + speed * 0.3
 
-        top = ttk.Frame(card, style="Card.TFrame")
-        top.pack(fill=tk.X)
-        ttk.Label(top, text="文件列表", style="Section.TLabel").pack(side=tk.LEFT)
+    def add(self, media_seconds):
+        """批处理进行中又加了文件，剩余工作量跟着增加。"""
+        with self._lock:
+            self.remaining += media_seconds
 
-        btns = ttk.Frame(top, style="Card.TFrame")
-        btns.pack(side=tk.RIGHT)
-        ttk.Button(btns, text="添加文件夹", style="Small.TButton", command=self.add_folder).pack(side=tk.LEFT, padx=2)
-        ttk.Button(btns, text="添加文件", style="Small.TButton", command=self.add_files).pack(side=tk.LEFT, padx=2)
-        ttk.Button(btns, text="删除选中", style="Small.TButton", command=self.delete_selected).pack(side=tk.LEFT, padx=2)
-        ttk.Button(btns, text="清空", style="Small.TButton", command=self.clear_list).pack(side=tk.LEFT, padx=2)
+    def complete(self, media_seconds):
+        """一个任务结束（成功或失败），从剩余工作量里扣掉。"""
+        with self._lock:
+            self.remaining = max(0.0, self.remaining - media_seconds)
 
-        hint = ttk.Label(
-            card,
-            text="支持 mp4 / mov / mkv / avi / webm 等常见格式，可批量添加文件夹。",
-            style="Hint.TLabel",
-        )
-        hint.pack(fill=tk.X, pady=(4, 6))
 
-        table_frame = ttk.Frame(card, style="Card.TFrame")
-        table_frame.pack(fill=tk.BOTH, expand=True)
+@dataclass
+class FileEstimate:
+    """预估里的一个文件：输出体积和临时文件占用（字节）、处理耗时（秒）。内容重复的文件不编码，都记 0。"""
 
-        self.tree = ttk.Treeview(
-            table_frame,
-            columns=("status", "name", "path"),
-            show="headings",
-            selectmode="extended",
-        )
-        self.tree.heading("status", text="状态")
-        self.tree.heading("name", text="文件名")
-        self.tree.heading("path", text="路径")
-        self.tree.column("status", width=76, anchor=tk.CENTER, stretch=False)
-        self.tree.column("name", width=180, anchor=tk.W, stretch=False)
-        self.tree.column("path", width=420, anchor=tk.W)
+    input_path: str
+    output_path: str
+    duration: float
+    output_bytes: int = 0
+    temp_bytes: int = 0
+    seconds: float = 0.0
+    duplicate_of: str = ""
 
-        yscroll = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        xscroll = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
 
-        self.tree.grid(row=0, column=0, sticky="nsew")
-        yscroll.grid(row=0, column=1, sticky="ns")
-        xscroll.grid(row=1, column=0, sticky="ew")
-        table_frame.rowconfigure(0, weight=1)
-        table_frame.columnconfigure(0, weight=1)
+@dataclass
+class BatchEstimate:
+    """整批的预估结果。problems 非空表示不应开始（磁盘空间不够），warnings 只是提醒。"""
+
+    files: List[FileEstimate]
+    jobs: int
+    total_bytes: int
+    temp_peak_bytes: int
+    wall_seconds: float
+    size_basis: str
+    speed_basis: str
+    output_free: Optional[int] = None
+    temp_free: Optional[int] = None
+    problems: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def summary_lines(self) -> List[str]:
+        duplicates = sum(1 for item in self.files if item.duplicate_of)
+        media = sum(item.duration for item in self.files)
+        lines = [
+            f"预估：{len(self.files)} 个文件{f'（{duplicates} 个内容重复，不单独编码）' if duplicates else ''}，素材共 {format_seconds(media)}；"
+            f"输出约 {format_bytes(self.total_bytes)}，临时文件峰值约 {format_bytes(self.temp_peak_bytes)}；"
+            f"并行 {self.jobs} 个，约需 {format_seconds(self.wall_seconds)}",
+            f"体积依据：{self.size_basis}；耗时依据：{self.speed_basis}",
+        ]
+        free = [f"{label}剩余 {format_bytes(value)}" for label, value in (("输出盘", self.output_free), ("临时盘", self.temp_free)) if value is not None]
+        if free:
+            lines.append("，".join(free))
+        return lines
+
+
+def format_bytes(size):
+    size = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} 秒"
+    if seconds < 3600:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds // 3600} 小时 {seconds % 3600 // 60} 分"
+
+
+def _number(text, default=0.0):
+    try:
+        return float(str(text).strip())
+    except ValueError:
+        return default
+
+
+def _estimate_video_kbps(plan: EncodePlan, width, height, fps):
+    """按编码计划估算视频平均码率（kbps）：码率类模式就是目标码率；CRF/CQ 按经验公式，智能动态码率再受最高码率限制。"""
+    if plan.rate_mode in ("固定码率 CBR", "平均码率 VBR") or plan.rate_mode in TWO_PASS_MODES:
+        return _number(plan.bitrate)
+    crf_encoder = plan.encoder in ("libx264", "libx265") or plan.encoder.endswith(("_nvenc", "_qsv", "_amf"))
+    if not crf_encoder or (plan.rate_mode != "恒定质量 CRF/CQ" and plan.encoder.endswith(("_qsv", "_amf"))):
+        # 智能动态码率在 QSV/AMF 上就是普通的平均码率（见 _video_rate_args）。
+        return _number(plan.bitrate)
+    family = plan.encoder if plan.encoder in ESTIMATE_BITS_PER_PIXEL else ("hevc" if plan.encoder.startswith("hevc") else "h264")
+    kbps = width * height * fps * ESTIMATE_BITS_PER_PIXEL[family] * 2 ** ((22 - _number(plan.crf_cq, 22)) / 6) / 1000
+    if plan.rate_mode != "恒定质量 CRF/CQ" and _number(plan.maxrate):
+        kbps = min(kbps, _number(plan.maxrate))
+    return kbps
+
+
+def _estimate_realtime(plan: EncodePlan, width, height, fps):
+    """没有历史记录时按编码器、预设和输出像素率估算单个任务的编码速度（素材时长倍数）。"""
+    family = plan.encoder if plan.encoder in ESTIMATE_REALTIME else plan.encoder.rsplit("_", 1)[-1]
+    speed = ESTIMATE_REALTIME.get(family, ESTIMATE_REALTIME["libx264"])
+    speed *= PRESET_SPEED_RATIO.get(plan.preset, PRESET_SPEED_RATIO["均衡"]) / PRESET_SPEED_RATIO["均衡"]
+    return speed * 1920 * 1080 * 30 / max(1.0, width * height * fps)
+
+
+def _disk_free(path):
+    """返回 (剩余字节, 设备号)；目录还不存在时看最近的上级目录，取不到时返回 (None, None)。"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None, None
+        path = parent
+    try:
+        return shutil.disk_usage(path).free, os.stat(path).st_dev
+    except OSError:
+        return None, None
+
+
+def _lookahead_frames(plan: EncodePlan):
+    match = re.search(r"rc-lookahead[=\s]+(\d+)", plan.extra_args or "")
+    if match:
+        return int(match.group(1))
+    if plan.encoder in ("libx264", "libx265"):
+        return LOOKAHEAD_FRAMES[plan.encoder].get(plan.preset, 40)
+    return 8
+
+
+class QualityCheckError(RuntimeError):
+    """输出画质低于配置的下限。输出文件保留，方便人工复查。"""
+
+
+class FFmpegError(RuntimeError):
+    """FFmpeg 非零退出；category 是 FFmpegErrorAnalyzer 给出的第一个诊断类别，用于按原因统计失败。"""
+
+    def __init__(self, message, category="unknown"):
+        super().__init__(message)
+        self.category = category
+
+
+# Prometheus 指标：名称 → (类型, 说明, 直方图分桶)。
+METRIC_DEFINITIONS = {
+    "video_tool_jobs_total": ("counter", "处理结束的文件数，result 为 done / failed / duplicate", ()),
+    "video_tool_job_failures_total": ("counter", "失败的文件数，按 FFmpegErrorAnalyzer 的诊断类别", ()),
+    "video_tool_queue_depth": ("gauge", "本批还没开始处理的文件数", ()),
+    "video_tool_jobs_running": ("gauge", "正在处理的文件数", ()),
+    "video_tool_preemptions_total": ("counter", "给加急文件让位的次数，mode 为 pause（暂停后恢复）/ requeue（中止后重新排队）", ()),
+    "video_tool_service_jobs_queued": ("gauge", "任务服务里排队的任务数", ()),
+    "video_tool_job_seconds": ("histogram", "单个文件从开始到写完的耗时（秒）", (5, 15, 30, 60, 120, 300, 600, 1800, 3600)),
+    "video_tool_stage_seconds": ("histogram", "各阶段 FFmpeg 命令耗时（秒）", (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)),
+    "video_tool_realtime_factor": ("histogram", "每个文件的编码速度（素材时长 / 编码耗时）", (0.25, 0.5, 1, 2, 4, 8, 16, 32)),
+    "video_tool_encode_seconds_total": ("counter", "各编码器累计的编码耗时（秒），按时间求速率即占用率", ()),
+    "video_tool_media_seconds_total": ("counter", "已处理的素材时长（秒）", ()),
+    "video_tool_bytes_out_total": ("counter", "写出的成品字节数", ()),
+    "video_tool_cache_requests_total": ("counter", "缓存命中情况：cache 为 segment（片头片尾）/ probe / loudness / complexity / watermark", ()),
+}
+
+
+class MetricsRegistry:
+    """进程内的计数器、仪表和直方图，导出成 Prometheus 文本格式（不依赖 prometheus_client）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    @staticmethod
+    def _key(name, labels):
+        if name not in METRIC_DEFINITIONS:
+            raise KeyError(f"未定义的指标：{name}")
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1.0, **labels):
+        """计数器加 amount；仪表也用它做加减。"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        buckets = METRIC_DEFINITIONS[name][2]
+        with self._lock:
+            # [各分桶计数..., 总和, 总数]
+            data = self._values.setdefault(key, [0] * len(buckets) + [0.0, 0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def value(self, name, **labels):
+        """某个序列的当前值；直方图返回观测次数。没有数据时返回 0。"""
+        with self._lock:
+            value = self._values.get(self._key(name, labels), 0.0)
+        return value[-1] if isinstance(value, list) else value
+
+    def series(self, name):
+        """某个指标的所有序列：{标签字典的元组形式: 值}，直方图的值是观测次数。"""
+        with self._lock:
+            return {labels: value[-1] if isinstance(value, list) else value for (metric, labels), value in self._values.items() if metric == name}
+
+    def cache(self, cache, hit):
+        self.inc("video_tool_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    @staticmethod
+    def _number(value):
+        # 不用 :g，大的字节数会被截成 6 位有效数字。
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    def render(self) -> str:
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in METRIC_DEFINITIONS.items():
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {self._number(value)}")
+                    continue
+                for bound, count in zip([*buckets, "+Inf"], [*value[:len(buckets)], value[-1]]):
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {self._number(value[-2])}")
+                lines.append(f"{name}_count{self._labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """写成 node_exporter textfile collector 能读的文件；先写临时文件再替换，采集时不会读到半截。"""
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(self.render(), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
 
-        self.context_menu = tk.Menu(self.tree, tearoff=0)
-        self.context_menu.add_command(label="删除选中", command=self.delete_selected)
-        self.context_menu.add_command(label="打开所在文件夹", command=self.open_selected_folder)
+
+def start_metrics_textfile(registry: MetricsRegistry, path, interval=5.0) -> threading.Event:
+    """后台每 interval 秒刷新一次指标文件；返回的 Event 置位后再写最后一次并退出。"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            registry.write_textfile(path)
+        registry.write_textfile(path)
+
+    registry.write_textfile(path)
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
+
+
+class ProcessBackend:
+    """引擎启动 FFmpeg/ffprobe 的方式，默认就是 subprocess。
+
+    测试和压测时可以换成不真正启动进程的替身（见 build/fake_ffmpeg.py）：popen 返回的对象
+    需要有 stdout（逐行迭代，stderr 已合并进来）、pid、poll()、wait(timeout)；
+    run 返回带 returncode / stdout / stderr 的 subprocess.CompletedProcess；terminate / kill
+    结束一条命令连同它派生的子进程。suspend / resume 可选：没有时加急任务插队改为中止一个普通任务、稍后重新排队。
+
+    FFmpeg 在独立的进程组（POSIX 上是新会话）里启动，信号发给整个组，不会漏下它派生的子进程。
+    """
+
+    def popen(self, cmd, cwd=None):
+        startupinfo = None
+        creationflags = 0
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            creationflags = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+        return subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            encoding="utf-8",
+            errors="replace",
+            cwd=cwd,
+            startupinfo=startupinfo,
+            creationflags=creationflags,
+            start_new_session=os.name != "nt",
+        )
+
+    def run(self, cmd, timeout=None) -> subprocess.CompletedProcess:
+        return subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=timeout)
+
+    def terminate(self, process):
+        """请整个进程组退出：POSIX 发 SIGTERM，Windows 上没有对应的信号，直接结束进程。"""
+        try:
+            if os.name != "nt":
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+        except OSError:
+            pass
+
+    def kill(self, process):
+        """强制结束整个进程组，也收拾主进程退出后还留着的子进程。"""
+        try:
+            if os.name != "nt":
+                os.killpg(process.pid, signal.SIGKILL)
+            elif process.poll() is None:
+                # 进程号可能被复用，主进程已退出时不再按进程号结束进程树。
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW)
+                process.kill()
+        except OSError:
+            pass
+
+    def suspend(self, process):
+        """暂停整个进程组，成功返回 True。POSIX 发 SIGSTOP；Windows 需要 psutil，否则做不到。"""
+        try:
+            if os.name != "nt":
+                os.killpg(process.pid, signal.SIGSTOP)
+                return True
+            if psutil is not None:
+                psutil.Process(process.pid).suspend()
+                return True
+        except Exception:
+            pass
+        return False
+
+    def resume(self, process):
+        try:
+            if os.name != "nt":
+                os.killpg(process.pid, signal.SIGCONT)
+            elif psutil is not None:
+                psutil.Process(process.pid).resume()
+        except Exception:
+            pass
+
+
+class JobPreempted(RuntimeError):
+    """给加急任务让位而被中止的任务，会放回队列里原来的位置。"""
+
+
+class BatchQueue:
+    """一批任务的优先级队列：优先级高的先出队，同一优先级按加入顺序。
+
+    批处理进行中也能继续加文件、把还在排队的文件提前。队列空了且没有任务在处理时自动关闭，
+    之后再加入会被拒绝，由调用方另开一批。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._entries = {}  # 输入文件 → 堆里的有效条目 [-优先级, 序号, 输入, 输出]
+        self._order = itertools.count()
+        self._active = 0
+        self.closed = False
+
+    def put(self, input_path, output_path, priority=PRIORITY_NORMAL, order=None):
+        """加入一个任务；order 用于让位的任务回到原来的位置。队列已关闭时返回 False。"""
+        with self._cond:
+            if self.closed:
+                return False
+            entry = [-priority, next(self._order) if order is None else order, input_path, output_path]
+            self._entries[input_path] = entry
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+            return True
+
+    def promote(self, input_path, priority):
+        """把还在排队的任务提到 priority，排在同优先级已有任务之后。不在排队中时返回 False。"""
+        with self._cond:
+            entry = self._entries.get(input_path)
+            if entry is None or self.closed:
+                return False
+            if -entry[0] < priority:
+                # 堆里的旧条目作废，出队时跳过。
+                self._entries[input_path] = new = [-priority, next(self._order), input_path, entry[3]]
+                heapq.heappush(self._heap, new)
+                self._cond.notify()
+            return True
+
+    def waiting(self, priority):
+        """排队中优先级不低于 priority 的任务数。"""
+        with self._cond:
+            return sum(1 for entry in self._entries.values() if -entry[0] >= priority)
+
+    def get(self, above=None):
+        """取出下一个任务 (优先级, 序号, 输入, 输出)，没有时等待；队列关闭后返回 None。
+
+        给了 above 时不等待，只取优先级高于它的任务，没有就返回 None。
+        """
+        with self._cond:
+            while True:
+                while self._heap and self._entries.get(self._heap[0][2]) is not self._heap[0]:
+                    heapq.heappop(self._heap)
+                if self.closed:
+                    return None
+                if self._heap and (above is None or -self._heap[0][0] > above):
+                    neg, order, input_path, output_path = heapq.heappop(self._heap)
+                    del self._entries[input_path]
+                    self._active += 1
+                    return -neg, order, input_path, output_path
+                if above is not None:
+                    return None
+                if not self._heap and self._active == 0:
+                    self.close()
+                    return None
+                self._cond.wait()
+
+    def task_done(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def _failure_category(exc):
+    if isinstance(exc, FFmpegError):
+        return exc.category
+    if isinstance(exc, QualityCheckError):
+        return "quality"
+    if isinstance(exc, MemoryPressureError):
+        return "memory"
+    return "other"
+
+
+class VideoEngine:
+    """不依赖 Tk 的处理引擎，GUI 和命令行共用同一套命令构建与执行逻辑。"""
+
+    def __init__(
+        self, ffmpeg_path, ffprobe_path=None, log: Optional[Callable] = None, stop_event=None, probe_index=None, governor=None, metrics=None,
+        backend=None,
+    ):
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        self.backend = backend or ProcessBackend()
+        self.probe_index = probe_index or ProbeIndex()
+        self.metrics = metrics or MetricsRegistry()
+        self.governor = governor or ResourceGovernor()
+        self.throughput: Optional[ThroughputController] = None
+        # on_progress(已处理的素材秒数, 速度倍数)：每条 FFmpeg 进度行回调一次，任务服务用它推送进度。
+        self.on_progress: Optional[Callable] = None
+        self.log = log or _print_log
+        self.stop_event = stop_event or threading.Event()
+        self.overwrite = True
+        self.keep_temp = False
+        self.dedupe = True
+        self._lock = threading.Lock()
+        self._segment_lock = threading.Lock()
+        self._processes = set()
+        self._job_processes = {}
+        # 加急插队：被暂停的任务（线程）和其中已暂停的子进程，以及被要求让位、稍后重新排队的任务。
+        self._paused_jobs = set()
+        self._suspended = set()
+        self._requeue_jobs = set()
+        self._segment_owner = None
+        self._batch_enqueue = None
+        self._encode_seconds = {}
+        self._monitor_stop = None
+        self._batch_dir = None
+        self._segment_cache = {}
+        self._derived_templates = {}
+        self._capabilities = None
+        self._caption_warned = False
+
+    # ------------------------------------------------------------------
+    # 配置编译
+    # ------------------------------------------------------------------
+    def compile_profile(self, profile: EncodeProfile) -> CommandTemplate:
+        return self._compile(profile, self._build_encode_plan(profile))
+
+    def derive_template(self, template: CommandTemplate, **plan_changes) -> CommandTemplate:
+        """在已编译模板上替换部分码率参数（按文件计算码率时使用），同样的替换只编译一次。"""
+        cache_key = (template.key, tuple(sorted(plan_changes.items())))
+        with self._lock:
+            cached = self._derived_templates.get(cache_key)
+        if cached is None:
+            cached = self._compile(template.profile, replace(template.plan, **plan_changes))
+            with self._lock:
+                self._derived_templates[cache_key] = cached
+        return cached
+
+    def _compile(self, profile: EncodeProfile, plan: EncodePlan) -> CommandTemplate:
+        vf = self._build_video_filter(profile)
+        two_pass = plan.rate_mode in TWO_PASS_MODES and plan.encoder in ("libx264", "libx265")
+
+        pre = []
+        if vf:
+            pre += ["-vf", vf]
+        fps = profile.framerate.strip()
+        if fps and fps != "跟随原视频":
+            # fps 也可以在 filter 中做，但单独放 -r 更直观。
+            pre += ["-r", fps]
+        pre += ["-c:v", plan.encoder]
+        pre += self._video_rate_args(plan)
+        pre += self._preset_args(plan.encoder, plan.preset)
+        pre += ["-pix_fmt", "yuv420p"]
+        pre += self._keyframe_args(profile, plan)
+        pre += ["-video_track_timescale", str(SEGMENT_TIMESCALE)]
+        pre += self._extra_args(plan)
+        audio = self._audio_args(profile)
+        resample = "aresample=48000:resampler=soxr" if self._has_soxr() else "aresample=48000"
+
+        # 转场时片头/正片/片尾在一个滤镜图里直接编码成品，音频经过滤镜不能复制。
+        graph_out = ["-c:v", plan.encoder]
+        graph_out += self._video_rate_args(plan)
+        graph_out += self._preset_args(plan.encoder, plan.preset)
+        graph_out += ["-pix_fmt", "yuv420p"]
+        graph_out += self._keyframe_args(profile, plan)
+        graph_out += audio
+        graph_out += self._extra_args(plan)
+
+        pass1 = []
+        if two_pass:
+            pass1 = ["-c:v", plan.encoder]
+            pass1 += self._video_rate_args(plan)
+            pass1 += self._preset_args(plan.encoder, plan.preset)
+            pass1 += ["-pix_fmt", "yuv420p"]
+            pass1 += self._keyframe_args(profile, plan)
+
+        renditions = tuple(self._compile_rendition(profile, plan, rung) for rung in profile.renditions)
+
+        digest = hashlib.sha256(
+            json.dumps(
+                [
+                    PROFILE_VERSION, pre, audio, resample, [asdict(r) for r in renditions],
+                    profile.transition, profile.transition_duration,
+                    profile.watermark, profile.watermark_position, profile.watermark_scale, profile.caption, profile.caption_font,
+                    profile.container, profile.segment_seconds,
+                ],
+                ensure_ascii=False,
+            ).encode("utf-8")
+        ).hexdigest()
+        return CommandTemplate(
+            profile=profile,
+            plan=plan,
+            preprocess_args=tuple(pre),
+            key=digest[:16],
+            renditions=renditions,
+            pass1_args=tuple(pass1),
+            audio_args=tuple(audio),
+            resample_filter=resample,
+            graph_args=tuple(graph_out),
+            fps_mode_option="-fps_mode" if self.capabilities().get("fps_mode", True) else "-vsync",
+        )
+
+    def _compile_rendition(self, profile: EncodeProfile, plan: EncodePlan, rung: Rendition):
+        rung_profile = replace(profile, resolution=rung.resolution, fit_mode=rung.fit_mode)
+        rung_plan = replace(
+            plan,
+            bitrate=rung.bitrate.strip() or plan.bitrate,
+            maxrate=rung.maxrate.strip() or plan.maxrate,
+            crf_cq=rung.crf_cq.strip() or plan.crf_cq,
+        )
+        args = []
+        fps = profile.framerate.strip()
+        if fps and fps != "跟随原视频":
+            args += ["-r", fps]
+        args += ["-c:v", rung_plan.encoder]
+        args += self._video_rate_args(rung_plan)
+        args += self._preset_args(rung_plan.encoder, rung_plan.preset)
+        args += ["-pix_fmt", "yuv420p"]
+        args += self._keyframe_args(profile, rung_plan)
+        # 经过滤镜图的音频无法直接复制，统一重新编码。
+        args += self._audio_args(profile)
+        args += self._extra_args(plan)
+        return CompiledRendition(
+            suffix=rung.output_suffix,
+            video_filter=self._build_video_filter(rung_profile),
+            output_args=tuple(args),
+        )
+
+    def _build_video_filter(self, profile: EncodeProfile):
+        res = profile.resolution.strip()
+        fps = profile.framerate.strip()
+        if res == "跟随原视频":
+            filters = []
+            if fps and fps != "跟随原视频":
+                filters.append(f"fps={fps}")
+            filters.append("format=yuv420p")
+            return ",".join(filters)
+
+        w, h = parse_resolution(res)
+        fit = profile.fit_mode
+        if fit == "完整保留补黑边":
+            vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p"
+        elif fit == "拉伸填满":
+            vf = f"scale={w}:{h},setsar=1,format=yuv420p"
+        else:
+            vf = f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},setsar=1,format=yuv420p"
+
+        if fps and fps != "跟随原视频":
+            vf = f"{vf},fps={fps}"
+        return vf
+
+    def _build_encode_plan(self, profile: EncodeProfile):
+        encoder = self._select_encoder(profile.codec, profile.accel)
+        return EncodePlan(
+            codec=profile.codec,
+            encoder=encoder,
+            preset=profile.preset,
+            rate_mode=profile.rate_mode,
+            bitrate=profile.bitrate.strip(),
+            maxrate=profile.maxrate.strip(),
+            crf_cq=profile.crf_cq.strip(),
+            audio_bitrate=profile.audio_bitrate.strip(),
+            extra_args=profile.extra_args.strip(),
+        )
+
+    def _select_encoder(self, codec, accel):
+        is_h265 = codec.startswith("H.265")
+        cpu_encoder = "libx265" if is_h265 else "libx264"
+
+        preferred = []
+        if accel == "NVIDIA GPU":
+            preferred = ["hevc_nvenc" if is_h265 else "h264_nvenc"]
+        elif accel == "AMD GPU":
+            preferred = ["hevc_amf" if is_h265 else "h264_amf"]
+        elif accel == "Intel GPU":
+            preferred = ["hevc_qsv" if is_h265 else "h264_qsv"]
+        elif accel == "CPU":
+            return cpu_encoder
+        else:
+            preferred = [
+                "hevc_nvenc" if is_h265 else "h264_nvenc",
+                "hevc_qsv" if is_h265 else "h264_qsv",
+                "hevc_amf" if is_h265 else "h264_amf",
+                cpu_encoder,
+            ]
+
+        available = self._get_available_encoders()
+        for enc in preferred:
+            if enc in available:
+                return enc
+        self.log("没有检测到可用硬件编码器，已自动回退 CPU 编码。", "warning")
+        return cpu_encoder
+
+    def capabilities(self):
+        """ffmpeg 支持的编码器、滤镜、soxr 和 -fps_mode。结果按 ffmpeg 可执行文件存进探测索引，
+        下次启动直接读取；换了 ffmpeg（大小或修改时间变化）会自动重新检测。"""
+        if self._capabilities is not None:
+            return self._capabilities
+        if not self.ffmpeg_path:
+            return {"encoders": [], "filters": [], "soxr": False, "fps_mode": True}
+        caps = self.probe_index.get(self.ffmpeg_path, "capabilities")
+        # 旧版本写入的记录没有 fps_mode，重新检测一次。
+        if not caps or "fps_mode" not in caps:
+            caps = {
+                "encoders": self._query_encoders(), "filters": self._query_filters(), "soxr": self._query_soxr(),
+                "fps_mode": self._query_fps_mode(),
+            }
+            if caps["encoders"] is not None:
+                self.probe_index.put(self.ffmpeg_path, "capabilities", caps)
+                self.probe_index.save()
+            else:
+                caps["encoders"] = ["libx264", "libx265"]
+        self._capabilities = caps
+        return caps
+
+    def _get_available_encoders(self):
+        return set(self.capabilities()["encoders"])
+
+    def _get_available_filters(self):
+        return set(self.capabilities()["filters"])
+
+    def _has_soxr(self):
+        return bool(self.capabilities()["soxr"])
+
+    def _ffmpeg_info(self, *args):
+        return self.backend.run([self.ffmpeg_path, "-hide_banner", *args], timeout=12).stdout
+
+    def _query_encoders(self):
+        try:
+            stdout = self._ffmpeg_info("-encoders")
+        except Exception:
+            return None
+        encoders = set(re.findall(r"\s([a-zA-Z0-9_]+)\s+", stdout))
+        # 正则抓不全时，直接用包含判断也够用。
+        for name in ["h264_nvenc", "hevc_nvenc", "h264_qsv", "hevc_qsv", "h264_amf", "hevc_amf", "libx264", "libx265"]:
+            if name in stdout:
+                encoders.add(name)
+        return sorted(encoders)
+
+    def _query_filters(self):
+        filters = set()
+        try:
+            # 每行形如 " TSC libvmaf  VV->V  Calculate the VMAF..."，第三列是输入输出类型。
+            for line in self._ffmpeg_info("-filters").splitlines():
+                parts = line.split()
+                if len(parts) >= 3 and "->" in parts[2]:
+                    filters.add(parts[1])
+        except Exception:
+            pass
+        return sorted(filters)
+
+    def _query_soxr(self):
+        try:
+            return "--enable-libsoxr" in self._ffmpeg_info("-version")
+        except Exception:
+            return False
+
+    def _query_fps_mode(self):
+        """FFmpeg 5.1 之前没有 -fps_mode；查不到帮助时按新版本处理。"""
+        try:
+            return "-fps_mode" in self._ffmpeg_info("-h", "long")
+        except Exception:
+            return True
+
+    def _video_rate_args(self, plan: EncodePlan):
+        enc = plan.encoder
+        mode = plan.rate_mode
+        bitrate = f"{plan.bitrate}k"
+        maxrate = f"{plan.maxrate}k"
+        # 目标文件大小/CRF 模式下码率可以留空（目标文件大小按文件时长另算，见 _sized_template），空串不能参与计算。
+        bitrate_k = int(plan.bitrate) if str(plan.bitrate).strip().isdigit() else 0
+        maxrate_k = int(plan.maxrate) if str(plan.maxrate).strip().isdigit() else 0
+        bufsize = f"{max((maxrate_k or bitrate_k) * 2, bitrate_k or 1000)}k"
+        q = plan.crf_cq
+
+        is_x264_or_x265 = enc in ("libx264", "libx265")
+        is_nvenc = enc.endswith("_nvenc")
+        is_qsv = enc.endswith("_qsv")
+        is_amf = enc.endswith("_amf")
+
+        args = []
+        if mode in TWO_PASS_MODES:
+            if bitrate_k:
+                args += ["-b:v", bitrate]
+            if maxrate_k:
+                args += ["-maxrate", maxrate, "-bufsize", bufsize]
+            if is_nvenc:
+                # NVENC 没有独立的两遍流程，用编码器内部的多遍分析代替。
+                args += ["-rc", "vbr", "-multipass", "fullres"]
+        elif mode == "固定码率 CBR":
+            args += ["-b:v", bitrate, "-minrate", bitrate, "-maxrate", bitrate, "-bufsize", bufsize]
+            if is_nvenc:
+                args += ["-rc", "cbr"]
+        elif mode == "平均码率 VBR":
+            args += ["-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
+            if is_nvenc:
+                args += ["-rc", "vbr"]
+        elif mode == "恒定质量 CRF/CQ":
+            if is_x264_or_x265:
+                args += ["-crf", q]
+            elif is_nvenc:
+                args += ["-rc", "vbr", "-cq", q, "-b:v", "0"]
+            elif is_qsv:
+                args += ["-global_quality", q]
+            elif is_amf:
+                args += ["-quality", "quality", "-qp_i", q, "-qp_p", q, "-qp_b", q]
+            else:
+                args += ["-b:v", bitrate]
+        else:  # 智能动态码率
+            if is_x264_or_x265:
+                args += ["-crf", q, "-maxrate", maxrate, "-bufsize", bufsize]
+            elif is_nvenc:
+                args += ["-rc", "vbr", "-cq", q, "-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
+            else:
+                args += ["-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
+        return args
+
+    def _preset_args(self, encoder, preset_name):
+        if encoder in ("libx264", "libx265"):
+            mapping = {"速度优先": "veryfast", "均衡": "medium", "质量优先": "slow"}
+            return ["-preset", mapping.get(preset_name, "medium")]
+        if encoder.endswith("_nvenc"):
+            mapping = {"速度优先": "p3", "均衡": "p5", "质量优先": "p7"}
+            return ["-preset", mapping.get(preset_name, "p5")]
+        if encoder.endswith("_qsv"):
+            mapping = {"速度优先": "veryfast", "均衡": "medium", "质量优先": "slower"}
+            return ["-preset", mapping.get(preset_name, "medium")]
+        if encoder.endswith("_amf"):
+            mapping = {"速度优先": "speed", "均衡": "balanced", "质量优先": "quality"}
+            return ["-quality", mapping.get(preset_name, "balanced")]
+        return []
+
+    def _keyframe_args(self, profile: EncodeProfile, plan: EncodePlan):
+        """固定间隔的关键帧和封闭 GOP：每段都从 IDR 帧开始，段与段之间没有互相参考的帧，可以直接复制拼接。
+        分片输出时间隔取能整除分片时长、又不超过 KEYFRAME_SECONDS 的值，每个分片都从关键帧开始。"""
+        interval = float(KEYFRAME_SECONDS)
+        if profile.container != "mp4":
+            seconds = float(profile.segment_seconds)
+            interval = seconds / math.ceil(seconds / KEYFRAME_SECONDS)
+        args = ["-force_key_frames", f"expr:gte(t,n_forced*{interval:g})", "-flags", "+cgop"]
+        fps = profile.framerate.strip()
+        if fps and fps != "跟随原视频":
+            gop = str(max(1, round(float(fps) * interval)))
+            args += ["-g", gop, "-keyint_min", gop]
+        if plan.encoder == "libx264":
+            # 场景切换不再额外插关键帧，GOP 长度固定。
+            args += ["-sc_threshold", "0"]
+        elif plan.encoder.endswith("_nvenc"):
+            # NVENC 强制的关键帧默认只是普通 I 帧，要显式要求 IDR。
+            args += ["-forced-idr", "1", "-no-scenecut", "1"]
+        return args
+
+    def _audio_args(self, profile: EncodeProfile):
+        """片段音频需要转码时的编码参数。片段统一为 AAC 48kHz 立体声，拼接时直接复制，避免第二代有损编码；
+        “复制音频”和 AAC 模式都是能复制就复制，区别只在需要转码时的码率。"""
+        if profile.audio_mode == "静音输出":
+            return ["-an"]
+        bitrate = profile.audio_bitrate.strip() or "192"
+        return ["-c:a", "aac", "-b:a", f"{bitrate}k", "-ar", "48000", "-ac", "2"]
+
+    def _audio_plan(self, template: CommandTemplate, input_path) -> Optional[AudioPlan]:
+        """按探测结果决定片段音频做法；读不到信息时返回 None，按老办法统一转码。"""
+        info = self.probe(input_path)
+        if info is None:
+            return None
+        duration = self._segment_duration(template.profile, info)
+        if not info.has_audio:
+            return AudioPlan("silence", duration) if duration > 0 else None
+        loudnorm = self._loudnorm_filter(template.profile, input_path, info)
+        if loudnorm:
+            # loudnorm 内部按 192kHz 输出，后面必须接重采样。
+            return AudioPlan("encode", duration, filter=f"{loudnorm},{template.resample_filter}")
+        fps = info.fps or 30
+        same_length = info.video_duration > 0 and abs(info.audio_duration - info.video_duration) < 1 / fps
+        if info.audio_codec == "aac" and info.audio_profile == "LC" and info.sample_rate == 48000 and info.channels == 2 and same_length:
+            return AudioPlan("copy")
+        return AudioPlan("encode", duration, filter="" if info.sample_rate == 48000 else template.resample_filter)
+
+    @staticmethod
+    def _segment_duration(profile: EncodeProfile, info: MediaInfo):
+        """片段编码后的画面时长：视频流时长按输出帧率对齐到整帧。"""
+        video = info.video_duration or info.duration
+        fps = profile.framerate.strip()
+        fps = float(fps) if fps and fps != "跟随原视频" else info.fps
+        return round(video * fps) / fps if fps > 0 else video
+
+    def _loudnorm_filter(self, profile: EncodeProfile, path, info: Optional[MediaInfo] = None) -> str:
+        """开启响度统一时，用缓存的测量值生成线性模式的 loudnorm，折进本来就有的音频编码里。"""
+        if not profile.loudnorm or (info is not None and not info.has_audio):
+            return ""
+        measured = self.measure_loudness(path)
+        if not measured:
+            return ""
+        # 目标响度范围不小于素材本身，loudnorm 才能保持线性增益而不退回动态压缩。
+        lra = min(max(LOUDNORM_RANGE, measured["input_lra"]), 20)
+        return (
+            f"loudnorm=I={profile.loudness_target}:TP={LOUDNORM_TRUE_PEAK}:LRA={lra:g}"
+            f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}:linear=true"
+        )
+
+    def measure_loudness(self, path) -> Optional[dict]:
+        """测量整体响度/真峰值/响度范围，结果写入探测索引，同一个片头片尾只会测一次。"""
+        cached = self.probe_index.get(path, "loudness")
+        self.metrics.cache("loudness", bool(cached))
+        if cached:
+            return cached
+        cmd = [
+            self.ffmpeg_path, "-hide_banner", "-i", path, "-vn",
+            "-af", f"loudnorm=TP={LOUDNORM_TRUE_PEAK}:LRA={LOUDNORM_RANGE}:print_format=json", "-f", "null", "-",
+        ]
+        output = self._run_command(cmd, stage="loudness")
+        # 测量结果是滤镜最后打印的一段多行 JSON。
+        start = max((i for i, line in enumerate(output) if line == "{"), default=-1)
+        measured = None
+        if start >= 0:
+            try:
+                data = json.loads("".join(output[start:]).split("}")[0] + "}")
+                measured = {key: float(data[key]) for key in ("input_i", "input_tp", "input_lra", "input_thresh")}
+            except (ValueError, KeyError):
+                measured = None
+        # 纯静音测出来是 -inf，没法做线性增益，直接跳过。
+        if not measured or any(abs(value) == float("inf") for value in measured.values()):
+            self.log(f"响度测量没有得到有效结果，保持原音量：{os.path.basename(path)}", "warning")
+            return None
+        self.log(f"响度测量：{measured['input_i']} LUFS，真峰值 {measured['input_tp']} dBTP：{os.path.basename(path)}")
+        self.probe_index.put(path, "loudness", measured)
+        return measured
+
+    def _extra_args(self, plan: EncodePlan):
+        text = plan.extra_args
+        if not text:
+            return []
+        try:
+            return shlex.split(text)
+        except ValueError:
+            self.log("高级参数解析失败，已忽略。", "warning")
+            return []
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+    def run_batch(self, files, template: CommandTemplate, output_dir, intro_path="", outro_path="", jobs=1, on_event=None):
+        """按优先级队列和并行任务数调度一整批文件，返回成功数量。
+
+        on_event(事件, 输入文件, 详情) 用于汇报进度：start / done（详情为输出列表）/
+        failed（详情为异常）/ requeued（给加急任务让位，放回队列）/ progress（详情为已结束的任务数）。
+        处理过程中可以用 add_to_batch 继续加文件或加急。
+        """
+        on_event = on_event or (lambda *_: None)
+        # 内容相同的文件只编码第一份，其余的成品从它硬链接或复制过去。
+        copies = {}
+        for group in find_duplicates(files, self.probe_index) if self.dedupe else []:
+            copies[group[0]] = group[1:]
+            self.log(f"内容相同，只编码一次：{os.path.basename(group[0])} ← {'、'.join(os.path.basename(path) for path in group[1:])}")
+        duplicates = {path for group in copies.values() for path in group}
+        batch = BatchQueue()
+        taken = set()
+        output_paths = {}
+        for input_path in files:
+            output_path = make_output_path(input_path, output_dir, self.overwrite, taken, template.output_ext)
+            taken.add(output_path)
+            output_paths[input_path] = output_path
+            if input_path not in duplicates:
+                batch.put(input_path, output_path)
+
+        workers = max(1, int(jobs))
+        counts = {"succeeded": 0, "finished": 0, "queued": len(output_paths) - len(duplicates)}
+        lock = threading.Lock()
+        # 正在处理的任务：工作线程 → (优先级, 开始顺序, 输入文件)；paused 是其中暂停让位的。
+        running = {}
+        paused = set()
+        started_order = itertools.count()
+        threads = []
+        errors = []
+
+        def enqueue(paths, priority, preempt):
+            """批处理进行中加入新文件（新文件不再查重），或把还在排队的文件提前。"""
+            accepted, added = [], []
+            with lock:
+                for input_path in paths:
+                    if input_path in output_paths:
+                        if batch.promote(input_path, priority):
+                            accepted.append(input_path)
+                        continue
+                    output_path = make_output_path(input_path, output_dir, self.overwrite, taken, template.output_ext)
+                    if not batch.put(input_path, output_path, priority):
+                        break
+                    taken.add(output_path)
+                    output_paths[input_path] = output_path
+                    counts["queued"] += 1
+                    accepted.append(input_path)
+                    added.append(input_path)
+            self.metrics.inc("video_tool_queue_depth", len(added))
+            if added and self.throughput is not None:
+                self.throughput.add(sum(self._duration(path) for path in added))
+            for _ in accepted if preempt else ():
+                if not make_room(priority):
+                    break
+            return accepted
+
+        def make_room(priority):
+            """空闲的路数不够排队中的加急任务时，让优先级最低、最晚开始的任务让位，让了返回 True。
+
+            能暂停就暂停它并另开一路，否则中止它、放回队列。
+            """
+            with lock:
+                candidates = [
+                    (item[0], -item[1], token) for token, item in running.items()
+                    if token not in paused and token != self._segment_owner
+                ]
+                if len(running) - len(paused) + batch.waiting(priority) <= workers or not candidates:
+                    return False
+                low, _, token = min(candidates)
+                if low >= priority:
+                    return False
+                name = os.path.basename(running[token][2])
+                paused.add(token)
+            if self._pause_job(token):
+                self.log(f"加急任务插队：暂停 {name}，加急的处理完再继续", "warning")
+                self.metrics.inc("video_tool_preemptions_total", mode="pause")
+                start_worker(relieve, token, low, name)
+                return True
+            with lock:
+                paused.discard(token)
+                if token not in running:
+                    return False
+                del running[token]
+                with self._lock:
+                    self._requeue_jobs.add(token)
+            self.log(f"加急任务插队：中止 {name}，稍后重新处理", "warning")
+            self.metrics.inc("video_tool_preemptions_total", mode="requeue")
+            self._requeue_job(token)
+            return True
+
+        def dequeue():
+            with lock:
+                counts["queued"] -= 1
+            self.metrics.inc("video_tool_queue_depth", -1)
+
+        def run(priority, order, input_path, output_path):
+            if self.stop_event.is_set():
+                dequeue()
+                return
+            token = threading.get_ident()
+            started = []
+
+            def on_start():
+                started.append(time.monotonic())
+                dequeue()
+                with lock:
+                    running[token] = (priority, next(started_order), input_path)
+                self.metrics.inc("video_tool_jobs_running", 1)
+                on_event("start", input_path, None)
+
+            try:
+                outputs = self._run_governed(input_path, output_path, template, intro_path, outro_path, on_start=on_start)
+            except Exception as exc:
+                outputs = exc
+            finally:
+                with lock:
+                    running.pop(token, None)
+                    with self._lock:
+                        self._requeue_jobs.discard(token)
+            if started:
+                self.metrics.inc("video_tool_jobs_running", -1)
+            else:
+                dequeue()
+            if isinstance(outputs, JobPreempted):
+                # 放回原来的位置；片头片尾的共享片段已缓存，重新处理只重做这一个文件。
+                with lock:
+                    counts["queued"] += 1
+                self.metrics.inc("video_tool_queue_depth", 1)
+                if batch.put(input_path, output_path, priority, order):
+                    on_event("requeued", input_path, outputs)
+                    return
+                dequeue()
+            if isinstance(outputs, Exception):
+                exc, outputs = outputs, None
+                on_event("failed", input_path, exc)
+                succeeded = 0
+                self.metrics.inc("video_tool_jobs_total", result="failed")
+                category = "cancelled" if self.stop_event.is_set() else _failure_category(exc)
+                self.metrics.inc("video_tool_job_failures_total", category=category)
+            else:
+                on_event("done", input_path, outputs)
+                succeeded = 1
+                self.metrics.inc("video_tool_jobs_total", result="done")
+                self.metrics.observe("video_tool_job_seconds", time.monotonic() - started[0])
+            if self.throughput is not None:
+                self.throughput.complete(self._duration(input_path))
+            finish(input_path, succeeded)
+            for duplicate in copies.get(input_path, []):
+                if outputs is None:
+                    on_event("failed", duplicate, RuntimeError(f"与 {os.path.basename(input_path)} 内容相同，它处理失败，本文件也未生成"))
+                    finish(duplicate, 0)
+                    continue
+                on_event("start", duplicate, None)
+                try:
+                    cloned = self.clone_outputs(outputs, output_path, output_paths[duplicate])
+                except OSError as exc:
+                    on_event("failed", duplicate, exc)
+                    finish(duplicate, 0)
+                    continue
+                self.record_metrics(output_paths[duplicate], {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "input": os.path.abspath(duplicate),
+                    "outputs": [os.path.abspath(path) for path in cloned],
+                    "duplicate_of": os.path.abspath(input_path),
+                    "passed": True,
+                })
+                on_event("done", duplicate, cloned)
+                self.metrics.inc("video_tool_jobs_total", result="duplicate")
+                finish(duplicate, 1)
+
+        def finish(input_path, succeeded):
+            with lock:
+                counts["succeeded"] += succeeded
+                counts["finished"] += 1
+                finished = counts["finished"]
+            on_event("progress", input_path, finished)
+
+        def work(item):
+            try:
+                run(*item)
+            except BaseException as exc:
+                # 回调出错等意外：停掉整批，由调用方所在线程抛出。
+                errors.append(exc)
+                self.stop_event.set()
+                batch.close()
+                self.terminate_processes()
+            finally:
+                batch.task_done()
+
+        def worker():
+            while True:
+                item = batch.get()
+                if item is None:
+                    return
+                work(item)
+
+        def relieve(token, priority, name):
+            """顶替被暂停的那一路：只处理比它优先级高的任务，没有了就恢复它。"""
+            try:
+                while not self.stop_event.is_set():
+                    item = batch.get(above=priority)
+                    if item is None:
+                        break
+                    work(item)
+            finally:
+                with lock:
+                    paused.discard(token)
+                self._resume_job(token)
+                self.log(f"加急任务已处理完，继续处理 {name}")
+
+        def start_worker(target, *args):
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            with lock:
+                threads.append(thread)
+            thread.start()
+
+        self.start_batch()
+        self.metrics.inc("video_tool_queue_depth", counts["queued"])
+        if self.throughput is not None:
+            self.throughput.start(sum(self._duration(path) for path in output_paths if path not in duplicates), jobs, template.plan.preset)
+        self._batch_enqueue = enqueue
+        try:
+            for _ in range(workers):
+                start_worker(worker)
+            try:
+                while True:
+                    with lock:
+                        alive = [thread for thread in threads if thread.is_alive()]
+                    if not alive:
+                        break
+                    alive[0].join(0.5)
+            except BaseException:
+                # Ctrl+C 等中断：先停掉所有 FFmpeg，工作线程才能尽快退出。
+                self.stop_event.set()
+                batch.close()
+                self.terminate_processes()
+                raise
+            if errors:
+                raise errors[0]
+        finally:
+            self._batch_enqueue = None
+            batch.close()
+            # 被中断时没轮到的文件不再排队。
+            self.metrics.inc("video_tool_queue_depth", -counts["queued"])
+            self.finish_batch()
+        return counts["succeeded"]
+
+    def clone_outputs(self, outputs, output_path, target_path):
+        """把 output_path 这一份成品（含 HLS 分片、各档输出）换成 target_path 的名字再放一份，返回新的输出列表。
+
+        媒体文件硬链接（不行就复制），播放列表里引用的文件名跟着改，所以重写一份。
+        """
+        old_stem, new_stem = Path(output_path).stem, Path(target_path).stem
+        name_pattern = re.compile("^" + re.escape(old_stem) + r"(?=[_.])")
+        text_pattern = re.compile(r"(?<![\w.-])" + re.escape(old_stem) + r"(?=[_.])")
+        target_dir = os.path.dirname(target_path)
+
+        def renamed(path):
+            return os.path.join(target_dir, name_pattern.sub(lambda _: new_stem, os.path.basename(path), count=1))
+
+        cloned = []
+        for path in outputs:
+            for item in output_files(path):
+                if not item.endswith(".m3u8"):
+                    _link_or_copy(item, renamed(item))
+                    continue
+                with open(item, "r", encoding="utf-8", newline="") as f:
+                    text = f.read()
+                with open(renamed(item), "w", encoding="utf-8", newline="") as f:
+                    f.write(text_pattern.sub(lambda _: new_stem, text))
+            cloned.append(renamed(path))
+        return cloned
+
+    def estimate_batch(self, files, template: CommandTemplate, output_dir, intro_path="", outro_path="", jobs=1, history=()) -> BatchEstimate:
+        """开始之前预估每个文件和整批的输出体积、临时文件峰值和耗时，并检查输出盘、临时盘的剩余空间。
+
+        码率类模式按目标码率算，CRF/CQ 按经验公式算；输出目录（以及 history 里的）metrics.jsonl 有同一
+        编码器的历史记录时，按“实际体积 / 当时的预估”校准体积，耗时改用历史上每秒素材的实际处理时间。
+        """
+        jobs = max(1, int(jobs))
+        calibration = self._calibration(template, [os.path.join(output_dir, METRICS_FILE_NAME), *history])
+        copies = {}
+        for group in find_duplicates(files, self.probe_index) if self.dedupe else []:
+            copies.update((path, group[0]) for path in group[1:])
+        extra = sum(self._duration(path) for path in (intro_path, outro_path) if path)
+        # 转场和多规格输出一条命令直接出成品，没有正片片段文件，也不需要拼接。
+        one_pass = bool(template.renditions) or bool(template.profile.transition and extra)
+
+        items, taken, unknown, reclaim = [], set(), 0, 0
+        for input_path in files:
+            output_path = make_output_path(input_path, output_dir, self.overwrite, taken, template.output_ext)
+            taken.add(output_path)
+            info = self.probe(input_path)
+            item = FileEstimate(input_path, output_path, info.duration if info else 0.0, duplicate_of=copies.get(input_path, ""))
+            items.append(item)
+            if item.duration <= 0:
+                unknown += 1
+            elif not item.duplicate_of:
+                item.output_bytes = int(self.model_output_bytes(template, info, extra) * calibration["size_factor"])
+                item.temp_bytes = 0 if one_pass else self._model_temp_bytes(template, info)
+                per_second = calibration["seconds_per_media"]
+                item.seconds = item.duration * per_second if per_second else self._model_seconds(template, info, extra, one_pass)
+            if self.overwrite:
+                # 覆盖已有的成品时，旧文件腾出的空间可以抵掉一部分。
+                reclaim += sum(os.path.getsize(path) for path in output_files(output_path) if os.path.isfile(path))
+
+        # 片头片尾整批只预处理一次，放在批处理临时目录里直到整批结束。
+        shared_bytes, setup = 0, 0.0
+        if extra and not one_pass:
+            width, height, fps = self._estimate_geometry(template, self.probe(intro_path or outro_path))
+            shared_bytes = int(extra * (_estimate_video_kbps(template.plan, width, height, fps) + self._audio_kbps(template)) * 125)
+            setup = extra / _estimate_realtime(template.plan, width, height, fps)
+        # 按原来的顺序把任务分给最先空下来的那一路，和 run_batch 的工作线程一致。
+        lanes = [0.0] * jobs
+        for item in items:
+            if item.seconds:
+                heapq.heappush(lanes, heapq.heappop(lanes) + item.seconds)
+        temp_peak = shared_bytes + sum(sorted((item.temp_bytes for item in items), reverse=True)[:jobs])
+
+        estimate = BatchEstimate(
+            files=items, jobs=jobs, total_bytes=sum(item.output_bytes for item in items), temp_peak_bytes=temp_peak,
+            wall_seconds=setup + max(lanes), size_basis=calibration["size_basis"], speed_basis=calibration["speed_basis"],
+        )
+        if unknown:
+            estimate.warnings.append(f"{unknown} 个文件读不到时长（没有 ffprobe 或文件损坏），没有计入预估。")
+        estimate.output_free, output_device = _disk_free(output_dir)
+        estimate.temp_free, temp_device = _disk_free(tempfile.gettempdir())
+        needs = [("输出目录", estimate.output_free, max(0, estimate.total_bytes - reclaim))]
+        if temp_device is not None and temp_device == output_device:
+            needs[0] = ("输出目录（与临时目录同一磁盘）", estimate.output_free, needs[0][2] + temp_peak)
+        else:
+            needs.append(("临时目录", estimate.temp_free, temp_peak))
+        for label, free, need in needs:
+            if free is None or not need:
+                continue
+            if need > free:
+                estimate.problems.append(f"{label}所在磁盘剩余 {format_bytes(free)}，预计需要 {format_bytes(need)}。")
+            elif need * ESTIMATE_SPACE_MARGIN > free:
+                estimate.warnings.append(f"{label}所在磁盘剩余 {format_bytes(free)}，预计需要 {format_bytes(need)}，余量不足两成。")
+        return estimate
+
+    def _calibration(self, template: CommandTemplate, paths):
+        """读历史处理记录：同一编码器“实际体积 / 当时预估”的中位数作为体积系数；同一命令模板（没有就同一
+        编码器和预设）“处理耗时 / 素材时长”的中位数作为每秒素材的处理时间。重复文件和缺字段的旧记录跳过。"""
+        ratios, exact, similar = [], [], []
+        for path in dict.fromkeys(os.path.abspath(item) for item in paths):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or record.get("duplicate_of") or not record.get("bytes_out"):
+                    continue
+                if record.get("encoder") != template.plan.encoder:
+                    continue
+                if record.get("model_bytes"):
+                    ratios.append(record["bytes_out"] / record["model_bytes"])
+                media, elapsed = record.get("media_seconds") or 0, record.get("elapsed") or 0
+                if media > 0 and elapsed > 0:
+                    if record.get("template") == template.key:
+                        exact.append(elapsed / media)
+                    elif record.get("preset") == template.plan.preset:
+                        similar.append(elapsed / media)
+
+        def median(values):
+            values = sorted(values)
+            return values[len(values) // 2] if len(values) % 2 else (values[len(values) // 2 - 1] + values[len(values) // 2]) / 2
+
+        result = {"size_factor": 1.0, "seconds_per_media": None}
+        if template.plan.rate_mode == "目标文件大小":
+            result["size_basis"] = f"目标文件大小 {template.profile.target_size_mb} MB"
+        elif ratios:
+            result["size_factor"] = median(ratios)
+            result["size_basis"] = f"{len(ratios)} 条历史记录校准（实际 / 预估 = {result['size_factor']:.2f}）"
+        elif template.plan.rate_mode in ("固定码率 CBR", "平均码率 VBR") or template.plan.rate_mode in TWO_PASS_MODES:
+            result["size_basis"] = f"目标码率 {template.plan.bitrate} kbps"
+        else:
+            result["size_basis"] = f"CRF/CQ {template.plan.crf_cq} 经验公式（没有历史记录，误差可能较大）"
+        samples = exact or similar
+        if samples:
+            result["seconds_per_media"] = median(samples)
+            result["speed_basis"] = f"{len(samples)} 条{'同一命令模板' if exact else '同一编码器和预设'}的历史记录"
+        else:
+            result["speed_basis"] = f"{template.plan.encoder} 经验速度（没有历史记录，误差可能较大）"
+        return result
+
+    def _estimate_geometry(self, template: CommandTemplate, info: Optional[MediaInfo]):
+        """成品的宽、高、帧率；“跟随原视频”时取探测结果。"""
+        resolution = template.profile.resolution.strip()
+        if resolution == "跟随原视频":
+            width, height = (info.width, info.height) if info and info.width else (1920, 1080)
+        else:
+            width, height = parse_resolution(resolution)
+        fps = _number(template.profile.framerate, 0) or (info.fps if info and info.fps else 30.0)
+        return width, height, fps
+
+    def _audio_kbps(self, template: CommandTemplate):
+        return 0.0 if template.profile.audio_mode == "静音输出" else _number(template.profile.audio_bitrate, 192)
+
+    def _rendition_plans(self, template: CommandTemplate, info: Optional[MediaInfo]):
+        """[(编码计划, 宽, 高, 帧率)]：多规格输出每档一项，各档没填的码率沿用配置里的值。"""
+        width, height, fps = self._estimate_geometry(template, info)
+        if not template.profile.renditions:
+            return [(template.plan, width, height, fps)]
+        plans = []
+        for rung in template.profile.renditions:
+            changes = {key: getattr(rung, key) for key in ("bitrate", "maxrate", "crf_cq") if getattr(rung, key)}
+            plans.append((replace(template.plan, **changes), *parse_resolution(rung.resolution), fps))
+        return plans
+
+    def model_output_bytes(self, template: CommandTemplate, info: Optional[MediaInfo], extra_seconds=0.0):
+        """按编码参数（不含历史校准）估算一个文件所有输出的总字节数；extra_seconds 是片头片尾的时长。"""
+        if info is None or info.duration <= 0:
+            return 0
+        plans = self._rendition_plans(template, info)
+        if template.plan.rate_mode == "目标文件大小":
+            return int(_number(template.profile.target_size_mb) * 2**20 * len(plans))
+        seconds = info.duration + extra_seconds
+        kbps = sum(_estimate_video_kbps(plan, width, height, fps) + self._audio_kbps(template) for plan, width, height, fps in plans)
+        # 封装开销：MP4 约 2%，TS 分片的包头更多。
+        overhead = 1.08 if template.profile.container == "hls" else 1.02
+        return int(kbps * 125 * seconds * overhead)
+
+    def _model_temp_bytes(self, template: CommandTemplate, info: MediaInfo):
+        """分段拼接时一个任务的临时文件，也就是按成品参数编码好的正片片段。"""
+        if template.plan.rate_mode == "目标文件大小":
+            return self.model_output_bytes(template, info)  # 正片片段不会超过整条成品的目标大小
+        plan, width, height, fps = self._rendition_plans(template, info)[0]
+        return int(info.duration * (_estimate_video_kbps(plan, width, height, fps) + self._audio_kbps(template)) * 125)
+
+    def _model_seconds(self, template: CommandTemplate, info: MediaInfo, extra_seconds, one_pass=False):
+        """没有历史记录时估算一个任务的耗时：各次编码的素材时长除以经验速度。"""
+        seconds = ESTIMATE_JOB_OVERHEAD
+        for plan, width, height, fps in self._rendition_plans(template, info):
+            speed = _estimate_realtime(plan, width, height, fps)
+            # 一条命令出成品时片头片尾也一起编码；分段拼接时只编码正片（片头片尾整批共用），拼接只复制码流。
+            work = info.duration + extra_seconds if one_pass else info.duration
+            if template.two_pass:
+                work *= 2
+            seconds += work / speed
+        return seconds
+
+    def _run_governed(self, input_path, output_path, template: CommandTemplate, intro_path, outro_path, on_start=None, max_requeues=3):
+        """先向资源调度器申请内存/显存再处理；因内存吃紧被中止的任务等资源释放后重新排队。"""
+        need = self.governor.estimate(template, self.probe(input_path))
+        for attempt in range(max_requeues + 1):
+            token = self.governor.acquire(need, self.stop_event, self.log)
+            if attempt == 0 and on_start:
+                on_start()
+            try:
+                return self.process_single_file(input_path, output_path, template, intro_path, outro_path)
+            except MemoryPressureError:
+                if attempt >= max_requeues:
+                    raise
+                self.log(f"系统内存吃紧，已暂停任务，等内存释放后重新处理：{os.path.basename(input_path)}", "warning")
+            finally:
+                self.governor.release(token)
+
+    def start_batch(self):
+        """开始一批任务：片头片尾在同一批里只预处理一次。"""
+        self.finish_batch()
+        # 不用 TemporaryDirectory：它被回收时会自动删除目录，“保留临时文件”就失效了。
+        self._batch_dir = make_temp_dir("video_processor_")
+        self._segment_cache = {}
+        self._monitor_stop = threading.Event()
+        threading.Thread(target=self._watch_resources, args=(self._monitor_stop,), daemon=True).start()
+
+    def _watch_resources(self, stop, interval=2.0):
+        """定时采样各任务 FFmpeg 子进程的内存，系统内存见底时中止最后放行的任务。"""
+        while not stop.wait(interval):
+            with self._lock:
+                jobs = {token: list(processes) for token, processes in self._job_processes.items() if processes}
+            for token, processes in jobs.items():
+                self.governor.observe(token, sum(_process_rss_mb(process.pid) for process in processes))
+            victim = self.governor.check_pressure()
+            if victim is not None:
+                for process in jobs.get(victim, []):
+                    self._terminate(process)
+
+    def finish_batch(self):
+        if self._monitor_stop is not None:
+            self._monitor_stop.set()
+            self._monitor_stop = None
+        self.probe_index.save()
+        if self._batch_dir is None:
+            return
+        if self.keep_temp:
+            keep_temp_dir(self._batch_dir)
+            self.log(f"已保留临时目录：{self._batch_dir}", "warning")
+        else:
+            shutil.rmtree(self._batch_dir, ignore_errors=True)
+        self._batch_dir = None
+        self._segment_cache = {}
+
+    def process_single_file(self, input_path, output_path, template: CommandTemplate, intro_path="", outro_path=""):
+        """处理一个文件，返回实际写出的输出文件列表。"""
+        started = time.monotonic()
+        shared_template = template
+        if self.throughput is not None:
+            # 正片按吞吐目标换预设；片头片尾按原模板的码率参数编码，换了预设的只多编码一次（见 _process_main）。
+            preset = self.throughput.choose()
+            if preset != template.plan.preset:
+                template = self.derive_template(template, preset=preset)
+        template = self._complexity_template(template, input_path)
+        with self._lock:
+            self._encode_seconds.pop(threading.get_ident(), None)
+        written_since = time.time()
+        try:
+            if template.renditions:
+                outputs, quality = self._process_renditions(input_path, output_path, template, intro_path, outro_path)
+            elif template.profile.transition and (intro_path or outro_path):
+                outputs, quality = self._process_transition(input_path, output_path, template, intro_path, outro_path)
+            else:
+                outputs, quality = self._process_main(input_path, output_path, template, shared_template, intro_path, outro_path)
+        except BaseException:
+            targets = [rendition_output_path(output_path, rung.suffix) for rung in template.renditions] or [output_path]
+            self._remove_partial_outputs(targets, written_since)
+            raise
+
+        failures = [f"{os.path.basename(path)}：{'，'.join(result['failures'])}" for path, result in quality.items() if result["failures"]]
+        elapsed = time.monotonic() - started
+        with self._lock:
+            encode_seconds = self._encode_seconds.pop(threading.get_ident(), 0.0) or elapsed
+        media_seconds = self._duration(input_path)
+        extra_seconds = sum(self._duration(path) for path in (intro_path, outro_path) if path)
+        bytes_out = sum(os.path.getsize(item) for path in outputs for item in output_files(path) if os.path.isfile(item))
+        if self.throughput is not None:
+            self.throughput.observe(template.plan.preset, media_seconds, encode_seconds)
+        self.metrics.inc("video_tool_media_seconds_total", media_seconds)
+        self.metrics.inc("video_tool_encode_seconds_total", encode_seconds, encoder=template.plan.encoder)
+        self.metrics.inc("video_tool_bytes_out_total", bytes_out)
+        if media_seconds > 0 and encode_seconds > 0:
+            self.metrics.observe("video_tool_realtime_factor", media_seconds / encode_seconds, encoder=template.plan.encoder)
+        self.record_metrics(output_path, {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "input": os.path.abspath(input_path),
+            "outputs": [os.path.abspath(path) for path in outputs],
+            "profile": template.profile.name,
+            "template": template.key,
+            "encoder": template.plan.encoder,
+            "preset": template.plan.preset,
+            "elapsed": round(elapsed, 2),
+            "encode_seconds": round(encode_seconds, 2),
+            "media_seconds": round(media_seconds, 3),
+            "bytes_out": bytes_out,
+            # 按本次实际用的参数算出的预估体积，预估整批时用“实际 / 预估”校准。
+            "model_bytes": self.model_output_bytes(template, self.probe(input_path), extra_seconds),
+            "quality": {os.path.basename(path): result for path, result in quality.items()},
+            "passed": not failures,
+        })
+        if failures:
+            raise QualityCheckError("画质校验未通过（输出已保留）：" + "；".join(failures))
+        return outputs
+
+    def _process_main(self, input_path, output_path, template: CommandTemplate, shared_template: CommandTemplate, intro_path, outro_path):
+        """分段编码、复制拼接：各段直接按成品参数编码（固定关键帧间隔、封闭 GOP、统一时间基、音频对齐画面），
+        拼接只复制码流，整条成品不再重新编码。"""
+        if intro_path or outro_path:
+            info = self.probe(input_path)
+            template, shared_template = self._splice_template(template, info), self._splice_template(shared_template, info)
+            if template.plan.rate_mode == "目标文件大小":
+                # 码率按片头 + 正片 + 片尾的总时长反推，各段用同一码率。
+                template = shared_template = self._sized_template(template, [path for path in (intro_path, input_path, outro_path) if path])
+            elif shared_template.plan.preset != template.plan.preset:
+                # 编码预设决定参考帧数等码流参数，各段一致才能复制拼接后连续解码；
+                # 码率参数不影响这些，按画面复杂度调过码率的正片仍共用同一份片头片尾。
+                shared_template = self.derive_template(shared_template, preset=template.plan.preset)
+        elif template.plan.rate_mode == "目标文件大小":
+            template = self._sized_template(template, [input_path])
+
+        temp_dir = make_temp_dir("video_processor_")
+        segments = []
+        try:
+            if intro_path:
+                segments.append(self._shared_segment(intro_path, "001_intro.mp4", temp_dir, shared_template))
+
+            main_temp = os.path.join(temp_dir, "002_main.mp4")
+            overlay = self._overlay(template.profile, input_path, self._output_width(template.profile.resolution, input_path))
+            seconds = self._thumbnail_seconds(template, input_path)
+            thumbnails = (os.path.abspath(output_path), seconds) if seconds else None
+            self._preprocess_video(input_path, main_temp, template, overlay, thumbnails)
+            segments.append(main_temp)
+
+            if outro_path:
+                segments.append(self._shared_segment(outro_path, "003_outro.mp4", temp_dir, shared_template))
+
+            self._concat_videos(segments, output_path, template)
+
+            quality = {}
+            if template.profile.verify_quality:
+                # concat 按每段的封装时长接续，正片在输出里的起点就是片头段的时长。
+                offset = self._duration(segments[0], cache=False) if intro_path else 0.0
+                quality[output_path] = self.verify_quality(
+                    input_path, output_path, self._build_video_filter(template.profile), offset, self._duration(main_temp, cache=False),
+                    template.profile,
+                    overlay=overlay,
+                )
+            return [output_path], quality
+        finally:
+            if self.keep_temp:
+                keep_temp_dir(temp_dir)
+                self.log(f"已保留临时目录：{temp_dir}", "warning")
+            else:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _remove_partial_outputs(self, targets, since):
+        """失败或被取消时删掉写了一半的成品（含 HLS 分片、封面拼图）。只删这次写过的，
+        覆盖模式下还没被改动的旧成品保留。"""
+        for target in targets:
+            for path in output_files(target):
+                try:
+                    if os.path.getmtime(path) >= since - 1:
+                        os.remove(path)
+                        self.log(f"已删除未完成的输出：{path}", "debug")
+                except OSError:
+                    pass
+
+    def _splice_template(self, template: CommandTemplate, info: Optional[MediaInfo]) -> CommandTemplate:
+        """复制拼接要求各段画面尺寸和帧率一致：分辨率/帧率“跟随原视频”时按正片固定下来，片头片尾照此规整。
+        同样的固定只编译一次，片头片尾的缓存按模板 key 照常命中。"""
+        profile = template.profile
+        changes = {}
+        if info is not None and profile.resolution.strip() == "跟随原视频" and info.width and info.height:
+            changes["resolution"] = f"{info.width // 2 * 2}x{info.height // 2 * 2}"
+        if info is not None and profile.framerate.strip() in ("", "跟随原视频") and info.fps > 0:
+            changes["framerate"] = f"{round(info.fps, 3):g}"
+        if not changes:
+            return template
+        cache_key = (template.key, "splice", tuple(sorted(changes.items())))
+        with self._lock:
+            cached = self._derived_templates.get(cache_key)
+        if cached is None:
+            cached = self._compile(replace(profile, **changes), template.plan)
+            with self._lock:
+                self._derived_templates[cache_key] = cached
+        return cached
+
+    def _transition_layout(self, template: CommandTemplate, sources, main_index):
+        """转场需要的统一帧率、各段对齐到帧的时长，以及正片以外的段按正片尺寸规整的画面滤镜。"""
+        if any(info is None or info.duration <= 0 for _, info in sources):
+            raise RuntimeError("转场需要 ffprobe 读取各段时长，请把 ffprobe 放到 ffmpeg 同一目录。")
+        profile = template.profile
+        main = sources[main_index][1]
+        fps = profile.framerate.strip()
+        fps = float(fps) if fps and fps != "跟随原视频" else round(main.fps or 30, 3)
+        if profile.resolution.strip() == "跟随原视频":
+            # xfade 要求两路画面尺寸一致，片头片尾按正片尺寸（取偶数）规整。
+            profile = replace(profile, resolution=f"{main.width // 2 * 2}x{main.height // 2 * 2}")
+        durations = [round(info.duration * fps) / fps for _, info in sources]
+        seconds = float(profile.transition_duration)
+        for i, (path, _) in enumerate(sources):
+            joins = (i > 0) + (i < len(sources) - 1)
+            if durations[i] <= seconds * joins:
+                raise RuntimeError(f"转场时长 {seconds:g} 秒太长：{os.path.basename(path)} 只有 {durations[i]:.2f} 秒。")
+        return self._build_video_filter(profile), durations, fps
+
+    def _process_transition(self, input_path, output_path, template: CommandTemplate, intro_path, outro_path):
+        """带转场的单规格输出：不做分段预处理和拼接，一个滤镜图里规整、衔接并编码成品。"""
+        sources = [(path, self.probe(path)) for path in (intro_path, input_path, outro_path) if path]
+        main_index = 1 if intro_path else 0
+        video_filter, durations, fps = self._transition_layout(template, sources, main_index)
+        seconds = float(template.profile.transition_duration)
+        overlays = [None] * len(sources)
+        overlays[main_index] = self._overlay(template.profile, input_path, self._output_width(template.profile.resolution, input_path))
+        audio_filters = [self._loudnorm_filter(template.profile, path, info) for path, info in sources]
+        if template.plan.rate_mode == "目标文件大小":
+            template = self._sized_template(template, [path for path, _ in sources], overlap=seconds * (len(sources) - 1))
+        self.log(f"转场：{TRANSITIONS[template.profile.transition]} {seconds:g} 秒，各段 {' + '.join(f'{d:.3f}' for d in durations)} 秒：{os.path.basename(input_path)}")
+
+        thumbnail_index = main_index if template.profile.thumbnails else -1
+        if not template.two_pass:
+            self._run_command(
+                template.transition_command(
+                    self.ffmpeg_path, sources, output_path, video_filter, durations, fps, self.overwrite, audio_filters, overlays=overlays,
+                    thumbnail_index=thumbnail_index,
+                ),
+                stage="transition",
+            )
+        else:
+            scratch_dir = make_temp_dir("video_processor_")
+            try:
+                for pass_no in (1, 2):
+                    self._run_command(
+                        template.transition_command(
+                            self.ffmpeg_path, sources, os.path.abspath(output_path), video_filter, durations, fps,
+                            self.overwrite, audio_filters, pass_no, "pass_stats", overlays, thumbnail_index,
+                        ),
+                        cwd=scratch_dir,
+                        stage="transition",
+                    )
+            finally:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        quality = {}
+        if template.profile.verify_quality:
+            # 正片在输出里从“片头时长 - 转场时长”开始，首尾各有一段转场画面不参与对比。
+            offset = durations[0] - seconds if intro_path else 0.0
+            quality[output_path] = self.verify_quality(
+                input_path, output_path, video_filter, offset, durations[main_index], template.profile, margin=seconds,
+                overlay=overlays[main_index],
+            )
+        return [output_path], quality
+
+    def render_preview(self, input_path, template: CommandTemplate, intro_path="", outro_path="") -> str:
+        """渲染正片和片头/片尾拼接点前后各几秒的预览，返回预览文件路径；没有片头片尾时取正片中间一段。
+
+        参数和正式处理一致（“跟随原视频”按正片固定、画面复杂度和目标文件大小的码率调整、水印字幕、转场），
+        只把编码预设换成“速度优先”。按最终参数和各段来源缓存，设置没变时直接返回上次的预览。
+        """
+        info = self.probe(input_path)
+        if info is None or info.duration <= 0:
+            raise RuntimeError("预览需要 ffprobe 读取视频时长，请把 ffprobe 放到 ffmpeg 同一目录。")
+        sources = [path for path in (intro_path, input_path, outro_path) if path]
+        template = self._complexity_template(template, input_path)
+        if len(sources) > 1:
+            template = self._splice_template(template, info)
+        if template.plan.rate_mode == "目标文件大小":
+            overlap = float(template.profile.transition_duration) * (len(sources) - 1) if template.profile.transition else 0.0
+            template = self._sized_template(template, sources, overlap=overlap)
+        if template.plan.preset != "速度优先":
+            template = self.derive_template(template, preset="速度优先")
+        profile = template.profile
+        fps = profile.framerate.strip()
+        fps = float(fps) if fps and fps != "跟随原视频" else round(info.fps or 30, 3)
+        seconds = PREVIEW_SECONDS
+        if profile.transition:
+            # 转场要落在两段之间，每段至少比转场长半秒。
+            seconds = max(seconds, float(profile.transition_duration) + 0.5)
+
+        def frames(value):
+            return max(1, round(value * fps)) / fps
+
+        overlay = self._overlay(profile, input_path, self._output_width(profile.resolution, input_path))
+        pieces = []
+        if intro_path:
+            intro = self.probe(intro_path)
+            length = frames(min(seconds, intro.duration if intro else seconds))
+            start = max(0.0, (intro.duration if intro else length) - length)
+            pieces += [(intro_path, intro, start, length, None, 0), (input_path, info, 0.0, frames(min(seconds, info.duration)), overlay, 0)]
+        if outro_path:
+            outro = self.probe(outro_path)
+            length = frames(min(seconds, info.duration))
+            pieces += [
+                (input_path, info, max(0.0, info.duration - length), length, overlay, 1),
+                (outro_path, outro, 0.0, frames(min(seconds, outro.duration if outro else seconds)), None, 1),
+            ]
+        if not pieces:
+            length = frames(min(seconds * 2, info.duration))
+            pieces.append((input_path, info, (info.duration - length) / 2, length, overlay, 0))
+
+        identity = []
+        for path, _, start, length, _, _ in pieces:
+            st = os.stat(path)
+            identity.append([os.path.abspath(path), st.st_size, st.st_mtime_ns, round(start, 3), round(length, 3)])
+        key = json.dumps([template.key, identity, asdict(overlay) if overlay else None], ensure_ascii=False)
+        folder = APP_CACHE_DIR / "previews"
+        target = folder / f"preview_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.mp4"
+        self.metrics.cache("preview", target.is_file())
+        if target.is_file():
+            os.utime(target)
+            self.log(f"预览参数没变，直接使用缓存：{target}")
+            return str(target)
+
+        folder.mkdir(parents=True, exist_ok=True)
+        temp = target.with_name(f"{target.stem}.{os.getpid()}.{threading.get_ident()}.tmp.mp4")
+        try:
+            self._run_command(
+                template.preview_command(self.ffmpeg_path, pieces, str(temp), self._build_video_filter(profile), fps), stage="preview"
+            )
+            os.replace(temp, target)
+        finally:
+            if temp.exists():
+                temp.unlink()
+        # 只保留最近用过的几个预览。
+        previews = sorted(folder.glob("preview_*.mp4"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for old in previews[PREVIEW_CACHE_LIMIT:]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+        self.log(f"预览已生成（{len(pieces)} 段，每段约 {seconds:g} 秒）：{target}", "success")
+        return str(target)
+
+    def _thumbnail_seconds(self, template: CommandTemplate, input_path):
+        """需要出封面和拼图时返回正片编码后的画面时长；没开启或读不到时长时返回 0。"""
+        if not template.profile.thumbnails:
+            return 0.0
+        info = self.probe(input_path)
+        if info is None or info.duration <= 0:
+            self.log(f"读不到时长，跳过封面和缩略图拼图：{os.path.basename(input_path)}", "warning")
+            return 0.0
+        return self._segment_duration(template.profile, info)
+
+    def _output_width(self, resolution, input_path):
+        resolution = resolution.strip()
+        if resolution != "跟随原视频":
+            return parse_resolution(resolution)[0]
+        info = self.probe(input_path)
+        return info.width // 2 * 2 if info and info.width else 1920
+
+    def _overlay(self, profile: EncodeProfile, input_path, width) -> Optional[OverlaySpec]:
+        """准备本文件在给定输出宽度下的水印和字幕；都没配置时返回 None。"""
+        if not profile.watermark and not profile.caption:
+            return None
+        image = self._watermark_asset(profile.watermark, round(width * float(profile.watermark_scale))) if profile.watermark else ""
+        textfile = font = ""
+        if profile.caption:
+            if "drawtext" in self._get_available_filters():
+                textfile = self._caption_file(self._caption_text(profile.caption, input_path))
+                font = profile.caption_font or default_caption_font()
+            elif not self._caption_warned:
+                self._caption_warned = True
+                self.log("FFmpeg 没有 drawtext 滤镜（编译时未启用 freetype），跳过字幕，只叠加水印。", "warning")
+        if not image and not textfile:
+            return None
+        return OverlaySpec(image, profile.watermark_position, textfile, font)
+
+    def _watermark_asset(self, path, width):
+        """水印图片按目标宽度缩放一次，存成带透明通道的 PNG 放在缓存目录，之后直接叠加，不再逐帧缩放。"""
+        width = max(2, int(width))
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{width}"
+        folder = APP_CACHE_DIR / "overlays"
+        target = folder / f"watermark_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.png"
+        # 并行任务同时要同一个尺寸的水印时，只缩放一次。
+        with self._segment_lock:
+            self.metrics.cache("watermark", target.is_file())
+            if not target.is_file():
+                folder.mkdir(parents=True, exist_ok=True)
+                temp = target.with_name(f"{target.stem}.{os.getpid()}.tmp.png")
+                self._run_command([
+                    self.ffmpeg_path, "-hide_banner", "-y", "-i", path,
+                    "-vf", f"scale={width}:-1:flags=lanczos,format=rgba", "-frames:v", "1", "-update", "1", str(temp),
+                ], stage="overlay")
+                os.replace(temp, target)
+                self.log(f"水印已按宽度 {width} 缩放并缓存：{os.path.basename(path)}")
+        return str(target)
+
+    def _caption_text(self, template, input_path):
+        """套用字幕模板：{stem} 文件名（不含扩展名）、{name} 文件名、{parent} 所在文件夹、
+        {title} 视频元数据里的标题（没有时用文件名）、{date} 文件修改日期。"""
+        info = self.probe(input_path)
+        stem = Path(input_path).stem
+        values = {
+            "stem": stem,
+            "name": os.path.basename(input_path),
+            "parent": Path(input_path).resolve().parent.name,
+            "title": (info.title if info else "") or stem,
+            "date": time.strftime("%Y-%m-%d", time.localtime(os.path.getmtime(input_path))),
+        }
+        return re.sub(r"\{(\w+)\}", lambda m: values.get(m.group(1), m.group(0)), template)
+
+    def _caption_file(self, text):
+        """字幕文字写进 UTF-8 文本文件交给 drawtext 读取，省掉引号、冒号、百分号等的转义。"""
+        folder = APP_CACHE_DIR / "overlays"
+        path = folder / f"caption_{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}.txt"
+        if not path.is_file():
+            folder.mkdir(parents=True, exist_ok=True)
+            temp = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+            temp.write_text(text, encoding="utf-8")
+            os.replace(temp, path)
+        return str(path)
+
+    def _complexity_template(self, template: CommandTemplate, input_path):
+        """按画面复杂度微调本文件的 CRF / 最高码率；片头片尾仍用原模板，缓存照常命中。"""
+        if not template.profile.scene_analysis or template.plan.rate_mode not in ("智能动态码率", "恒定质量 CRF/CQ"):
+            return template
+        result = self.analyze_complexity(input_path)
+        if not result:
+            return template
+        _, level, crf_delta, maxrate_scale = next(item for item in COMPLEXITY_LEVELS if result["bpp"] < item[0])
+        crf = min(max(int(template.plan.crf_cq) + crf_delta, 0), 51)
+        maxrate = str(int(int(template.plan.maxrate) * maxrate_scale)) if template.plan.maxrate else ""
+        self.log(f"画面复杂度：{level}（bpp {result['bpp']}）→ CRF {crf}，最高码率 {maxrate or '-'}k：{os.path.basename(input_path)}")
+        return self.derive_template(template, crf_cq=str(crf), maxrate=maxrate)
+
+    def analyze_complexity(self, path) -> Optional[dict]:
+        """抽几段低分辨率画面做一次 CRF 试编码来衡量复杂度，结果写入探测索引，重复运行直接命中。"""
+        cached = self.probe_index.get(path, "complexity")
+        self.metrics.cache("complexity", bool(cached))
+        if cached:
+            return cached
+        if "libx264" not in self._get_available_encoders():
+            self.log("FFmpeg 没有 libx264，跳过画面复杂度分析。", "warning")
+            return None
+
+        info = self.probe(path)
+        duration = info.duration if info else 0.0
+        if duration >= 8:
+            # 长视频在开头、中间、结尾附近各取 2 秒。
+            starts, length = [duration * ratio - 1 for ratio in (0.15, 0.5, 0.85)], 2.0
+        else:
+            starts, length = [0.0], min(duration or 6.0, 6.0)
+
+        cmd = [self.ffmpeg_path, "-hide_banner"]
+        for start in starts:
+            cmd += ["-ss", f"{max(0.0, start):.2f}", "-t", f"{length:.2f}", "-i", path]
+        graph = ";".join(f"[{i}:v]scale=320:320,setsar=1,fps=15[p{i}]" for i in range(len(starts)))
+        graph += ";" + "".join(f"[p{i}]" for i in range(len(starts))) + f"concat=n={len(starts)}:v=1:a=0[probe]"
+        cmd += ["-filter_complex", graph, "-map", "[probe]", "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", "-f", "null", "-"]
+        output = self._run_command(cmd, stage="complexity")
+
+        size_bytes, frames = _parse_encode_stats(output)
+        if not size_bytes or not frames:
+            self.log(f"画面复杂度分析没有得到有效结果，按原参数处理：{path}", "warning")
+            return None
+        bpp = size_bytes * 8 / (320 * 320 * frames)
+        result = {"bpp": round(bpp, 4), "level": next(item[1] for item in COMPLEXITY_LEVELS if bpp < item[0])}
+        self.probe_index.put(path, "complexity", result)
+        return result
+
+    def _sized_template(self, template: CommandTemplate, segments, overlap=0.0):
+        """目标文件大小模式：按片头 + 正片 + 片尾的总时长反推视频码率；overlap 是转场重叠掉的时长。"""
+        infos = [self.probe(path) for path in segments]
+        if any(info is None or info.duration <= 0 for info in infos):
+            raise RuntimeError("目标文件大小模式需要 ffprobe 读取视频时长，请把 ffprobe 放到 ffmpeg 同一目录。")
+        duration = sum(info.duration for info in infos) - overlap
+        audio_kbps = 0 if template.profile.audio_mode == "静音输出" else int(template.plan.audio_bitrate or 192)
+        # 预留约 2% 给 MP4 封装开销。
+        total_kbits = float(template.profile.target_size_mb) * 8192 * 0.98
+        video_kbps = max(100, int(total_kbits / duration - audio_kbps))
+        self.log(f"目标 {template.profile.target_size_mb} MB / 时长 {duration:.1f} 秒 → 视频码率 {video_kbps} kbps", "info")
+        return self.derive_template(template, bitrate=str(video_kbps), maxrate="")
+
+    def _process_renditions(self, input_path, output_path, template: CommandTemplate, intro_path, outro_path):
+        sources = [(path, self.probe(path)) for path in (intro_path, input_path, outro_path) if path]
+        audio_filters = [self._loudnorm_filter(template.profile, path, info) for path, info in sources]
+        outputs = [rendition_output_path(output_path, rung.suffix) for rung in template.renditions]
+        main_index = 1 if intro_path else 0
+        durations, fps, margin = (), 0.0, 0.0
+        if template.profile.transition and len(sources) > 1:
+            _, durations, fps = self._transition_layout(template, sources, main_index)
+            margin = float(template.profile.transition_duration)
+        overlays = [None] * len(sources)
+        rung_overlays = [self._overlay(template.profile, input_path, parse_resolution(rung.resolution)[0]) for rung in template.profile.renditions]
+        if any(rung_overlays):
+            overlays[main_index] = rung_overlays
+        # 封面和拼图取第一档的画面，放在第一档输出旁边。
+        seconds = (durations[main_index] if durations else self._thumbnail_seconds(template, input_path)) if template.profile.thumbnails else 0
+        thumbnails = (main_index, outputs[0], seconds) if seconds else None
+        self._run_command(
+            template.ladder_command(self.ffmpeg_path, sources, outputs, self.overwrite, audio_filters, durations, fps, overlays, thumbnails),
+            stage="ladder",
+        )
+
+        quality = {}
+        if template.profile.verify_quality:
+            offset = (durations[0] - margin if durations else self._duration(intro_path)) if intro_path else 0.0
+            duration = self._duration(input_path)
+            for rung, path, overlay in zip(template.renditions, outputs, rung_overlays):
+                quality[path] = self.verify_quality(
+                    input_path, path, rung.video_filter, offset, duration, template.profile, margin=margin, overlay=overlay
+                )
+        if template.output_ext == ".m3u8":
+            self._write_master_playlist(output_path, outputs)
+            outputs = [output_path] + outputs
+        return outputs, quality
+
+    def _write_master_playlist(self, master_path, playlists):
+        """多规格 HLS：按各档实际的平均码率和分辨率写主播放列表，播放器据此自适应切换。"""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+        for path in playlists:
+            info = self.probe(path, cache=False)
+            size = sum(os.path.getsize(item) for item in output_files(path)[1:] if os.path.isfile(item))
+            # BANDWIDTH 应是峰值码率，平均码率上浮两成作近似。
+            bandwidth = int(size * 8 / info.duration * 1.2) if info and info.duration else 0
+            resolution = f",RESOLUTION={info.width}x{info.height}" if info and info.width else ""
+            lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}{resolution}", os.path.basename(path)]
+        with open(master_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _duration(self, path, cache=True):
+        info = self.probe(path, cache)
+        return info.duration if info else 0.0
+
+    def verify_quality(
+        self, source_path, output_path, video_filter, offset=0.0, duration=0.0, profile: Optional[EncodeProfile] = None, margin=0.0,
+        overlay: Optional[OverlaySpec] = None,
+    ) -> dict:
+        """抽样比较输出里的正片部分与按同样滤镜规整后的源视频，计算 SSIM / PSNR，有 libvmaf 时加算 VMAF。
+
+        只取几段 2 秒的窗口（短视频取开头一段），输入端 -ss 跳转，开销只有完整编码的一小部分。
+        margin 是正片首尾要跳过的秒数（转场画面和原视频本来就不一样）；overlay 是正片的叠加层，
+        参考画面也叠上同样的水印/字幕，只比较编码损失。
+        """
+        span = max(duration - 2 * margin, 0.0) if duration else 0.0
+        if span >= 12:
+            starts, length = [margin + span * ratio - 1 for ratio in (0.2, 0.5, 0.8)], 2.0
+        else:
+            starts, length = [margin], min(span or 4.0, 4.0)
+        metrics = ["ssim", "psnr"]
+        if "libvmaf" in self._get_available_filters():
+            metrics.append(f"libvmaf=n_threads={min(os.cpu_count() or 1, 8)}")
+
+        cmd = [self.ffmpeg_path, "-hide_banner"]
+        graph = []
+        count = len(starts)
+        # HLS 播放列表在输入端 -ss 跳转不可靠：整条只读一次，在滤镜里按时间裁出各个窗口。
+        playlist = output_path.endswith(".m3u8")
+        if playlist:
+            cmd += ["-i", output_path]
+            graph.append(f"[0:v]setpts=PTS-STARTPTS,split={count}" + "".join(f"[o{i}]" for i in range(count)))
+        for i, start in enumerate(starts):
+            start = max(0.0, start)
+            if playlist:
+                graph.append(f"[o{i}]trim=start={offset + start:.3f}:duration={length:.3f},setpts=PTS-STARTPTS,format=yuv420p[d{i}]")
+            else:
+                graph.append(f"[{cmd.count('-i')}:v]setpts=PTS-STARTPTS,format=yuv420p[d{i}]")
+                cmd += ["-ss", f"{offset + start:.3f}", "-t", f"{length:.3f}", "-i", output_path]
+            reference_filter = overlay.apply(video_filter, f"r{i}") if overlay else video_filter
+            graph.append(f"[{cmd.count('-i')}:v]{reference_filter},setpts=PTS-STARTPTS[r{i}]")
+            cmd += ["-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", source_path]
+        for side in ("d", "r"):
+            graph.append(
+                "".join(f"[{side}{i}]" for i in range(count))
+                + f"concat=n={count}:v=1:a=0,split={len(metrics)}"
+                + "".join(f"[{side}m{k}]" for k in range(len(metrics)))
+            )
+        # 质量滤镜的第一个输入是待测视频，第二个是参考视频。
+        graph += [f"[dm{k}][rm{k}]{metric}" for k, metric in enumerate(metrics)]
+        cmd += ["-filter_complex", ";".join(graph), "-f", "null", "-"]
+        output = self._run_command(cmd, stage="verify")
+
+        result = {"ssim": None, "psnr": None, "vmaf": None, "sampled_seconds": round(count * length, 2)}
+        for line in output:
+            m = re.search(r"SSIM .*All:([\d.]+)", line)
+            if m:
+                result["ssim"] = round(float(m.group(1)), 4)
+            m = re.search(r"PSNR .*average:([\d.]+|inf)", line)
+            if m:
+                result["psnr"] = round(float(m.group(1)), 2) if m.group(1) != "inf" else 99.0
+            m = re.search(r"VMAF score:\s*([\d.]+)", line)
+            if m:
+                result["vmaf"] = round(float(m.group(1)), 2)
+
+        failures = []
+        profile = profile or EncodeProfile()
+        for key, label, bound in (("ssim", "SSIM", profile.min_ssim), ("vmaf", "VMAF", profile.min_vmaf)):
+            if str(bound).strip() and result[key] is not None and result[key] < float(bound):
+                failures.append(f"{label} {result[key]} < {bound}")
+        if result["ssim"] is None:
+            failures.append("没有得到 SSIM 结果")
+        result["failures"] = failures
+
+        summary = " / ".join(
+            f"{label} {result[key]}" for key, label in (("ssim", "SSIM"), ("psnr", "PSNR"), ("vmaf", "VMAF")) if result[key] is not None
+        )
+        self.log(f"画质校验：{summary}（抽样 {result['sampled_seconds']} 秒）：{os.path.basename(output_path)}", "warning" if failures else "info")
+        return result
+
+    def record_metrics(self, output_path, record):
+        """把一条处理记录追加到输出目录的 metrics.jsonl，并行任务共用一把锁。"""
+        path = os.path.join(os.path.dirname(os.path.abspath(output_path)), METRICS_FILE_NAME)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as exc:
+                self.log(f"写入处理记录失败：{exc}", "warning")
+
+    def probe(self, path, cache=True) -> Optional[MediaInfo]:
+        """用 ffprobe 读取时长、分辨率和音轨信息；没有 ffprobe 或读取失败时返回 None。
+
+        cache=False 用于临时片段和中间产物：这些路径处理完就删或每次重写，记进探测索引永远不会再命中，只会挤掉源文件的记录。
+        """
+        if cache:
+            cached = self.probe_index.get(path, "probe")
+            # 旧版本写入的记录字段不全时重新探测。
+            hit = bool(cached) and set(cached) == {f.name for f in fields(MediaInfo)}
+            self.metrics.cache("probe", hit)
+            if hit:
+                return MediaInfo(**cached)
+        if not self.ffprobe_path:
+            return None
+        info = None
+        try:
+            result = self.backend.run(
+                [self.ffprobe_path, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path], timeout=30,
+            )
+            info = _parse_probe_json(json.loads(result.stdout or "{}"))
+        except Exception as exc:
+            self.log(f"读取视频信息失败：{path}（{exc}）", "warning")
+        if cache and info is not None:
+            self.probe_index.put(path, "probe", asdict(info))
+        return info
+
+    def _shared_segment(self, source_path, name, temp_dir, template: CommandTemplate):
+        """片头/片尾每个文件都一样，按（模板 key + 源文件）缓存编码好的片段。"""
+        if self._batch_dir is None:
+            output_path = os.path.join(temp_dir, name)
+            self._preprocess_video(source_path, output_path, template)
+            return output_path
+
+        st = os.stat(source_path)
+        cache_key = (template.key, os.path.abspath(source_path), st.st_size, st.st_mtime_ns)
+        # 并行时多个任务会同时要同一个片头，加锁保证只预处理一次，其余任务等结果。
+        with self._segment_lock:
+            cached = self._segment_cache.get(cache_key)
+            self.metrics.cache("segment", bool(cached) and os.path.isfile(cached))
+            if cached and os.path.isfile(cached):
+                return cached
+            digest = hashlib.sha256(repr(cache_key).encode("utf-8")).hexdigest()[:16]
+            output_path = os.path.join(self._batch_dir, f"{template.key}_{digest}_{name}")
+            # 其他任务都在等这一份，正在编码它的任务不能暂停让位（见 run_batch）。
+            self._segment_owner = threading.get_ident()
+            try:
+                self._preprocess_video(source_path, output_path, template)
+            finally:
+                self._segment_owner = None
+            self._segment_cache[cache_key] = output_path
+            return output_path
+
+    def _preprocess_video(self, input_path, output_path, template: CommandTemplate, overlay: Optional[OverlaySpec] = None, thumbnails=None):
+        audio = None if template.profile.audio_mode == "静音输出" else self._audio_plan(template, input_path)
+        if audio is not None:
+            self.log(f"音频：{audio.action} {audio.filter}：{os.path.basename(input_path)}", "debug")
+        video_filter = overlay.apply(self._build_video_filter(template.profile)) if overlay else ""
+        if not template.two_pass:
+            self._run_command(
+                template.preprocess_command(self.ffmpeg_path, input_path, output_path, audio, video_filter, thumbnails=thumbnails), stage="preprocess"
+            )
+            return
+        # 两遍编码逐段进行。统计文件放在输出旁边、以输出文件名区分，并行任务和共享的片头片尾互不干扰。
+        folder = os.path.dirname(os.path.abspath(output_path))
+        stats_name = f"{os.path.basename(output_path)}.pass"
+        try:
+            for pass_no in (1, 2):
+                self._run_command(
+                    template.preprocess_command(
+                        self.ffmpeg_path, os.path.abspath(input_path), os.path.abspath(output_path), audio, video_filter, pass_no, stats_name,
+                        thumbnails if pass_no == 2 else None,
+                    ),
+                    cwd=folder,
+                    stage="preprocess",
+                )
+        finally:
+            for path in Path(folder).glob(f"{stats_name}*"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _concat_videos(self, segments, output_path, template: CommandTemplate):
+        list_file = os.path.join(make_temp_dir("concat_list_"), "filelist.txt")
+        try:
+            with open(list_file, "w", encoding="utf-8") as f:
+                for file_path in segments:
+                    safe_path = file_path.replace("'", "'\\''")
+                    f.write(f"file '{safe_path}'\n")
+            self._run_command(template.concat_command(self.ffmpeg_path, list_file, output_path, self.overwrite), stage="concat")
+        finally:
+            shutil.rmtree(os.path.dirname(list_file), ignore_errors=True)
+
+    def _run_command(self, cmd, cwd=None, stage="other"):
+        """执行一条 FFmpeg 命令并返回输出行；stage 用于按阶段统计耗时。"""
+        if self.stop_event.is_set():
+            raise RuntimeError("用户已停止任务")
+        tid = threading.get_ident()
+        if tid in self._requeue_jobs:
+            raise JobPreempted("给加急任务让位，稍后重新处理")
+        started = time.monotonic()
+        self.log("执行命令：" + " ".join(self._quote_cmd(c) for c in cmd), "debug")
+        output_lines: List[str] = []
+        progress = None
+        process = None
+        try:
+            process = self.backend.popen(cmd, cwd)
+            with self._lock:
+                self._processes.add(process)
+                self._job_processes.setdefault(tid, set()).add(process)
+                # 任务暂停期间开始的命令也立即暂停，等让位结束一起恢复。
+                if tid in self._paused_jobs and self.backend.suspend(process):
+                    self._suspended.add(process)
+            for line in process.stdout:
+                if self.stop_event.is_set():
+                    self._terminate(process)
+                    raise RuntimeError("用户已停止任务")
+                line = line.strip()
+                if line:
+                    output_lines.append(line)
+                    self.log(line, "debug")
+                    parsed = _parse_progress(line)
+                    if parsed:
+                        progress = parsed
+                        if self.on_progress is not None:
+                            self.on_progress(*parsed)
+            ret = process.wait()
+            if ret != 0 and tid in self._requeue_jobs:
+                raise JobPreempted("给加急任务让位，稍后重新处理")
+            if ret != 0 and self.governor.take_preempted(tid):
+                raise MemoryPressureError("系统内存不足，任务被暂停")
+            if ret != 0:
+                diagnosis = FFmpegErrorAnalyzer.format_diagnosis(output_lines, exit_code=ret)
+                category = next((d.category for d in FFmpegErrorAnalyzer.analyze(output_lines, ret) if d.category != "exit_code"), "exit_code")
+                raise FFmpegError(f"FFmpeg 处理失败（退出码 {ret}）\n{diagnosis}", category)
+            self.metrics.observe("video_tool_stage_seconds", time.monotonic() - started, stage=stage)
+            if progress and progress[1] > 0:
+                # 最后一行进度的 素材时长/速度 就是这条命令的编码耗时，按线程累计到当前任务。
+                with self._lock:
+                    self._encode_seconds[tid] = self._encode_seconds.get(tid, 0.0) + progress[0] / progress[1]
+            return output_lines
+        except BaseException:
+            # 包括 Ctrl+C：FFmpeg 在独立的会话里，收不到终端的中断信号，要在这里结束它。
+            if process is not None:
+                self._terminate(process)
+            raise
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+                self._suspended.discard(process)
+                self._job_processes.get(tid, set()).discard(process)
+
+    def terminate_processes(self):
+        """终止所有正在运行的 FFmpeg 子进程（并行时可能不止一个）：先一起请它们退出，再逐个等待，必要时强制结束。"""
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                self.backend.terminate(process)
+        for process in processes:
+            self._terminate(process)
+
+    def _terminate(self, process):
+        """结束一条命令的整个进程组：先请它退出，TERMINATE_GRACE_SECONDS 秒内没退出就强制结束。"""
+        if process.poll() is not None:
+            return
+        with self._lock:
+            suspended = process in self._suspended
+            self._suspended.discard(process)
+        if suspended:
+            # 暂停中的进程收不到 SIGTERM，先恢复再终止。
+            self.backend.resume(process)
+        self.backend.terminate(process)
+        try:
+            process.wait(timeout=TERMINATE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.log(f"FFmpeg（进程 {process.pid}）{TERMINATE_GRACE_SECONDS} 秒内没有退出，强制结束", "warning")
+        # 主进程退出后组里可能还有子进程占着输出管道，一并强制结束。
+        self.backend.kill(process)
+        try:
+            process.wait(timeout=TERMINATE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.log(f"无法结束 FFmpeg（进程 {process.pid}）", "error")
+
+    def add_to_batch(self, files, priority=PRIORITY_URGENT, preempt=False):
+        """往正在运行的这一批里加文件，或把还在排队的文件提到 priority，返回被接受的文件。
+
+        没有批处理在跑或这一批已经收尾时返回空列表。preempt 为真且各路都在忙时，挑一个
+        优先级更低的任务让位：能暂停子进程就暂停（POSIX 用 SIGSTOP/SIGCONT），另开一路先处理加急的，
+        处理完再恢复它；不能暂停时中止它、放回队列原来的位置。已经处理完的文件都不受影响。
+        """
+        enqueue = self._batch_enqueue
+        return enqueue(list(files), priority, preempt) if enqueue is not None else []
+
+    def _pause_job(self, token):
+        """暂停一个任务的全部 FFmpeg 子进程，后续新开的命令也立即暂停；做不到时返回 False。"""
+        if not callable(getattr(self.backend, "suspend", None)):
+            return False
+        with self._lock:
+            processes = list(self._job_processes.get(token, ()))
+            done = []
+            for process in processes:
+                if not self.backend.suspend(process):
+                    for paused in done:
+                        self.backend.resume(paused)
+                    return False
+                done.append(process)
+            self._paused_jobs.add(token)
+            self._suspended.update(done)
+        self.governor.suspend(token)
+        return True
+
+    def _resume_job(self, token):
+        with self._lock:
+            self._paused_jobs.discard(token)
+            for process in self._job_processes.get(token, ()):
+                if process in self._suspended:
+                    self._suspended.discard(process)
+                    self.backend.resume(process)
+        self.governor.resume(token)
+
+    def _requeue_job(self, token):
+        """中止一个任务正在运行的命令，让它抛出 JobPreempted、回到队列里。
+
+        调用方先把 token 放进 _requeue_jobs；任务已经结束、标记被清掉时什么也不做。
+        """
+        with self._lock:
+            if token not in self._requeue_jobs:
+                return
+            processes = list(self._job_processes.get(token, ()))
+        for process in processes:
+            self._terminate(process)
+
+    def _quote_cmd(self, s):
+        if not isinstance(s, str):
+            s = str(s)
+        return f'"{s}"' if " " in s else s
+
+
+# ----------------------------------------------------------------------
+# 渲染农场：协调端分发任务，多台机器/多个进程各跑一个工作进程领取任务
+# ----------------------------------------------------------------------
+FARM_LEASE_SECONDS = 60
+FARM_MAX_ATTEMPTS = 3
+
+
+def make_farm_jobs(files, template: CommandTemplate, output_dir, intro_path="", outro_path="", overwrite=True):
+    """把一批文件打包成农场任务。任务里带完整配置和模板哈希，路径都转成绝对路径，
+    局域网里的工作机需要能按同样的路径（共享盘/挂载点）访问到这些文件。"""
+    taken = set()
+    jobs = []
+    for index, input_path in enumerate(files):
+        output_path = make_output_path(input_path, output_dir, overwrite, taken, template.output_ext)
+        taken.add(output_path)
+        digest = hashlib.sha256(os.path.abspath(input_path).encode("utf-8")).hexdigest()[:8]
+        jobs.append({
+            "id": f"{index:05d}_{digest}",
+            "input": os.path.abspath(input_path),
+            "output": os.path.abspath(output_path),
+            "intro": os.path.abspath(intro_path) if intro_path else "",
+            "outro": os.path.abspath(outro_path) if outro_path else "",
+            "profile": template.profile.to_dict(),
+            "template": template.key,
+            "overwrite": overwrite,
+            "attempts": 0,
+        })
+    return jobs
+
+
+class FarmCoordinator:
+    """内存中的农场任务表：租约、心跳、失败重试和汇总进度都在这里，HTTP 服务只是一层外壳。
+
+    工作进程领取任务后拿到一个租约，处理期间定时心跳续约；进程崩溃或断网后租约过期，
+    任务回到待处理队列由其他工作进程重试，超过最大尝试次数才记为失败。
+    """
+
+    def __init__(self, lease_seconds=FARM_LEASE_SECONDS, max_attempts=FARM_MAX_ATTEMPTS, log: Optional[Callable] = None):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.log = log or _print_log
+        self.jobs = {}
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, jobs):
+        with self._lock:
+            for job in jobs:
+                self.jobs[job["id"]] = dict(job, status="pending", worker="", lease_until=0.0, error="", outputs=[])
+
+    def lease(self, worker_id):
+        self.reap()
+        with self._lock:
+            self.workers[worker_id] = time.time()
+            for job in self.jobs.values():
+                if job["status"] == "pending":
+                    job.update(status="leased", worker=worker_id, lease_until=time.time() + self.lease_seconds)
+                    job["attempts"] += 1
+                    return dict(job, lease_seconds=self.lease_seconds)
+        return None
+
+    def heartbeat(self, job_id, worker_id):
+        """续约；返回 False 表示租约已被收回（任务已交给别的工作进程）。"""
+        with self._lock:
+            self.workers[worker_id] = time.time()
+            job = self.jobs.get(job_id)
+            if not job or job["status"] != "leased" or job["worker"] != worker_id:
+                return False
+            job["lease_until"] = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, job_id, worker_id, outputs):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job["status"] == "done":
+                return
+            job.update(status="done", worker=worker_id, outputs=list(outputs), error="")
+        self.log(f"[{worker_id}] 处理完成：{'、'.join(outputs)}", "success")
+
+    def fail(self, job_id, worker_id, error):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job["status"] != "leased" or job["worker"] != worker_id:
+                return
+            retry = job["attempts"] < self.max_attempts
+            job.update(status="pending" if retry else "failed", worker="", error=str(error))
+        if retry:
+            self.log(f"[{worker_id}] 处理失败，稍后重试（第 {job['attempts']} 次）：{job['input']}\n原因：{error}", "warning")
+        else:
+            self.log(f"[{worker_id}] 处理失败：{job['input']}\n原因：{error}", "error")
+
+    def reap(self):
+        """收回过期租约：工作进程失联的任务重新排队。"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            for job in self.jobs.values():
+                if job["status"] == "leased" and job["lease_until"] < now:
+                    expired.append((job["id"], job["worker"]))
+        for job_id, worker_id in expired:
+            self.fail(job_id, worker_id, f"工作进程 {worker_id} 超过 {self.lease_seconds} 秒没有心跳")
+
+    def status(self):
+        with self._lock:
+            counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            now = time.time()
+            workers = {worker: round(now - seen, 1) for worker, seen in self.workers.items()}
+        return dict(counts, total=len(self.jobs), finished=counts["pending"] + counts["leased"] == 0, workers=workers)
+
+
+class FileJobQueue:
+    """基于共享目录的任务队列，适合没法开端口、但有共享盘的环境。
+
+    jobs/ 待处理，leased/ 处理中（文件修改时间就是心跳），done/ 与 failed/ 是结果。
+    领取任务靠 os.rename 的原子性：多个工作进程抢同一个文件时只有一个能改名成功。
+    """
+
+    def __init__(self, root, lease_seconds=FARM_LEASE_SECONDS, max_attempts=FARM_MAX_ATTEMPTS, log: Optional[Callable] = None):
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.log = log or _print_log
+        for name in ("jobs", "leased", "done", "failed", "workers"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def _write(self, folder, job):
+        self._dump(self.root / folder / f"{job['id']}.json", job)
+
+    @staticmethod
+    def _dump(path, job):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _names(self, folder):
+        try:
+            return sorted(name for name in os.listdir(self.root / folder) if name.endswith(".json") and not name.startswith("."))
+        except OSError:
+            return []
+
+    def submit(self, jobs):
+        for job in jobs:
+            self._write("jobs", job)
+
+    def lease(self, worker_id):
+        self.reap()
+        (self.root / "workers" / worker_id).touch()
+        for name in self._names("jobs"):
+            leased = self.root / "leased" / name
+            try:
+                # 先刷新修改时间再改名：改名会保留排队时的修改时间，排队久的任务一出现在 leased/ 里就会被当成过期租约收回。
+                os.utime(self.root / "jobs" / name)
+                os.rename(self.root / "jobs" / name, leased)
+            except OSError:
+                continue  # 被别的工作进程抢先领走了
+            job = json.loads(leased.read_text(encoding="utf-8"))
+            job.update(worker=worker_id, attempts=job.get("attempts", 0) + 1)
+            self._write("leased", job)
+            return dict(job, lease_seconds=self.lease_seconds)
+        return None
+
+    def heartbeat(self, job_id, worker_id):
+        (self.root / "workers" / worker_id).touch()
+        try:
+            os.utime(self.root / "leased" / f"{job_id}.json")
+            return True
+        except OSError:
+            return False
+
+    def complete(self, job_id, worker_id, outputs):
+        path = self.root / "leased" / f"{job_id}.json"
+        try:
+            job = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            job = {"id": job_id}
+        self._write("done", dict(job, worker=worker_id, outputs=list(outputs)))
+        path.unlink(missing_ok=True)
+        # 租约过期后任务可能已被重新排队，既然已经做完就撤掉，免得重复处理。
+        (self.root / "jobs" / f"{job_id}.json").unlink(missing_ok=True)
+        self.log(f"[{worker_id}] 处理完成：{'、'.join(outputs)}", "success")
+
+    def fail(self, job_id, worker_id, error):
+        path = self.root / "leased" / f"{job_id}.json"
+        try:
+            job = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._requeue(path, job, error)
+        self.log(f"[{worker_id}] 处理失败：{job.get('input', job_id)}\n原因：{error}", "warning")
+
+    def _requeue(self, path, job, error):
+        job["error"] = str(error)
+        folder = "jobs" if job.get("attempts", 0) < self.max_attempts else "failed"
+        # 原地改写后整体改名过去；先写新文件再删旧文件的话，中间被别人重新领走的租约会被误删。
+        self._dump(path, job)
+        os.rename(path, self.root / folder / f"{job['id']}.json")
+
+    def reap(self):
+        now = time.time()
+        for name in self._names("leased"):
+            path = self.root / "leased" / name
+            try:
+                if now - path.stat().st_mtime <= self.lease_seconds:
+                    continue
+                # 先改名占住，避免几个进程同时回收同一个任务。
+                claimed = path.with_name(f".{name}.reap")
+                os.rename(path, claimed)
+                if time.time() - claimed.stat().st_mtime <= self.lease_seconds:
+                    os.rename(claimed, path)  # 查看和改名之间任务已被重新领走，改到的是新租约，还回去
+                    continue
+                job = json.loads(claimed.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            self._requeue(claimed, job, f"工作进程 {job.get('worker', '?')} 超过 {self.lease_seconds} 秒没有心跳")
+
+    def status(self):
+        counts = {key: len(self._names(folder)) for key, folder in
+                  (("pending", "jobs"), ("leased", "leased"), ("done", "done"), ("failed", "failed"))}
+        now = time.time()
+        workers = {}
+        for path in (self.root / "workers").iterdir():
+            workers[path.name] = round(now - path.stat().st_mtime, 1)
+        return dict(counts, total=sum(counts.values()), finished=counts["pending"] + counts["leased"] == 0, workers=workers)
+
+
+class HttpJobQueue:
+    """工作进程一侧的 HTTP 客户端，接口与 FarmCoordinator / FileJobQueue 相同。"""
+
+    def __init__(self, address, timeout=15):
+        self.url = (address if "://" in address else f"http://{address}").rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        import urllib.request
+
+        data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8") or "{}")
+
+    def lease(self, worker_id):
+        return self._call("/lease", {"worker": worker_id}).get("job")
+
+    def heartbeat(self, job_id, worker_id):
+        return bool(self._call("/heartbeat", {"id": job_id, "worker": worker_id}).get("ok"))
+
+    def complete(self, job_id, worker_id, outputs):
+        self._call("/complete", {"id": job_id, "worker": worker_id, "outputs": list(outputs)})
+
+    def fail(self, job_id, worker_id, error):
+        self._call("/fail", {"id": job_id, "worker": worker_id, "error": str(error)})
+
+    def status(self):
+        return self._call("/status")
+
+
+class JsonRequestHandler:
+    """只收发 JSON 的请求处理混入类，不往终端打印访问日志。
+
+    启动服务时再和 http.server.BaseHTTPRequestHandler 组合（见 _serve_json），平时不必导入 http.server。
+    """
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            data = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_metrics(self, registry: MetricsRegistry):
+        self.send_text(200, registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsRequestHandler(JsonRequestHandler):
+    """GET /metrics 返回 Prometheus 文本格式的指标。"""
+
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            self.send_metrics(self.registry)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+
+class FarmRequestHandler(JsonRequestHandler):
+    coordinator: FarmCoordinator = None
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(200, self.coordinator.status())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        data = self.read_json()
+        if data is None:
+            self.send_json(400, {"error": "请求体必须是 JSON 对象"})
+            return
+        worker = str(data.get("worker") or "?")
+        if self.path == "/lease":
+            self.send_json(200, {"job": self.coordinator.lease(worker)})
+        elif self.path == "/heartbeat":
+            self.send_json(200, {"ok": self.coordinator.heartbeat(data.get("id"), worker)})
+        elif self.path == "/complete":
+            self.coordinator.complete(data.get("id"), worker, data.get("outputs") or [])
+            self.send_json(200, {"ok": True})
+        elif self.path == "/fail":
+            self.coordinator.fail(data.get("id"), worker, data.get("error", ""))
+            self.send_json(200, {"ok": True})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+
+def is_http_address(address):
+    """host:port 或 http://... 视为协调端 HTTP 地址，其余当作共享队列目录。"""
+    return "://" in address or re.fullmatch(r"[\w.\-]*:\d+", address) is not None
+
+
+def _serve_json(handler_class, attributes, host, port):
+    """在后台线程启动 JSON HTTP 服务，返回 server（server.server_address 是实际端口）。"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type(f"Bound{handler_class.__name__}", (handler_class, BaseHTTPRequestHandler), attributes)
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_farm_server(coordinator: FarmCoordinator, host="127.0.0.1", port=8765):
+    return _serve_json(FarmRequestHandler, {"coordinator": coordinator}, host, port)
+
+
+def start_metrics_server(registry: MetricsRegistry, host="127.0.0.1", port=9464):
+    return _serve_json(MetricsRequestHandler, {"registry": registry}, host, port)
+
+
+def run_farm_worker(job_queue, engine: VideoEngine, worker_id, poll_seconds=2.0):
+    """工作进程主循环：领取任务 → 处理（期间定时心跳）→ 汇报结果，队列处理完后退出。返回成功数量。"""
+    templates = {}
+    succeeded = 0
+    errors = 0
+    engine.start_batch()
+    try:
+        while not engine.stop_event.is_set():
+            try:
+                job = job_queue.lease(worker_id)
+                finished = job is None and job_queue.status()["finished"]
+                errors = 0
+            except (OSError, ValueError) as exc:
+                errors += 1
+                if errors >= 5:
+                    engine.log(f"连续 {errors} 次连不上协调端，工作进程退出：{exc}", "error")
+                    break
+                time.sleep(poll_seconds)
+                continue
+            if job is None:
+                if finished:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            profile = EncodeProfile.from_dict(job["profile"])
+            template = templates.get(job["template"])
+            if template is None:
+                template = templates[job["template"]] = engine.compile_profile(profile)
+                if template.key != job["template"]:
+                    engine.log(f"本机编码器与协调端不同（{template.plan.encoder}），命令模板 {job['template']} → {template.key}", "warning")
+            engine.overwrite = job.get("overwrite", True)
+
+            stop_heartbeat = threading.Event()
+
+            def heartbeat(job_id=job["id"], interval=max(1.0, job.get("lease_seconds", FARM_LEASE_SECONDS) / 3)):
+                while not stop_heartbeat.wait(interval):
+                    try:
+                        if not job_queue.heartbeat(job_id, worker_id):
+                            engine.log(f"任务 {job_id} 的租约已被收回，结果可能被别的工作进程覆盖。", "warning")
+                    except (OSError, ValueError):
+                        pass
+
+            threading.Thread(target=heartbeat, daemon=True).start()
+            engine.log(f"[{worker_id}] 开始处理：{os.path.basename(job['input'])}（第 {job.get('attempts', 1)} 次）")
+            try:
+                Path(job["output"]).parent.mkdir(parents=True, exist_ok=True)
+                outputs = engine.process_single_file(job["input"], job["output"], template, job.get("intro", ""), job.get("outro", ""))
+            except Exception as exc:
+                stop_heartbeat.set()
+                _report_farm_result(job_queue.fail, job["id"], worker_id, exc)
+            else:
+                stop_heartbeat.set()
+                _report_farm_result(job_queue.complete, job["id"], worker_id, outputs)
+                succeeded += 1
+    finally:
+        engine.finish_batch()
+    return succeeded
+
+
+def _report_farm_result(method, job_id, worker_id, detail, attempts=5):
+    # 汇报失败时多试几次；实在不行就交给租约过期后的重试。
+    for _ in range(attempts):
+        try:
+            method(job_id, worker_id, detail)
+            return
+        except (OSError, ValueError):
+            time.sleep(1)
+
+
+# ----------------------------------------------------------------------
+# 本地任务服务：上传服务等外部程序通过 HTTP/JSON 提交任务、订阅进度、取消任务
+# ----------------------------------------------------------------------
+SERVICE_QUEUE_SIZE = 16
+SERVICE_HISTORY = 500
+SERVICE_FINAL_STATES = ("done", "failed", "cancelled")
+
+
+class QueueFullError(RuntimeError):
+    """排队的任务已达上限，调用方应稍后重试（HTTP 429）。"""
+
+
+class JobService:
+    """本地任务服务：每个任务是一批文件，按提交顺序由固定数量的工作线程执行。
+
+    每个任务用自己的 VideoEngine（共用探测索引和资源调度器），取消一个任务只停它自己的 FFmpeg。
+    进度按事件列表记录，SSE 订阅者先补发历史事件再等新事件。
+    """
+
+    def __init__(self, ffmpeg_path, ffprobe_path, profile: EncodeProfile, output_dir, intro_path="", outro_path="", workers=1,
+                 max_queue=SERVICE_QUEUE_SIZE, overwrite=True, keep_temp=False, dedupe=True, governor=None, log: Optional[Callable] = None,
+                 backend=None, probe_index=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        # 任务里没写的配置、输出目录、片头片尾用服务启动时的默认值。
+        self.profile = profile
+        self.output_dir = output_dir
+        self.intro_path = intro_path
+        self.outro_path = outro_path
+        self.max_queue = max_queue
+        self.overwrite = overwrite
+        self.keep_temp = keep_temp
+        self.dedupe = dedupe
+        self.governor = governor or ResourceGovernor()
+        self.backend = backend
+        self.probe_index = probe_index or ProbeIndex()
+        self.metrics = MetricsRegistry()
+        self.log = log or _print_log
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._templates = {}
+        self._seq = 0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, int(workers)))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, data) -> dict:
+        """校验并登记一个任务，返回任务摘要；参数无效抛 ValueError，队列已满抛 QueueFullError。"""
+        inputs = data.get("inputs")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not isinstance(inputs, list) or not inputs:
+            raise ValueError("inputs 必须是文件或文件夹路径的列表")
+        files = collect_video_files([str(path) for path in inputs])
+        if not files:
+            raise ValueError("没有找到要处理的视频文件")
+        intro, outro = str(data.get("intro", self.intro_path) or ""), str(data.get("outro", self.outro_path) or "")
+        for label, path in (("片头", intro), ("片尾", outro)):
+            if path and not os.path.isfile(path):
+                raise ValueError(f"{label}文件不存在：{path}")
+        profile = self.profile
+        if isinstance(data.get("profile"), dict):
+            profile = EncodeProfile.from_dict(data["profile"])
+        elif data.get("profile"):
+            profile = EncodeProfile.load(str(data["profile"]))
+        ok, msg = profile.validate()
+        if not ok:
+            raise ValueError(f"配置参数无效：{msg}")
+        output_dir = str(data.get("output_dir") or self.output_dir)
+
+        with self._cond:
+            if self._closed:
+                raise QueueFullError("服务正在关闭")
+            if sum(1 for job in self._jobs.values() if job["status"] == "queued") >= self.max_queue:
+                raise QueueFullError(f"排队任务已达上限 {self.max_queue} 个，请稍后重试")
+            # 排上队才建输出目录，被 429 拒绝的提交不在磁盘上留东西；建不了时抛 OSError（接口返回 400）。
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            self._seq += 1
+            job = {
+                # 序号便于人看，随机后缀避免服务重启后和旧任务号重复。
+                "id": f"{self._seq:05d}_{os.urandom(3).hex()}",
+                "status": "queued",
+                "created": time.time(),
+                "files": files,
+                "intro": intro,
+                "outro": outro,
+                "output_dir": output_dir,
+                "profile": profile,
+                "outputs": [],
+                "errors": [],
+                "done": 0,
+                "events": [],
+                "engine": None,
+            }
+            self._jobs[job["id"]] = job
+            self._publish(job, "queued", {"files": len(files)})
+            self._prune()
+            self._count_queued()
+        self._queue.put(job["id"])
+        self.log(f"[{job['id']}] 已接收任务：{len(files)} 个文件")
+        return self.summary(job["id"])
+
+    def cancel(self, job_id) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                self._finish(job, "cancelled")
+                self._count_queued()
+            elif job["status"] == "running":
+                job["status"] = "cancelling"
+                engine = job["engine"]
+                engine.stop_event.set()
+                threading.Thread(target=engine.terminate_processes, daemon=True).start()
+        return self.summary(job_id)
+
+    def summary(self, job_id) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {
+                "id": job["id"],
+                "status": job["status"],
+                "files": len(job["files"]),
+                "done": job["done"],
+                "outputs": list(job["outputs"]),
+                "errors": list(job["errors"]),
+                "created": job["created"],
+            }
+
+    def jobs(self) -> List[dict]:
+        with self._cond:
+            ids = list(self._jobs)
+        return [summary for summary in map(self.summary, ids) if summary]
+
+    def status(self) -> dict:
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"jobs": counts, "max_queue": self.max_queue, "workers": len(self._threads)}
+
+    def events(self, job_id, start=0, timeout=15.0):
+        """返回 (从 start 开始的新事件, 任务是否已结束)；没有新事件时最多等 timeout 秒。任务不存在返回 None。"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if len(job["events"]) <= start and job["status"] not in SERVICE_FINAL_STATES:
+                self._cond.wait(timeout)
+            return job["events"][start:], job["status"] in SERVICE_FINAL_STATES
+
+    def shutdown(self):
+        """不再接新任务，取消排队和正在执行的任务。"""
+        with self._cond:
+            self._closed = True
+            ids = [job["id"] for job in self._jobs.values() if job["status"] not in SERVICE_FINAL_STATES]
+        for job_id in ids:
+            self.cancel(job_id)
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _publish(self, job, event, data):
+        # 调用方持有 self._cond。
+        job["events"].append({"event": event, "time": round(time.time(), 3), **data})
+        self._cond.notify_all()
+
+    def _count_queued(self):
+        # 调用方持有 self._cond。
+        self.metrics.set("video_tool_service_jobs_queued", sum(1 for job in self._jobs.values() if job["status"] == "queued"))
+
+    def _finish(self, job, status):
+        job["status"] = status
+        job["engine"] = None
+        self._publish(job, status, {"done": job["done"], "outputs": list(job["outputs"]), "errors": list(job["errors"])})
+
+    def _prune(self):
+        # 只保留最近 SERVICE_HISTORY 个已结束的任务。调用方持有 self._cond。
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in SERVICE_FINAL_STATES]
+        for job_id in finished[: max(0, len(finished) - SERVICE_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                engine = VideoEngine(
+                    self.ffmpeg_path, self.ffprobe_path, log=self._job_logger(job),
+                    probe_index=self.probe_index, governor=self.governor, metrics=self.metrics, backend=self.backend,
+                )
+                engine.overwrite, engine.keep_temp, engine.dedupe = self.overwrite, self.keep_temp, self.dedupe
+                job["engine"] = engine
+                job["status"] = "running"
+                self._publish(job, "running", {})
+                self._count_queued()
+            self._run_job(job, engine)
+
+    def _run_job(self, job, engine: VideoEngine):
+        current = {"file": "", "sent": 0.0}
+
+        def on_progress(seconds, speed):
+            # FFmpeg 每秒输出好几行进度，最多每半秒推一次。
+            now = time.monotonic()
+            if now - current["sent"] < 0.5:
+                return
+            current["sent"] = now
+            with self._cond:
+                self._publish(job, "progress", {"file": current["file"], "position": round(seconds, 2), "speed": speed})
+
+        def on_event(event, input_path, detail):
+            with self._cond:
+                if event == "start":
+                    current["file"] = input_path
+                    self._publish(job, "file_start", {"file": input_path})
+                elif event == "done":
+                    job["done"] += 1
+                    job["outputs"].extend(detail)
+                    self._publish(job, "file_done", {"file": input_path, "outputs": list(detail)})
+                elif event == "failed":
+                    job["errors"].append(f"{input_path}：{detail}")
+                    self._publish(job, "file_failed", {"file": input_path, "error": str(detail)})
+
+        engine.on_progress = on_progress
+        try:
+            key = self._template_key(job["profile"])
+            template = self._templates.get(key)
+            if template is None:
+                template = self._templates.setdefault(key, engine.compile_profile(job["profile"]))
+            engine.run_batch(job["files"], template, job["output_dir"], job["intro"], job["outro"], on_event=on_event)
+        except Exception as exc:
+            with self._cond:
+                job["errors"].append(str(exc))
+        with self._cond:
+            if engine.stop_event.is_set():
+                status = "cancelled"
+            else:
+                status = "done" if job["done"] == len(job["files"]) else "failed"
+            self._finish(job, status)
+            self._prune()
+        self.log(f"[{job['id']}] 任务结束：{status}，成功 {job['done']}/{len(job['files'])} 个文件", "success" if status == "done" else "warning")
+
+    @staticmethod
+    def _template_key(profile: EncodeProfile):
+        return json.dumps(profile.to_dict(), sort_keys=True, ensure_ascii=False)
+
+    def _job_logger(self, job):
+        def log(message, tag="info"):
+            self.log(f"[{job['id']}] {message}", tag)
+            if tag in ("warning", "error"):
+                with self._cond:
+                    self._publish(job, "log", {"level": tag, "message": str(message)})
+        return log
+
+
+class ServiceRequestHandler(JsonRequestHandler):
+    """任务服务的 HTTP 接口：
+
+    POST /jobs 提交任务（202；排队已满 429），GET /jobs、GET /jobs/<id> 查询，
+    GET /jobs/<id>/events 用 SSE 推送进度，POST /jobs/<id>/cancel 或 DELETE /jobs/<id> 取消，GET /status 看概况，
+    GET /metrics 是 Prometheus 指标。
+    """
+
+    service: JobService = None
+
+    def _job_path(self):
+        m = re.fullmatch(r"/jobs/(\w+)(/\w+)?", self.path.split("?")[0])
+        return (m.group(1), m.group(2) or "") if m else (None, "")
+
+    def do_GET(self):
+        job_id, action = self._job_path()
+        if self.path == "/status":
+            self.send_json(200, self.service.status())
+        elif self.path == "/metrics":
+            self.send_metrics(self.service.metrics)
+        elif self.path == "/jobs":
+            self.send_json(200, {"jobs": self.service.jobs()})
+        elif job_id and action == "/events":
+            self._stream_events(job_id)
+        elif job_id and not action:
+            summary = self.service.summary(job_id)
+            self.send_json(200 if summary else 404, summary or {"error": "任务不存在"})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        job_id, action = self._job_path()
+        if self.path == "/jobs":
+            data = self.read_json()
+            if data is None:
+                self.send_json(400, {"error": "请求体必须是 JSON 对象"})
+                return
+            try:
+                self.send_json(202, self.service.submit(data))
+            except QueueFullError as exc:
+                self.send_json(429, {"error": str(exc)}, headers={"Retry-After": "5"})
+            except (ValueError, OSError) as exc:
+                self.send_json(400, {"error": str(exc)})
+        elif job_id and action == "/cancel":
+            self._cancel(job_id)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        job_id, action = self._job_path()
+        if job_id and not action:
+            self._cancel(job_id)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def _cancel(self, job_id):
+        summary = self.service.cancel(job_id)
+        self.send_json(200 if summary else 404, summary or {"error": "任务不存在"})
+
+    def _stream_events(self, job_id):
+        if self.service.summary(job_id) is None:
+            self.send_json(404, {"error": "任务不存在"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                result = self.service.events(job_id, sent)
+                if result is None:
+                    return
+                events, finished = result
+                if finished and not events:
+                    return
+                for event in events:
+                    data = json.dumps({key: value for key, value in event.items() if key != "event"}, ensure_ascii=False)
+                    self.wfile.write(f"event: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+                sent += len(events)
+                if not events:
+                    # 心跳注释行，让代理和客户端知道连接还活着。
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+def start_job_service(service: JobService, host="127.0.0.1", port=8766):
+    return _serve_json(ServiceRequestHandler, {"service": service}, host, port)
+
+
+# 文件列表的列（Treeview 列名 → 表头）和状态筛选项，第一项表示不筛选。
+FILE_COLUMNS = {"status": "状态", "group": "重复", "name": "文件名", "size": "大小", "duration": "时长", "path": "路径"}
+FILE_FILTERS = ("全部", "等待", "加急", "处理中", "成功", "失败")
+
+
+class FileListStore:
+    """界面文件列表的数据：内存里的一张 SQLite 表，每个文件一行（路径、大小、时长、状态、输出、重复分组）。
+
+    每个可排序的列都有（列, 顺序）和（状态, 列, 顺序）索引，十万个文件排序、筛选、翻页也只要几毫秒；
+    Treeview 只放看得见的几十行（见 VideoProcessorApp._refresh_file_view）。后台线程也会读写，用一把锁串行化。
+    """
+
+    SORT_COLUMNS = {
+        "position": "position", "status": "status", "name": "name", "size": "size", "duration": "duration", "group": "dup_group",
+        "path": "path",
+    }
+
+    def __init__(self):
+        import sqlite3
+
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE files (
+                id INTEGER PRIMARY KEY,
+                position INTEGER NOT NULL,
+                path TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                duration REAL,
+                status TEXT NOT NULL DEFAULT '等待',
+                output TEXT NOT NULL DEFAULT '',
+                dup_group TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX files_position ON files(position);
+            CREATE INDEX files_status ON files(status, position);
+            CREATE INDEX files_name ON files(name, position);
+            CREATE INDEX files_status_name ON files(status, name, position);
+            CREATE INDEX files_size ON files(size, position);
+            CREATE INDEX files_status_size ON files(status, size, position);
+            CREATE INDEX files_duration ON files(duration, position);
+            CREATE INDEX files_status_duration ON files(status, duration, position);
+            CREATE INDEX files_dup_group ON files(dup_group, position);
+            CREATE INDEX files_status_dup_group ON files(status, dup_group, position);
+        """)
+        self._count = 0
+        self._next_position = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() is not None
+
+    def add(self, items):
+        """items 是 (路径, 字节数) 的序列，已在列表里的跳过，返回新加入的路径（保持顺序）。"""
+        added = []
+        with self._lock, self._db:
+            for path, size in items:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO files (position, path, name, size) VALUES (?, ?, ?, ?)",
+                    (self._next_position, path, os.path.basename(path), size),
+                )
+                if cursor.rowcount:
+                    self._next_position += 1
+                    added.append(path)
+            self._count += len(added)
+        return added
+
+    def remove(self, ids):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM files WHERE id = ?", [(int(row_id),) for row_id in ids])
+            self._count = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files")
+            self._count = 0
+
+    def paths(self):
+        """按列表顺序返回全部路径。"""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT path FROM files ORDER BY position")]
+
+    def first_path(self):
+        with self._lock:
+            row = self._db.execute("SELECT path FROM files ORDER BY position LIMIT 1").fetchone()
+        return row[0] if row else ""
+
+    def rows(self, ids):
+        """按 id 取 (id, 路径, 输出)，顺序同 ids，已不存在的跳过。"""
+        with self._lock:
+            found = {
+                row[0]: row
+                for row in self._db.execute(
+                    f"SELECT id, path, output FROM files WHERE id IN ({','.join('?' * len(ids))})", [int(row_id) for row_id in ids]
+                )
+            } if ids else {}
+        return [found[int(row_id)] for row_id in ids if int(row_id) in found]
+
+    def move_to_front(self, ids):
+        """把这些文件按给定顺序排到列表最前面。"""
+        with self._lock, self._db:
+            first = self._db.execute("SELECT MIN(position) FROM files").fetchone()[0] or 0
+            self._db.executemany(
+                "UPDATE files SET position = ? WHERE id = ?", [(first - len(ids) + i, int(row_id)) for i, row_id in enumerate(ids)]
+            )
+
+    def set_status(self, path, status):
+        """更新状态，返回这一行的 id；路径不在列表里时返回 None。"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE files SET status = ? WHERE path = ?", (status, path))
+            row = self._db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def set_output(self, path, output):
+        with self._lock, self._db:
+            self._db.execute("UPDATE files SET output = ? WHERE path = ?", (output, path))
+
+    def set_durations(self, durations):
+        """durations 是 (路径, 秒数) 的序列；读不到时长的记 0，不再重复探测。"""
+        with self._lock, self._db:
+            self._db.executemany("UPDATE files SET duration = ? WHERE path = ?", [(seconds, path) for path, seconds in durations])
+
+    def missing_durations(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT path FROM files WHERE duration IS NULL ORDER BY position")]
+
+    def set_groups(self, labels):
+        """labels 是 路径 → 重复分组名，不在其中的清空。"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE files SET dup_group = '' WHERE dup_group != ''")
+            self._db.executemany("UPDATE files SET dup_group = ? WHERE path = ?", [(label, path) for path, label in labels.items()])
+
+    def count(self, status=""):
+        if not status:
+            return self._count
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files WHERE status = ?", (status,)).fetchone()[0]
+
+    def page(self, status="", sort="position", descending=False, offset=0, limit=50):
+        """筛选、排序后的一页：(id, 状态, 文件名, 字节数, 时长, 重复分组, 路径)。"""
+        order = "DESC" if descending else "ASC"
+        column = self.SORT_COLUMNS[sort]
+        where = "WHERE status = ?" if status else ""
+        sql = (
+            f"SELECT id, status, name, size, duration, dup_group, path FROM files {where} "
+            f"ORDER BY {column} {order}, position {order} LIMIT ? OFFSET ?"
+        )
+        with self._lock:
+            return self._db.execute(sql, ((status,) if status else ()) + (int(limit), int(offset))).fetchall()
+
+
+class ScrollableFrame:
+    """一个可滚动的 ttk.Frame（frame 是外层控件，内容放进 inner），用于小屏幕下防止按钮被挤出窗口。
+
+    不继承 ttk.Frame：tkinter 要到打开界面时才导入，定义类时还拿不到 ttk。
+    """
+
+    def __init__(self, parent, height=None):
+        self.frame = ttk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, highlightthickness=0, borderwidth=0)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.inner = ttk.Frame(self.canvas)
+        self.window_id = self.canvas.create_window((0, 0), window=self.inner, anchor="nw")
+
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        if height:
+            self.canvas.configure(height=height)
+
+        self.inner.bind("<Configure>", self._on_inner_configure)
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel_windows)
+        self.canvas.bind_all("<Button-4>", self._on_mousewheel_linux)
+        self.canvas.bind_all("<Button-5>", self._on_mousewheel_linux)
+
+    def _on_inner_configure(self, _event=None):
+        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+
+    def _on_canvas_configure(self, event):
+        self.canvas.itemconfigure(self.window_id, width=event.width)
+
+    def _on_mousewheel_windows(self, event):
+        # 只在鼠标位于该控件内时滚动，避免影响 Treeview / Text。
+        widget = self.frame.winfo_containing(event.x_root, event.y_root)
+        if widget and str(widget).startswith(str(self.frame)):
+            self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+
+    def _on_mousewheel_linux(self, event):
+        widget = self.frame.winfo_containing(event.x_root, event.y_root)
+        if not (widget and str(widget).startswith(str(self.frame))):
+            return
+        if event.num == 4:
+            self.canvas.yview_scroll(-1, "units")
+        elif event.num == 5:
+            self.canvas.yview_scroll(1, "units")
+
+
+class VideoProcessorApp:
+    def __init__(self, master):
+        self.master = master
+        self.master.title("专业视频片头片尾批处理工具 v4.4")
+        self.master.geometry("1180x760")
+        self.master.minsize(980, 640)
+
+        self.files = FileListStore()
+        # 文件列表是虚拟的：Treeview 只放从 _view_offset 开始的 _view_rows 行，见 _refresh_file_view。
+        self._view_offset = 0
+        self._view_rows = 20
+        self._view_sort = ("position", False)
+        self._view_pending = False
+        self._duration_thread = None
+        self._batch_files = set()
+        self._dedup_generation = 0
+        self.processing_thread = None
+        self.stop_event = threading.Event()
+        self.log_queue = queue.Queue()
+        self.ui_queue = queue.Queue()
+        self.profile_name = ""
+
+        # FFmpeg 在窗口显示之后由后台线程查找，见 _discover_tools。
+        self.ffmpeg_path = None
+        self.ffprobe_path = None
+        self.tools_ready = threading.Event()
+        self.engine = VideoEngine(None, None, log=self.log, stop_event=self.stop_event)
+        self.advanced_frame = None
+
+        self._build_variables()
+        self._setup_styles()
+        self._build_ui()
+        self._bind_events()
+        self._refresh_mode_ui()
+        self._refresh_resolution_presets()
+        self.master.after(100, self._process_queues)
+        self.master.after_idle(lambda: threading.Thread(target=self._discover_tools, daemon=True).start())
+
+    def _discover_tools(self):
+        """后台查找 ffmpeg/ffprobe 并预热编码器检测（结果会持久化），第一个任务不用再等。"""
+        try:
+            ffmpeg_path = find_tool("ffmpeg")
+            ffprobe_path = find_tool("ffprobe")
+            self.engine.ffmpeg_path, self.engine.ffprobe_path = ffmpeg_path, ffprobe_path
+            self.engine._capabilities = None
+            if ffmpeg_path:
+                self.engine.capabilities()
+                self.log(f"检测到 FFmpeg：{ffmpeg_path}", "success")
+            else:
+                self.ui_queue.put(("ffmpeg_missing",))
+            self.ffmpeg_path, self.ffprobe_path = ffmpeg_path, ffprobe_path
+        finally:
+            self.tools_ready.set()
+            self.ui_queue.put(("tools_ready",))
+
+    # ------------------------------------------------------------------
+    # UI 初始化
+    # ------------------------------------------------------------------
+    def _build_variables(self):
+        self.mode_var = tk.StringVar(value="小白推荐")
+        self.process_type_var = tk.StringVar(value="同时添加")
+        self.aspect_var = tk.StringVar(value="9:16 竖屏")
+        self.resolution_var = tk.StringVar(value="1080x1920")
+        self.fit_mode_var = tk.StringVar(value="居中裁剪")
+        self.framerate_var = tk.StringVar(value="30")
+        self.quality_preset_var = tk.StringVar(value="高清推荐")
+
+        self.accel_var = tk.StringVar(value="自动选择")
+        self.codec_var = tk.StringVar(value="H.264 兼容优先")
+        self.rate_mode_var = tk.StringVar(value="智能动态码率")
+        self.bitrate_var = tk.StringVar(value="6000")
+        self.maxrate_var = tk.StringVar(value="9000")
+        self.crf_cq_var = tk.StringVar(value="22")
+        self.encoder_preset_var = tk.StringVar(value="均衡")
+        self.audio_bitrate_var = tk.StringVar(value="192")
+        self.audio_mode_var = tk.StringVar(value="AAC 立体声")
+        self.extra_args_var = tk.StringVar(value="")
+        self.renditions_var = tk.StringVar(value="")
+        self.transition_var = tk.StringVar(value="无")
+        self.transition_duration_var = tk.StringVar(value="0.5")
+        self.container_var = tk.StringVar(value=CONTAINER_MODES["mp4"])
+        self.segment_seconds_var = tk.StringVar(value="6")
+        self.thumbnails_var = tk.BooleanVar(value=False)
+        self.watermark_var = tk.StringVar(value="")
+        self.watermark_position_var = tk.StringVar(value="右上")
+        self.watermark_scale_var = tk.StringVar(value="0.15")
+        self.caption_var = tk.StringVar(value="")
+        # 字幕字体只能在配置文件里指定，界面上保留加载进来的值。
+        self.caption_font = ""
+        self.target_size_var = tk.StringVar(value="50")
+        self.jobs_var = tk.StringVar(value="1")
+        self.throughput_var = tk.StringVar(value="")
+        self.scene_analysis_var = tk.BooleanVar(value=False)
+        self.loudnorm_var = tk.BooleanVar(value=False)
+        self.loudness_target_var = tk.StringVar(value="-16")
+        self.verify_quality_var = tk.BooleanVar(value=False)
+        self.min_ssim_var = tk.StringVar(value="0.95")
+        self.min_vmaf_var = tk.StringVar(value="85")
+        self.log_expanded_var = tk.BooleanVar(value=False)
+        self.overwrite_var = tk.BooleanVar(value=True)
+        self.keep_temp_var = tk.BooleanVar(value=False)
+
+    def _setup_styles(self):
+        style = ttk.Style()
+        try:
+            style.theme_use("clam")
+        except tk.TclError:
+            pass
+
+        style.configure("TFrame", background="#f4f6f8")
+        style.configure("Card.TFrame", background="#ffffff", relief="flat")
+        style.configure("TLabel", background="#f4f6f8", font=("微软雅黑", 9))
+        style.configure("Card.TLabel", background="#ffffff", font=("微软雅黑", 9))
+        style.configure("Hint.TLabel", background="#ffffff", foreground="#64748b", font=("微软雅黑", 8))
+        style.configure("Title.TLabel", background="#f4f6f8", font=("微软雅黑", 15, "bold"), foreground="#0f172a")
+        style.configure("Section.TLabel", background="#ffffff", font=("微软雅黑", 10, "bold"), foreground="#1e293b")
+        style.configure("TButton", font=("微软雅黑", 9), padding=(8, 4))
+        style.configure("Primary.TButton", font=("微软雅黑", 10, "bold"), padding=(12, 7))
+        style.configure("Danger.TButton", foreground="#b91c1c", font=("微软雅黑", 10, "bold"), padding=(12, 7))
+        style.configure("Small.TButton", font=("微软雅黑", 8), padding=(6, 2))
+        style.configure("TCheckbutton", background="#ffffff", font=("微软雅黑", 9))
+        style.configure("TRadiobutton", background="#ffffff", font=("微软雅黑", 9))
+        style.configure("TLabelframe", background="#ffffff")
+        style.configure("TLabelframe.Label", font=("微软雅黑", 10, "bold"), foreground="#334155")
+
+    def _build_ui(self):
+        root = ttk.Frame(self.master, padding=10)
+        root.pack(fill=tk.BOTH, expand=True)
+
+        self._build_header(root)
+
+        body = ttk.PanedWindow(root, orient=tk.HORIZONTAL)
+        body.pack(fill=tk.BOTH, expand=True, pady=(8, 6))
+
+        left = ttk.Frame(body)
+        right = ttk.Frame(body)
+        body.add(left, weight=3)
+        body.add(right, weight=2)
+
+        self._build_file_panel(left)
+        self._build_settings_panel(right)
+        self._build_bottom_bar(root)
+        self._build_log_panel(root)
+
+    def _build_header(self, parent):
+        header = ttk.Frame(parent)
+        header.pack(fill=tk.X)
+
+        ttk.Label(header, text="视频片头片尾批处理", style="Title.TLabel").pack(side=tk.LEFT)
+
+        mode_box = ttk.Frame(header)
+        mode_box.pack(side=tk.RIGHT)
+        ttk.Label(mode_box, text="操作模式：").pack(side=tk.LEFT, padx=(0, 4))
+        self.mode_combo = ttk.Combobox(
+            mode_box,
+            textvariable=self.mode_var,
+            values=["小白推荐", "半专业调节"],
+            state="readonly",
+            width=14,
+        )
+        self.mode_combo.pack(side=tk.LEFT)
+
+    def _build_file_panel(self, parent):
+        card = ttk.Frame(parent, style="Card.TFrame", padding=10)
+        card.pack(fill=tk.BOTH, expand=True)
+
+        top = ttk.Frame(card, style="Card.TFrame")
+        top.pack(fill=tk.X)
+        ttk.Label(top, text="文件列表", style="Section.TLabel").pack(side=tk.LEFT)
+        self.file_filter_var = tk.StringVar(value=FILE_FILTERS[0])
+        file_filter = ttk.Combobox(top, textvariable=self.file_filter_var, values=FILE_FILTERS, state="readonly", width=7)
+        file_filter.pack(side=tk.LEFT, padx=(8, 0))
+        file_filter.bind("<<ComboboxSelected>>", self._on_file_filter)
+
+        btns = ttk.Frame(top, style="Card.TFrame")
+        btns.pack(side=tk.RIGHT)
+        ttk.Button(btns, text="添加文件夹", style="Small.TButton", command=self.add_folder).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btns, text="添加文件", style="Small.TButton", command=self.add_files).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btns, text="删除选中", style="Small.TButton", command=self.delete_selected).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btns, text="清空", style="Small.TButton", command=self.clear_list).pack(side=tk.LEFT, padx=2)
+
+        hint = ttk.Label(
+            card,
+            text="支持 mp4 / mov / mkv / avi / webm 等常见格式，可批量添加文件夹。",
+            style="Hint.TLabel",
+        )
+        hint.pack(fill=tk.X, pady=(4, 6))
+
+        table_frame = ttk.Frame(card, style="Card.TFrame")
+        table_frame.pack(fill=tk.BOTH, expand=True)
+
+        self.tree = ttk.Treeview(
+            table_frame,
+            columns=("status", "name", "size", "duration", "group", "path"),
+            displaycolumns=("status", "group", "name", "size", "duration", "path"),
+            show="headings",
+            selectmode="extended",
+        )
+        for column, text in FILE_COLUMNS.items():
+            self.tree.heading(column, text=text, command=lambda c=column: self._sort_file_view(c))
+        self.tree.column("status", width=76, anchor=tk.CENTER, stretch=False)
+        self.tree.column("group", width=56, anchor=tk.CENTER, stretch=False)
+        self.tree.column("name", width=180, anchor=tk.W, stretch=False)
+        self.tree.column("size", width=80, anchor=tk.E, stretch=False)
+        self.tree.column("duration", width=70, anchor=tk.E, stretch=False)
+        self.tree.column("path", width=420, anchor=tk.W)
+
+        # 竖向滚动条不跟 Treeview 走（里面只有看得见的几十行），由 _scroll_file_view 换页。
+        self.file_scroll = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self._scroll_file_view)
+        xscroll = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=xscroll.set)
+        self.tree.bind("<Configure>", self._on_file_view_configure)
+        self.tree.bind("<MouseWheel>", lambda e: self._scroll_file_view("scroll", -3 * int(e.delta / 120), "units"))
+        self.tree.bind("<Button-4>", lambda e: self._scroll_file_view("scroll", -3, "units"))
+        self.tree.bind("<Button-5>", lambda e: self._scroll_file_view("scroll", 3, "units"))
+        self.tree.bind("<Prior>", lambda e: self._scroll_file_view("scroll", -1, "pages"))
+        self.tree.bind("<Next>", lambda e: self._scroll_file_view("scroll", 1, "pages"))
+        self.tree.bind("<Home>", lambda e: self._scroll_file_view("moveto", 0))
+        self.tree.bind("<End>", lambda e: self._scroll_file_view("moveto", 1))
+        self.tree.bind("<Up>", lambda e: self._step_file_view(-1))
+        self.tree.bind("<Down>", lambda e: self._step_file_view(1))
+
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.file_scroll.grid(row=0, column=1, sticky="ns")
+        xscroll.grid(row=1, column=0, sticky="ew")
+        table_frame.rowconfigure(0, weight=1)
+        table_frame.columnconfigure(0, weight=1)
+
+        self.context_menu = tk.Menu(self.tree, tearoff=0)
+        self.context_menu.add_command(label="删除选中", command=self.delete_selected)
+        self.context_menu.add_command(label="打开所在文件夹", command=self.open_selected_folder)
+        self.context_menu.add_command(label="打开输出位置", command=self.open_selected_output)
+        self.context_menu.add_command(label="预览拼接效果", command=self.preview_selected)
+        self.context_menu.add_command(label="加急处理", command=self.expedite_selected)
         self.tree.bind("<Button-3>", self._show_context_menu)
 
     def _build_settings_panel(self, parent):
         outer = ttk.Frame(parent, style="Card.TFrame", padding=10)
         outer.pack(fill=tk.BOTH, expand=True, padx=(8, 0))
 
-        ttk.Label(outer, text="处理与编码设置", style="Section.TLabel").pack(anchor=tk.W)
+        top = ttk.Frame(outer, style="Card.TFrame")
+        top.pack(fill=tk.X)
+        ttk.Label(top, text="处理与编码设置", style="Section.TLabel").pack(side=tk.LEFT)
+        btns = ttk.Frame(top, style="Card.TFrame")
+        btns.pack(side=tk.RIGHT)
+        ttk.Button(btns, text="加载配置", style="Small.TButton", command=self.load_profile).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btns, text="保存配置", style="Small.TButton", command=self.save_profile).pack(side=tk.LEFT, padx=2)
         ttk.Label(
             outer,
             text="小白模式只显示必要选项；半专业模式会展开码率、编码器、音频和高级参数。",
@@ -522,12 +5221,13 @@ class VideoProcessorApp:
         ).pack(fill=tk.X, pady=(4, 6))
 
         self.settings_scroll = ScrollableFrame(outer)
-        self.settings_scroll.pack(fill=tk.BOTH, expand=True)
+        self.settings_scroll.frame.pack(fill=tk.BOTH, expand=True)
         form = self.settings_scroll.inner
 
         self._build_basic_settings(form)
         self._build_simple_settings(form)
-        self._build_advanced_settings(form)
+        # 半专业面板控件最多，第一次切到半专业模式时才创建。
+        self.settings_form = form
 
     def _build_basic_settings(self, parent):
         frame = ttk.LabelFrame(parent, text="基础处理", padding=10)
@@ -624,7 +5324,7 @@ class VideoProcessorApp:
         ttk.Combobox(
             video,
             textvariable=self.fit_mode_var,
-            values=["居中裁剪", "完整保留补黑边", "拉伸填满"],
+            values=FIT_MODES,
             state="readonly",
             width=12,
         ).grid(row=1, column=1, sticky="ew", padx=(8, 8), pady=3)
@@ -638,6 +5338,43 @@ class VideoProcessorApp:
         )
         self.advanced_fps_combo.grid(row=1, column=3, sticky="ew", padx=(8, 0), pady=3)
 
+        self._add_label(video, "多规格输出", 2, 0)
+        ttk.Entry(video, textvariable=self.renditions_var).grid(row=2, column=1, columnspan=3, sticky="ew", padx=(8, 0), pady=3)
+        ttk.Label(
+            video,
+            text="可选：一次解码同时输出多个规格，如 1080x1920; 720x1280::3000; 1920x1080:补黑边。格式为 分辨率:适配:码率:最高码率，留空只输出一个文件。",
+            style="Hint.TLabel",
+            wraplength=340,
+        ).grid(row=3, column=0, columnspan=4, sticky="ew", pady=(2, 0))
+
+        self._add_label(video, "转场", 4, 0)
+        ttk.Combobox(
+            video,
+            textvariable=self.transition_var,
+            values=["无", *TRANSITIONS.values()],
+            state="readonly",
+            width=12,
+        ).grid(row=4, column=1, sticky="ew", padx=(8, 8), pady=3)
+
+        self._add_label(video, "转场时长", 4, 2)
+        ttk.Combobox(video, textvariable=self.transition_duration_var, values=["0.3", "0.5", "0.8", "1.0"], width=14).grid(
+            row=4, column=3, sticky="ew", padx=(8, 0), pady=3
+        )
+
+        self._add_label(video, "输出格式", 5, 0)
+        ttk.Combobox(video, textvariable=self.container_var, values=list(CONTAINER_MODES.values()), state="readonly", width=12).grid(
+            row=5, column=1, sticky="ew", padx=(8, 8), pady=3
+        )
+        self._add_label(video, "分片时长", 5, 2)
+        ttk.Combobox(video, textvariable=self.segment_seconds_var, values=["2", "4", "6", "10"], width=14).grid(
+            row=5, column=3, sticky="ew", padx=(8, 0), pady=3
+        )
+        ttk.Checkbutton(
+            video,
+            text="同时生成封面和缩略图拼图（和正片同一次解码，放在成品旁边）",
+            variable=self.thumbnails_var,
+        ).grid(row=6, column=0, columnspan=4, sticky="w", pady=(4, 0))
+
         codec = ttk.LabelFrame(self.advanced_frame, text="编码与码率", padding=10)
         codec.pack(fill=tk.X, pady=(0, 8))
         codec.columnconfigure(1, weight=1)
@@ -647,7 +5384,7 @@ class VideoProcessorApp:
         ttk.Combobox(
             codec,
             textvariable=self.codec_var,
-            values=["H.264 兼容优先", "H.265 体积更小"],
+            values=CODECS,
             state="readonly",
             width=14,
         ).grid(row=0, column=1, sticky="ew", padx=(8, 8), pady=3)
@@ -656,7 +5393,7 @@ class VideoProcessorApp:
         ttk.Combobox(
             codec,
             textvariable=self.accel_var,
-            values=["自动选择", "NVIDIA GPU", "AMD GPU", "Intel GPU", "CPU"],
+            values=ACCEL_MODES,
             state="readonly",
             width=14,
         ).grid(row=0, column=3, sticky="ew", padx=(8, 0), pady=3)
@@ -665,7 +5402,7 @@ class VideoProcessorApp:
         ttk.Combobox(
             codec,
             textvariable=self.rate_mode_var,
-            values=["智能动态码率", "固定码率 CBR", "平均码率 VBR", "恒定质量 CRF/CQ"],
+            values=RATE_MODES,
             state="readonly",
             width=14,
         ).grid(row=1, column=1, columnspan=3, sticky="ew", padx=(8, 0), pady=3)
@@ -682,11 +5419,21 @@ class VideoProcessorApp:
         self.crf_entry = ttk.Combobox(codec, textvariable=self.crf_cq_var, values=["18", "20", "22", "24", "26", "28"], width=12)
         self.crf_entry.grid(row=3, column=1, sticky="ew", padx=(8, 8), pady=3)
 
+        self.target_size_label = self._add_label(codec, "目标大小MB", 4, 0)
+        self.target_size_entry = ttk.Combobox(codec, textvariable=self.target_size_var, values=["8", "16", "25", "50", "100", "200"], width=12)
+        self.target_size_entry.grid(row=4, column=1, sticky="ew", padx=(8, 8), pady=3)
+
+        ttk.Checkbutton(
+            codec,
+            text="按画面复杂度自动微调 CRF / 最高码率（首次多花几秒分析，结果会缓存）",
+            variable=self.scene_analysis_var,
+        ).grid(row=5, column=0, columnspan=4, sticky="w", pady=(4, 0))
+
         self._add_label(codec, "编码预设", 3, 2)
         ttk.Combobox(
             codec,
             textvariable=self.encoder_preset_var,
-            values=["速度优先", "均衡", "质量优先"],
+            values=PRESET_LADDER,
             state="readonly",
             width=12,
         ).grid(row=3, column=3, sticky="ew", padx=(8, 0), pady=3)
@@ -700,7 +5447,7 @@ class VideoProcessorApp:
         ttk.Combobox(
             audio,
             textvariable=self.audio_mode_var,
-            values=["AAC 立体声", "复制音频", "静音输出"],
+            values=AUDIO_MODES,
             state="readonly",
             width=12,
         ).grid(row=0, column=1, sticky="ew", padx=(8, 8), pady=3)
@@ -710,19 +5457,82 @@ class VideoProcessorApp:
             row=0, column=3, sticky="ew", padx=(8, 0), pady=3
         )
 
-        self._add_label(audio, "高级参数", 1, 0)
-        ttk.Entry(audio, textvariable=self.extra_args_var).grid(row=1, column=1, columnspan=3, sticky="ew", padx=(8, 0), pady=3)
+        ttk.Checkbutton(audio, text="响度统一（EBU R128）", variable=self.loudnorm_var).grid(row=1, column=0, columnspan=2, sticky="w", pady=3)
+        self._add_label(audio, "目标响度", 1, 2)
+        ttk.Combobox(audio, textvariable=self.loudness_target_var, values=["-14", "-16", "-18", "-23"], width=12).grid(
+            row=1, column=3, sticky="ew", padx=(8, 0), pady=3
+        )
+
+        self._add_label(audio, "高级参数", 2, 0)
+        ttk.Entry(audio, textvariable=self.extra_args_var).grid(row=2, column=1, columnspan=3, sticky="ew", padx=(8, 0), pady=3)
 
         options = ttk.Frame(audio, style="Card.TFrame")
-        options.grid(row=2, column=0, columnspan=4, sticky="ew", pady=(6, 0))
+        options.grid(row=3, column=0, columnspan=4, sticky="ew", pady=(6, 0))
         ttk.Checkbutton(options, text="覆盖同名输出", variable=self.overwrite_var).pack(side=tk.LEFT, padx=(0, 12))
-        ttk.Checkbutton(options, text="保留临时文件", variable=self.keep_temp_var).pack(side=tk.LEFT)
+        ttk.Checkbutton(options, text="保留临时文件", variable=self.keep_temp_var).pack(side=tk.LEFT, padx=(0, 12))
+        ttk.Label(options, text="并行任务：", style="Card.TLabel").pack(side=tk.LEFT)
+        ttk.Combobox(options, textvariable=self.jobs_var, values=["1", "2", "3", "4", "6", "8"], width=4).pack(side=tk.LEFT, padx=(0, 12))
+        ttk.Label(options, text="吞吐目标：", style="Card.TLabel").pack(side=tk.LEFT)
+        ttk.Combobox(options, textvariable=self.throughput_var, values=["", "1x", "2x", "4x", "60m", "2h"], width=7).pack(side=tk.LEFT)
 
         ttk.Label(
             audio,
-            text="提示：高级参数可填写如 -movflags +faststart；不会写就留空。",
+            text="提示：高级参数可填写如 -tune film；不会写就留空。吞吐目标填 18:30（完成时刻）、90m（时长）或 4x（实时倍数），"
+            "会按实测速度在所选编码预设和更快的预设之间自动切换，留空不调整。",
+            style="Hint.TLabel",
+            wraplength=340,
+        ).grid(row=4, column=0, columnspan=4, sticky="ew", pady=(4, 0))
+
+        verify = ttk.LabelFrame(self.advanced_frame, text="画质校验", padding=10)
+        verify.pack(fill=tk.X, pady=(0, 8))
+        verify.columnconfigure(1, weight=1)
+        verify.columnconfigure(3, weight=1)
+
+        ttk.Checkbutton(verify, text="处理完抽样对比原视频，低于下限的文件标记为失败", variable=self.verify_quality_var).grid(
+            row=0, column=0, columnspan=4, sticky="w"
+        )
+        self._add_label(verify, "SSIM 下限", 1, 0)
+        ttk.Combobox(verify, textvariable=self.min_ssim_var, values=["", "0.90", "0.93", "0.95", "0.97"], width=12).grid(
+            row=1, column=1, sticky="ew", padx=(8, 8), pady=3
+        )
+        self._add_label(verify, "VMAF 下限", 1, 2)
+        ttk.Combobox(verify, textvariable=self.min_vmaf_var, values=["", "80", "85", "90", "93", "95"], width=12).grid(
+            row=1, column=3, sticky="ew", padx=(8, 0), pady=3
+        )
+        ttk.Label(
+            verify,
+            text="VMAF 需要 FFmpeg 带 libvmaf，没有时只检查 SSIM/PSNR；结果写入输出目录的 metrics.jsonl。",
+            style="Hint.TLabel",
+            wraplength=340,
+        ).grid(row=2, column=0, columnspan=4, sticky="ew", pady=(2, 0))
+
+        overlay = ttk.LabelFrame(self.advanced_frame, text="水印与字幕", padding=10)
+        overlay.pack(fill=tk.X, pady=(0, 8))
+        overlay.columnconfigure(1, weight=1)
+        overlay.columnconfigure(3, weight=1)
+
+        self._add_label(overlay, "水印图片", 0, 0)
+        ttk.Entry(overlay, textvariable=self.watermark_var).grid(row=0, column=1, columnspan=2, sticky="ew", padx=(8, 4), pady=3)
+        ttk.Button(overlay, text="浏览", style="Small.TButton", command=self.browse_watermark).grid(row=0, column=3, sticky="w", pady=3)
+
+        self._add_label(overlay, "水印位置", 1, 0)
+        ttk.Combobox(overlay, textvariable=self.watermark_position_var, values=list(WATERMARK_POSITIONS), state="readonly", width=12).grid(
+            row=1, column=1, sticky="ew", padx=(8, 8), pady=3
+        )
+        self._add_label(overlay, "水印大小", 1, 2)
+        ttk.Combobox(overlay, textvariable=self.watermark_scale_var, values=["0.08", "0.12", "0.15", "0.2", "0.3"], width=12).grid(
+            row=1, column=3, sticky="ew", padx=(8, 0), pady=3
+        )
+
+        self._add_label(overlay, "字幕模板", 2, 0)
+        ttk.Entry(overlay, textvariable=self.caption_var).grid(row=2, column=1, columnspan=3, sticky="ew", padx=(8, 0), pady=3)
+        ttk.Label(
+            overlay,
+            text="只叠加在正片上，和正片同一次编码完成。水印大小是占画面宽度的比例，按输出分辨率缩放一次后缓存；"
+            "字幕可用 {stem} 文件名、{title} 视频标题、{date} 修改日期、{parent} 文件夹名，留空不加字幕。",
             style="Hint.TLabel",
-        ).grid(row=3, column=0, columnspan=4, sticky="ew", pady=(4, 0))
+            wraplength=340,
+        ).grid(row=3, column=0, columnspan=4, sticky="ew", pady=(2, 0))
 
     def _build_bottom_bar(self, parent):
         bottom = ttk.Frame(parent)
@@ -735,7 +5545,14 @@ class VideoProcessorApp:
         right.pack(side=tk.RIGHT)
         self.progress = ttk.Progressbar(right, orient=tk.HORIZONTAL, mode="determinate", length=220)
         self.progress.pack(side=tk.LEFT, padx=(0, 8))
-        self.start_btn = ttk.Button(right, text="开始处理", style="Primary.TButton", command=self.start_processing)
+        # 三个按钮在 FFmpeg 检测完成前不可用，检测线程结束后经界面队列启用（见 _discover_tools）。
+        self.preview_btn = ttk.Button(right, text="预览", command=self.preview_selected, state=tk.DISABLED)
+        self.preview_btn.pack(side=tk.LEFT, padx=4)
+        self.estimate_btn = ttk.Button(right, text="预估", command=self.estimate_processing, state=tk.DISABLED)
+        self.estimate_btn.pack(side=tk.LEFT, padx=4)
+        self.start_btn = ttk.Button(
+            right, text="开始处理", style="Primary.TButton", command=self.start_processing, state=tk.DISABLED,
+        )
         self.start_btn.pack(side=tk.LEFT, padx=4)
         self.stop_btn = ttk.Button(right, text="停止", style="Danger.TButton", command=self.stop_processing, state=tk.DISABLED)
         self.stop_btn.pack(side=tk.LEFT, padx=4)
@@ -788,12 +5605,16 @@ class VideoProcessorApp:
     def _refresh_mode_ui(self):
         is_simple = self.mode_var.get() == "小白推荐"
         if is_simple:
-            self.advanced_frame.pack_forget()
+            if self.advanced_frame is not None:
+                self.advanced_frame.pack_forget()
             if not self.simple_frame.winfo_ismapped():
                 self.simple_frame.pack(fill=tk.X, pady=(0, 8), padx=(0, 2), after=self.simple_frame.master.winfo_children()[0])
             self.status_label.configure(text="小白推荐模式：保留必要参数，默认即可使用")
         else:
             self.simple_frame.pack_forget()
+            if self.advanced_frame is None:
+                self._build_advanced_settings(self.settings_form)
+                self._refresh_resolution_presets()
             if not self.advanced_frame.winfo_ismapped():
                 self.advanced_frame.pack(fill=tk.X, pady=(0, 8), padx=(0, 2))
             self.status_label.configure(text="半专业调节模式：可调整编码、码率、音频和高级参数")
@@ -834,16 +5655,21 @@ class VideoProcessorApp:
                 combo.configure(values=values)
 
     def _refresh_rate_mode_ui(self):
+        if self.advanced_frame is None:
+            return
         mode = self.rate_mode_var.get()
-        show_bitrate = mode in ("智能动态码率", "固定码率 CBR", "平均码率 VBR")
-        show_maxrate = mode in ("智能动态码率", "平均码率 VBR")
+        show_bitrate = mode in ("智能动态码率", "固定码率 CBR", "平均码率 VBR", "两遍编码 2-pass")
+        show_maxrate = mode in ("智能动态码率", "平均码率 VBR", "两遍编码 2-pass")
         show_crf = mode in ("恒定质量 CRF/CQ", "智能动态码率")
+        show_target = mode == "目标文件大小"
         self._grid_visible(self.bitrate_label, show_bitrate)
         self._grid_visible(self.bitrate_entry, show_bitrate)
         self._grid_visible(self.maxrate_label, show_maxrate)
         self._grid_visible(self.maxrate_entry, show_maxrate)
         self._grid_visible(self.crf_label, show_crf)
         self._grid_visible(self.crf_entry, show_crf)
+        self._grid_visible(self.target_size_label, show_target)
+        self._grid_visible(self.target_size_entry, show_target)
 
     def _grid_visible(self, widget, visible):
         if visible:
@@ -865,6 +5691,11 @@ class VideoProcessorApp:
             entry_widget.insert(0, path)
             self._refresh_process_type_ui()
 
+    def browse_watermark(self):
+        path = filedialog.askopenfilename(filetypes=[("图片", "*.png *.jpg *.jpeg *.webp *.bmp"), ("所有文件", "*.*")])
+        if path:
+            self.watermark_var.set(path)
+
     def browse_output_dir(self):
         path = filedialog.askdirectory()
         if path:
@@ -875,20 +5706,14 @@ class VideoProcessorApp:
         folder = filedialog.askdirectory()
         if not folder:
             return
-        new_files = []
-        for root, _, files in os.walk(folder):
-            for filename in files:
-                if filename.lower().endswith(VIDEO_EXTENSIONS):
-                    new_files.append(os.path.normpath(os.path.join(root, filename)))
-        self.update_file_list(new_files)
+        self.update_file_list(collect_video_files([folder]))
 
     def add_files(self):
         files = filedialog.askopenfilenames(filetypes=[("视频文件", "*.mp4 *.mkv *.avi *.mov *.flv *.wmv *.webm *.m4v"), ("所有文件", "*.*")])
         self.update_file_list([os.path.normpath(f) for f in files])
 
     def update_file_list(self, new_files):
-        existing = set(self.file_list)
-        added = []
+        candidates = []
         skipped = 0
         for f in new_files:
             if not f:
@@ -899,51 +5724,111 @@ class VideoProcessorApp:
             if not f.lower().endswith(VIDEO_EXTENSIONS):
                 skipped += 1
                 continue
-            if f not in existing:
-                self.file_list.append(f)
-                existing.add(f)
-                added.append(f)
-                self.tree.insert("", tk.END, values=("等待", os.path.basename(f), f), tags=("waiting",))
+            candidates.append((f, os.path.getsize(f)))
+        added = self.files.add(candidates)
+        if added:
+            self._refresh_file_view()
+            self._fill_durations()
 
         if added:
             self.log(f"成功添加 {len(added)} 个视频文件", "success")
+        if added and self.processing_thread and self.processing_thread.is_alive():
+            # 处理过程中添加的文件排进正在进行的这一批，排在已有文件后面。
+            accepted = self.engine.add_to_batch(added, PRIORITY_NORMAL)
+            self._extend_batch(accepted)
+            if accepted:
+                self.log(f"已把 {len(accepted)} 个新文件加入正在进行的批处理", "info")
+            else:
+                self.log("这一批还在准备或已在收尾，新文件等下次开始处理", "warning")
         if skipped:
             self.log(f"已跳过 {skipped} 个非视频或无效文件", "warning")
         if not added and not skipped:
             self.log("没有新增文件", "info")
-        self._set_status(f"当前共有 {len(self.file_list)} 个待处理文件")
+        self._set_status(f"当前共有 {len(self.files)} 个待处理文件")
+        if added:
+            self._refresh_duplicates()
+
+    def _refresh_duplicates(self):
+        """后台按内容查找重复文件，结果放进界面队列，在文件列表的“重复”列标出分组。"""
+        self._dedup_generation += 1
+        generation, files = self._dedup_generation, self.files.paths()
+
+        def work():
+            groups = find_duplicates(files, self.engine.probe_index)
+            self.ui_queue.put(("duplicates", generation, groups))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def _show_duplicates(self, groups):
+        self.files.set_groups({path: f"组{i}" for i, group in enumerate(groups, 1) for path in group})
+        self._refresh_file_view()
+        if groups:
+            extra = sum(len(group) - 1 for group in groups)
+            self.log(f"发现 {len(groups)} 组内容相同的文件，处理时每组只编码一次，其余 {extra} 个直接复用成品", "info")
 
     def delete_selected(self):
         selected = list(self.tree.selection())
         if not selected:
             return
-        for item in selected:
-            values = self.tree.item(item, "values")
-            path = values[2]
-            if path in self.file_list:
-                self.file_list.remove(path)
-            self.tree.delete(item)
+        self.files.remove(selected)
+        self._refresh_file_view()
         self.log(f"已删除 {len(selected)} 个选中文件", "info")
-        self._set_status(f"当前共有 {len(self.file_list)} 个待处理文件")
+        self._set_status(f"当前共有 {len(self.files)} 个待处理文件")
+        self._refresh_duplicates()
 
     def clear_list(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        self.file_list.clear()
+        self.files.clear()
+        self._view_offset = 0
+        self._refresh_file_view()
+        self._dedup_generation += 1
         self.log("已清空文件列表", "info")
         self._set_status("当前没有待处理文件")
 
+    def expedite_selected(self):
+        """把选中的文件提到最前。处理中时插进正在进行的这一批，各路都忙就让一个普通任务暂时让位；
+        还没开始时移到列表最前面。"""
+        selected = list(self.tree.selection())
+        if not selected:
+            return
+        paths = [path for _, path, _ in self.files.rows(selected)]
+        if self.processing_thread and self.processing_thread.is_alive():
+            accepted = self.engine.add_to_batch(paths, PRIORITY_URGENT, preempt=True)
+            self._extend_batch(accepted)
+            for path in accepted:
+                self._update_tree_status(path, "加急")
+            if accepted:
+                self.log(f"已加急 {len(accepted)} 个文件，会在空出（或让出）的下一路立即处理", "success")
+            if len(accepted) < len(paths):
+                self.log(f"{len(paths) - len(accepted)} 个文件已在处理、已处理完，或这一批还没开始排队，未加急", "info")
+            return
+        self.files.move_to_front(selected)
+        self._refresh_file_view()
+        self.log(f"已把 {len(paths)} 个文件移到列表最前，开始处理时先处理", "info")
+
+    def _extend_batch(self, paths):
+        """处理中新加入这一批的文件计入总数和进度条。"""
+        new = [path for path in paths if path not in self._batch_files]
+        if new:
+            self._batch_files.update(new)
+            self.progress.configure(maximum=len(self._batch_files))
+
     def open_selected_folder(self):
         selected = self.tree.selection()
         if not selected:
             return
-        path = self.tree.item(selected[0], "values")[2]
-        folder = os.path.dirname(path)
+        path = self.tree.set(selected[0], "path")
+        try:
+            open_with_system(os.path.dirname(path))
+        except Exception as exc:
+            self.log(f"打开文件夹失败：{exc}", "error")
+
+    def open_selected_output(self):
+        rows = self.files.rows(self.tree.selection()[:1])
+        if not rows or not rows[0][2]:
+            self.log("选中的文件还没有输出", "info")
+            return
         try:
-            if os.name == "nt":
-                os.startfile(folder)
-            elif os.name == "posix":
-                subprocess.Popen(["open" if sys.platform == "darwin" else "xdg-open", folder])
+            open_with_system(os.path.dirname(rows[0][2]))
         except Exception as exc:
             self.log(f"打开文件夹失败：{exc}", "error")
 
@@ -962,248 +5847,139 @@ class VideoProcessorApp:
             messagebox.showerror("无法开始", message)
             return
 
-        self.stop_event.clear()
-        self.progress.configure(value=0, maximum=max(1, len(self.file_list)))
-        self.start_btn.configure(state=tk.DISABLED)
-        self.stop_btn.configure(state=tk.NORMAL)
-        self._set_status("开始处理...")
-
-        self.processing_thread = threading.Thread(target=self.process_files, daemon=True)
-        self.processing_thread.start()
-
-    def validate_inputs(self):
-        if not self.ffmpeg_path:
-            return False, "没有检测到 ffmpeg。请先安装 ffmpeg，并加入系统 PATH。"
-        if not self.file_list:
-            return False, "请先添加要处理的视频文件。"
-        output_dir = self.output_entry.get().strip()
-        if not output_dir:
-            return False, "请选择输出目录。"
-        try:
-            Path(output_dir).mkdir(parents=True, exist_ok=True)
-        except Exception as exc:
-            return False, f"输出目录不可用：{exc}"
-
-        process_type = self.process_type_var.get()
-        if process_type in ("加片头", "同时添加"):
-            intro = self.intro_entry.get().strip()
-            if not intro or not os.path.isfile(intro):
-                return False, "请选择有效的片头视频文件。"
-        if process_type in ("加片尾", "同时添加"):
-            outro = self.outro_entry.get().strip()
-            if not outro or not os.path.isfile(outro):
-                return False, "请选择有效的片尾视频文件。"
-
-        ok, msg = self._validate_resolution_and_fps()
-        if not ok:
-            return False, msg
-
-        if self.mode_var.get() == "半专业调节":
-            ok, msg = self._validate_advanced_values()
-            if not ok:
-                return False, msg
-        return True, "ok"
-
-    def _validate_resolution_and_fps(self):
-        res = self.resolution_var.get().strip()
-        if res in ("跟随原视频", "自定义输入"):
-            if res == "自定义输入":
-                return False, "分辨率不能保留为“自定义输入”，请直接输入例如 1080x1920。"
-        else:
-            if not re.fullmatch(r"\d{2,5}\s*[xX*]\s*\d{2,5}", res):
-                return False, "分辨率格式不正确，请输入例如 1080x1920 或 1920x1080。"
-            w, h = self._parse_resolution(res)
-            if w < 64 or h < 64:
-                return False, "分辨率太小，宽高都建议不低于 64。"
-            if w % 2 != 0 or h % 2 != 0:
-                return False, "分辨率的宽和高必须是偶数，避免编码器报错。"
-
-        fps = self.framerate_var.get().strip()
-        if fps != "跟随原视频":
-            try:
-                val = float(fps)
-            except ValueError:
-                return False, "帧率必须是数字，例如 30，也可以选择“跟随原视频”。"
-            if val <= 0 or val > 240:
-                return False, "帧率范围建议在 1 到 240 之间。"
-        return True, "ok"
-
-    def _validate_advanced_values(self):
-        for label, value, min_val, max_val in [
-            ("目标码率", self.bitrate_var.get(), 300, 200000),
-            ("最高码率", self.maxrate_var.get(), 300, 300000),
-            ("音频码率", self.audio_bitrate_var.get(), 32, 1024),
-        ]:
-            if self.rate_mode_var.get() == "恒定质量 CRF/CQ" and label in ("目标码率", "最高码率"):
-                continue
-            try:
-                intval = int(str(value).strip())
-            except ValueError:
-                return False, f"{label}必须是数字。"
-            if not (min_val <= intval <= max_val):
-                return False, f"{label}建议在 {min_val} 到 {max_val} 之间。"
-
-        try:
-            q = int(str(self.crf_cq_var.get()).strip())
-        except ValueError:
-            return False, "CRF/CQ 必须是数字。"
-        if not (0 <= q <= 51):
-            return False, "CRF/CQ 建议在 0 到 51 之间，数字越小质量越高、文件越大。"
-        return True, "ok"
-
-    # ------------------------------------------------------------------
-    # 处理逻辑
-    # ------------------------------------------------------------------
-    def process_files(self):
-        total = len(self.file_list)
-        processed_count = 0
-        try:
-            output_dir = self.output_entry.get().strip()
-            self.log("========== 开始批处理 ==========")
-            self.log(f"模式：{self.mode_var.get()} | 比例：{self.aspect_var.get()} | 分辨率：{self.resolution_var.get()} | 帧率：{self.framerate_var.get()}")
-
-            for index, input_path in enumerate(list(self.file_list), start=1):
-                if self.stop_event.is_set():
-                    break
-                self._queue_tree_status(input_path, "处理中")
-                self._queue_status(f"正在处理 {index}/{total}：{os.path.basename(input_path)}")
-
-                try:
-                    output_path = self._make_output_path(input_path, output_dir)
-                    self.process_single_file(input_path, output_path)
-                    processed_count += 1
-                    self._queue_tree_status(input_path, "成功")
-                    self.log(f"处理完成：{output_path}", "success")
-                except Exception as exc:
-                    self._queue_tree_status(input_path, "失败")
-                    self.log(f"处理失败：{input_path}\n原因：{exc}", "error")
-
-                self.ui_queue.put(("progress", index))
-
-            if self.stop_event.is_set():
-                self.log("任务已停止。", "warning")
-                self._queue_status(f"已停止，成功处理 {processed_count}/{total} 个文件")
-            else:
-                self.log("========== 全部处理完成 ==========" , "success")
-                self._queue_status(f"全部完成，成功处理 {processed_count}/{total} 个文件")
-        finally:
-            self.ui_queue.put(("buttons", False))
-            self.current_process = None
-
-    def process_single_file(self, input_path, output_path):
-        temp_dir_obj = tempfile.TemporaryDirectory(prefix="video_processor_")
-        temp_dir = temp_dir_obj.name
-        segments = []
-        try:
-            plan = self._build_encode_plan()
-            process_type = self.process_type_var.get()
-
-            if process_type in ("加片头", "同时添加"):
-                intro_temp = os.path.join(temp_dir, "001_intro.mp4")
-                self._preprocess_video(self.intro_entry.get().strip(), intro_temp, plan)
-                segments.append(intro_temp)
-
-            main_temp = os.path.join(temp_dir, "002_main.mp4")
-            self._preprocess_video(input_path, main_temp, plan)
-            segments.append(main_temp)
+        self.stop_event.clear()
+        self._batch_files = set(self.files.paths())
+        self.progress.configure(value=0, maximum=max(1, len(self._batch_files)))
+        self.start_btn.configure(state=tk.DISABLED)
+        self.stop_btn.configure(state=tk.NORMAL)
+        self._set_status("开始处理...")
 
-            if process_type in ("加片尾", "同时添加"):
-                outro_temp = os.path.join(temp_dir, "003_outro.mp4")
-                self._preprocess_video(self.outro_entry.get().strip(), outro_temp, plan)
-                segments.append(outro_temp)
+        # Tk 变量只在主线程读取，后台线程只拿编译前的配置快照。
+        profile = self._build_profile()
+        intro_path, outro_path = self._intro_outro_paths()
+        self.engine.overwrite = self.overwrite_var.get()
+        self.engine.keep_temp = self.keep_temp_var.get()
+        self.engine.throughput = ThroughputController.from_text(self.throughput_var.get(), log=self.log)
+        self.processing_thread = threading.Thread(
+            target=self.process_files,
+            args=(profile, intro_path, outro_path, self.output_entry.get().strip(), self._job_count()),
+            daemon=True,
+        )
+        self.processing_thread.start()
 
-            self._concat_videos(segments, output_path, plan)
+    def estimate_processing(self):
+        """只预估输出体积、临时空间和耗时，结果写进日志，不处理。"""
+        ok, message = self.validate_inputs(create_output=False)
+        if not ok:
+            messagebox.showerror("无法预估", message)
+            return
+        self.estimate_btn.configure(state=tk.DISABLED)
+        self._set_status("正在预估...")
+        profile = self._build_profile()
+        intro_path, outro_path = self._intro_outro_paths()
+        self.engine.overwrite = self.overwrite_var.get()
+        args = (self.files.paths(), profile, intro_path, outro_path, self.output_entry.get().strip(), self._job_count())
+        threading.Thread(target=self._run_estimate, args=args, daemon=True).start()
+
+    def preview_selected(self):
+        """按当前参数渲染选中文件（没选时用第一个）拼接点前后几秒的预览，生成后直接打开。"""
+        ok, message = self.validate_inputs(check_output=False)
+        if not ok:
+            messagebox.showerror("无法预览", message)
+            return
+        selected = self.tree.selection()
+        input_path = self.tree.set(selected[0], "path") if selected else self.files.first_path()
+        if not (self.processing_thread and self.processing_thread.is_alive()):
+            self.stop_event.clear()
+        self.preview_btn.configure(state=tk.DISABLED)
+        self._set_status(f"正在生成预览：{os.path.basename(input_path)}")
+        intro_path, outro_path = self._intro_outro_paths()
+        args = (input_path, self._build_profile(), intro_path, outro_path)
+        threading.Thread(target=self._run_preview, args=args, daemon=True).start()
+
+    def _run_preview(self, input_path, profile: EncodeProfile, intro_path, outro_path):
+        try:
+            path = self.engine.render_preview(input_path, self.engine.compile_profile(profile), intro_path, outro_path)
+            open_with_system(path)
+            self._queue_status("预览已打开，调整参数后再点“预览”即可对比")
+        except Exception as exc:
+            self.log(f"预览失败：{exc}", "error")
+            self._queue_status("预览失败，请查看日志")
         finally:
-            if self.keep_temp_var.get():
-                self.log(f"已保留临时目录：{temp_dir}", "warning")
-            else:
-                temp_dir_obj.cleanup()
-
-    def _preprocess_video(self, input_path, output_path, plan: EncodePlan):
-        vf = self._build_video_filter(input_path)
-        cmd = [self.ffmpeg_path, "-hide_banner", "-y", "-i", input_path]
-
-        if vf:
-            cmd += ["-vf", vf]
+            self.ui_queue.put(("preview_done",))
 
-        fps = self.framerate_var.get().strip()
-        if fps and fps != "跟随原视频":
-            # fps 也可以在 filter 中做，但单独放 -r 更直观。
-            cmd += ["-r", fps]
-
-        cmd += ["-c:v", plan.encoder]
-        cmd += self._video_rate_args(plan, stage="preprocess")
-        cmd += self._preset_args(plan.encoder, plan.preset)
-        cmd += ["-pix_fmt", "yuv420p"]
-        cmd += self._audio_args(for_concat=True)
-        cmd += ["-movflags", "+faststart", output_path]
-        self._run_command(cmd)
-
-    def _concat_videos(self, segments, output_path, plan: EncodePlan):
-        list_file = os.path.join(tempfile.mkdtemp(prefix="concat_list_"), "filelist.txt")
+    def _run_estimate(self, files, profile: EncodeProfile, intro_path, outro_path, output_dir, jobs):
         try:
-            with open(list_file, "w", encoding="utf-8") as f:
-                for file_path in segments:
-                    safe_path = file_path.replace("'", "'\\''")
-                    f.write(f"file '{safe_path}'\n")
-
-            cmd = [
-                self.ffmpeg_path,
-                "-hide_banner",
-                "-y" if self.overwrite_var.get() else "-n",
-                "-f",
-                "concat",
-                "-safe",
-                "0",
-                "-i",
-                list_file,
-                "-c:v",
-                plan.encoder,
-            ]
-            cmd += self._video_rate_args(plan, stage="final")
-            cmd += self._preset_args(plan.encoder, plan.preset)
-            cmd += ["-pix_fmt", "yuv420p"]
-            cmd += self._audio_args(for_concat=False)
-            cmd += self._extra_args()
-            cmd += ["-movflags", "+faststart", output_path]
-            self._run_command(cmd)
+            template = self.engine.compile_profile(profile)
+            estimate = self.engine.estimate_batch(files, template, output_dir, intro_path, outro_path, jobs=jobs)
+            self._log_estimate(estimate)
+            self._queue_status("预估完成，详见日志" if estimate.ok else "磁盘空间不够，详见日志")
+        except Exception as exc:
+            self.log(f"预估失败：{exc}", "error")
+            self._queue_status("预估失败，请查看日志")
         finally:
-            try:
-                folder = os.path.dirname(list_file)
-                os.remove(list_file)
-                os.rmdir(folder)
-            except Exception:
-                pass
+            self.ui_queue.put(("estimate_done",))
+
+    def _log_estimate(self, estimate: BatchEstimate):
+        for line in estimate.summary_lines():
+            self.log(line)
+        for line in estimate.warnings:
+            self.log(line, "warning")
+        for line in estimate.problems:
+            self.log(line, "error")
+
+    def validate_inputs(self, check_output=True, create_output=True):
+        """check_output=False 时不检查输出目录（预览不写输出目录）；create_output=False 时只检查填了，
+        不建目录（预估只读不写）。"""
+        # 在主线程里调用，不能等后台检测；按钮在检测完成前本来就不可用，这里只是兜底。
+        if not self.tools_ready.is_set():
+            return False, "正在检测 FFmpeg，请稍后再试。"
+        if not self.ffmpeg_path:
+            return False, "没有检测到 ffmpeg。请先安装 ffmpeg，并加入系统 PATH。"
+        if not len(self.files):
+            return False, "请先添加要处理的视频文件。"
+        output_dir = self.output_entry.get().strip()
+        if check_output and not output_dir:
+            return False, "请选择输出目录。"
+        try:
+            if check_output and create_output:
+                Path(output_dir).mkdir(parents=True, exist_ok=True)
+        except Exception as exc:
+            return False, f"输出目录不可用：{exc}"
 
-    def _build_video_filter(self, input_path):
-        res = self.resolution_var.get().strip()
-        if res == "跟随原视频":
-            filters = []
-            fps = self.framerate_var.get().strip()
-            if fps and fps != "跟随原视频":
-                filters.append(f"fps={fps}")
-            filters.append("format=yuv420p")
-            return ",".join(filters)
+        process_type = self.process_type_var.get()
+        if process_type in ("加片头", "同时添加"):
+            intro = self.intro_entry.get().strip()
+            if not intro or not os.path.isfile(intro):
+                return False, "请选择有效的片头视频文件。"
+        if process_type in ("加片尾", "同时添加"):
+            outro = self.outro_entry.get().strip()
+            if not outro or not os.path.isfile(outro):
+                return False, "请选择有效的片尾视频文件。"
 
-        w, h = self._parse_resolution(res)
-        fit = self.fit_mode_var.get()
-        if self.mode_var.get() == "小白推荐":
-            # 小白默认居中裁剪，更适合短视频发布，不留黑边。
-            fit = "居中裁剪"
+        try:
+            ThroughputController.from_text(self.throughput_var.get())
+        except ValueError as exc:
+            return False, str(exc)
+        return self._build_profile().validate()
 
-        if fit == "完整保留补黑边":
-            vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p"
-        elif fit == "拉伸填满":
-            vf = f"scale={w}:{h},setsar=1,format=yuv420p"
-        else:
-            vf = f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},setsar=1,format=yuv420p"
+    def _job_count(self):
+        try:
+            return max(1, min(16, int(self.jobs_var.get())))
+        except ValueError:
+            return 1
 
-        fps = self.framerate_var.get().strip()
-        if fps and fps != "跟随原视频":
-            vf = f"{vf},fps={fps}"
-        return vf
+    def _intro_outro_paths(self):
+        process_type = self.process_type_var.get()
+        intro = self.intro_entry.get().strip() if process_type in ("加片头", "同时添加") else ""
+        outro = self.outro_entry.get().strip() if process_type in ("加片尾", "同时添加") else ""
+        return intro, outro
 
-    def _build_encode_plan(self):
+    # ------------------------------------------------------------------
+    # 配置文件
+    # ------------------------------------------------------------------
+    def _build_profile(self) -> EncodeProfile:
+        """把当前界面上的参数整理成一份配置；小白模式的档位在这里展开成具体数值。"""
         if self.mode_var.get() == "小白推荐":
             quality = self.quality_preset_var.get()
             if quality == "体积优先":
@@ -1214,237 +5990,201 @@ class VideoProcessorApp:
                 bitrate, maxrate, crf = "14000", "20000", "18"
             else:
                 bitrate, maxrate, crf = "6000", "9000", "22"
-            codec = "H.264 兼容优先"
-            accel = "自动选择"
-            rate_mode = "智能动态码率"
-            preset = "均衡"
-            audio_bitrate = "192"
-            extra_args = ""
-        else:
-            codec = self.codec_var.get()
-            accel = self.accel_var.get()
-            rate_mode = self.rate_mode_var.get()
-            bitrate = self.bitrate_var.get().strip()
-            maxrate = self.maxrate_var.get().strip()
-            crf = self.crf_cq_var.get().strip()
-            preset = self.encoder_preset_var.get()
-            audio_bitrate = self.audio_bitrate_var.get().strip()
-            extra_args = self.extra_args_var.get().strip()
-
-        encoder = self._select_encoder(codec, accel)
-        return EncodePlan(
-            codec=codec,
-            encoder=encoder,
-            preset=preset,
-            rate_mode=rate_mode,
-            bitrate=bitrate,
-            maxrate=maxrate,
-            crf_cq=crf,
-            audio_bitrate=audio_bitrate,
-            extra_args=extra_args,
-        )
+            return EncodeProfile(
+                name=f"小白推荐-{quality}",
+                resolution=self.resolution_var.get().strip(),
+                # 小白默认居中裁剪，更适合短视频发布，不留黑边。
+                fit_mode="居中裁剪",
+                framerate=self.framerate_var.get().strip(),
+                bitrate=bitrate,
+                maxrate=maxrate,
+                crf_cq=crf,
+            )
 
-    def _select_encoder(self, codec, accel):
-        is_h265 = codec.startswith("H.265")
-        cpu_encoder = "libx265" if is_h265 else "libx264"
+        return EncodeProfile(
+            name=self.profile_name or "半专业调节",
+            resolution=self.resolution_var.get().strip(),
+            fit_mode=self.fit_mode_var.get(),
+            framerate=self.framerate_var.get().strip(),
+            codec=self.codec_var.get(),
+            accel=self.accel_var.get(),
+            rate_mode=self.rate_mode_var.get(),
+            bitrate=self.bitrate_var.get().strip(),
+            maxrate=self.maxrate_var.get().strip(),
+            crf_cq=self.crf_cq_var.get().strip(),
+            preset=self.encoder_preset_var.get(),
+            audio_mode=self.audio_mode_var.get(),
+            audio_bitrate=self.audio_bitrate_var.get().strip(),
+            extra_args=self.extra_args_var.get().strip(),
+            target_size_mb=self.target_size_var.get().strip(),
+            scene_analysis=self.scene_analysis_var.get(),
+            loudnorm=self.loudnorm_var.get(),
+            loudness_target=self.loudness_target_var.get().strip(),
+            verify_quality=self.verify_quality_var.get(),
+            min_ssim=self.min_ssim_var.get().strip(),
+            min_vmaf=self.min_vmaf_var.get().strip(),
+            transition=next((name for name, label in TRANSITIONS.items() if label == self.transition_var.get()), ""),
+            transition_duration=self.transition_duration_var.get().strip(),
+            watermark=self.watermark_var.get().strip(),
+            watermark_position=self.watermark_position_var.get(),
+            watermark_scale=self.watermark_scale_var.get().strip(),
+            caption=self.caption_var.get().strip(),
+            caption_font=self.caption_font,
+            container=next((name for name, label in CONTAINER_MODES.items() if label == self.container_var.get()), "mp4"),
+            segment_seconds=self.segment_seconds_var.get().strip(),
+            thumbnails=self.thumbnails_var.get(),
+            renditions=Rendition.parse_spec(self.renditions_var.get()),
+        )
 
-        preferred = []
-        if accel == "NVIDIA GPU":
-            preferred = ["hevc_nvenc" if is_h265 else "h264_nvenc"]
-        elif accel == "AMD GPU":
-            preferred = ["hevc_amf" if is_h265 else "h264_amf"]
-        elif accel == "Intel GPU":
-            preferred = ["hevc_qsv" if is_h265 else "h264_qsv"]
-        elif accel == "CPU":
-            return cpu_encoder
+    def _apply_profile(self, profile: EncodeProfile):
+        res = profile.resolution.strip()
+        if res == "跟随原视频":
+            aspect = "跟随原视频"
+        elif res in ("1080x1920", "720x1280", "1440x2560", "2160x3840"):
+            aspect = "9:16 竖屏"
+        elif res in ("1920x1080", "1280x720", "2560x1440", "3840x2160"):
+            aspect = "16:9 横屏"
         else:
-            preferred = [
-                "hevc_nvenc" if is_h265 else "h264_nvenc",
-                "hevc_qsv" if is_h265 else "h264_qsv",
-                "hevc_amf" if is_h265 else "h264_amf",
-                cpu_encoder,
-            ]
-
-        available = self._get_available_encoders()
-        for enc in preferred:
-            if enc in available:
-                return enc
-        self.log("没有检测到可用硬件编码器，已自动回退 CPU 编码。", "warning")
-        return cpu_encoder
-
-    def _get_available_encoders(self):
-        if hasattr(self, "_available_encoders_cache"):
-            return self._available_encoders_cache
-        if not self.ffmpeg_path:
-            self._available_encoders_cache = set()
-            return self._available_encoders_cache
-        try:
-            result = subprocess.run([self.ffmpeg_path, "-hide_banner", "-encoders"], capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=12)
-            encoders = set(re.findall(r"\s([a-zA-Z0-9_]+)\s+", result.stdout))
-            # 正则抓不全时，直接用包含判断也够用。
-            for name in ["h264_nvenc", "hevc_nvenc", "h264_qsv", "hevc_qsv", "h264_amf", "hevc_amf", "libx264", "libx265"]:
-                if name in result.stdout:
-                    encoders.add(name)
-            self._available_encoders_cache = encoders
-        except Exception:
-            self._available_encoders_cache = {"libx264", "libx265"}
-        return self._available_encoders_cache
-
-    def _video_rate_args(self, plan: EncodePlan, stage="final"):
-        enc = plan.encoder
-        mode = plan.rate_mode
-        bitrate = f"{plan.bitrate}k"
-        maxrate = f"{plan.maxrate}k"
-        bufsize = f"{max(int(plan.maxrate or plan.bitrate) * 2, int(plan.bitrate or 1000))}k"
-        q = plan.crf_cq
-
-        is_x264_or_x265 = enc in ("libx264", "libx265")
-        is_nvenc = enc.endswith("_nvenc")
-        is_qsv = enc.endswith("_qsv")
-        is_amf = enc.endswith("_amf")
-
-        args = []
-        if mode == "固定码率 CBR":
-            args += ["-b:v", bitrate, "-minrate", bitrate, "-maxrate", bitrate, "-bufsize", bufsize]
-            if is_nvenc:
-                args += ["-rc", "cbr"]
-        elif mode == "平均码率 VBR":
-            args += ["-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
-            if is_nvenc:
-                args += ["-rc", "vbr"]
-        elif mode == "恒定质量 CRF/CQ":
-            if is_x264_or_x265:
-                args += ["-crf", q]
-            elif is_nvenc:
-                args += ["-rc", "vbr", "-cq", q, "-b:v", "0"]
-            elif is_qsv:
-                args += ["-global_quality", q]
-            elif is_amf:
-                args += ["-quality", "quality", "-qp_i", q, "-qp_p", q, "-qp_b", q]
-            else:
-                args += ["-b:v", bitrate]
-        else:  # 智能动态码率
-            if is_x264_or_x265:
-                args += ["-crf", q, "-maxrate", maxrate, "-bufsize", bufsize]
-            elif is_nvenc:
-                args += ["-rc", "vbr", "-cq", q, "-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
-            else:
-                args += ["-b:v", bitrate, "-maxrate", maxrate, "-bufsize", bufsize]
-        return args
-
-    def _preset_args(self, encoder, preset_name):
-        if encoder in ("libx264", "libx265"):
-            mapping = {"速度优先": "veryfast", "均衡": "medium", "质量优先": "slow"}
-            return ["-preset", mapping.get(preset_name, "medium")]
-        if encoder.endswith("_nvenc"):
-            mapping = {"速度优先": "p3", "均衡": "p5", "质量优先": "p7"}
-            return ["-preset", mapping.get(preset_name, "p5")]
-        if encoder.endswith("_qsv"):
-            mapping = {"速度优先": "veryfast", "均衡": "medium", "质量优先": "slower"}
-            return ["-preset", mapping.get(preset_name, "medium")]
-        if encoder.endswith("_amf"):
-            mapping = {"速度优先": "speed", "均衡": "balanced", "质量优先": "quality"}
-            return ["-quality", mapping.get(preset_name, "balanced")]
-        return []
-
-    def _audio_args(self, for_concat=False):
-        mode = self.audio_mode_var.get() if self.mode_var.get() == "半专业调节" else "AAC 立体声"
-        if mode == "静音输出":
-            return ["-an"]
-        if mode == "复制音频" and not for_concat:
-            # 预处理阶段不能复制，否则拼接时音频参数可能不一致；最终阶段可以尽量复制。
-            return ["-c:a", "copy"]
-        bitrate = self.audio_bitrate_var.get().strip() if self.mode_var.get() == "半专业调节" else "192"
-        return ["-c:a", "aac", "-b:a", f"{bitrate}k", "-ar", "48000", "-ac", "2"]
-
-    def _extra_args(self):
-        if self.mode_var.get() != "半专业调节":
-            return []
-        text = self.extra_args_var.get().strip()
-        if not text:
-            return []
+            aspect = "自定义"
+        # 配置里的参数都是展开后的具体值，只有半专业模式能完整显示。
+        self.mode_var.set("半专业调节")
+        self.aspect_var.set(aspect)
+        self.resolution_var.set(res)
+        self.fit_mode_var.set(profile.fit_mode)
+        self.framerate_var.set(profile.framerate)
+        self.codec_var.set(profile.codec)
+        self.accel_var.set(profile.accel)
+        self.rate_mode_var.set(profile.rate_mode)
+        self.bitrate_var.set(profile.bitrate)
+        self.maxrate_var.set(profile.maxrate)
+        self.crf_cq_var.set(profile.crf_cq)
+        self.encoder_preset_var.set(profile.preset)
+        self.audio_mode_var.set(profile.audio_mode)
+        self.audio_bitrate_var.set(profile.audio_bitrate)
+        self.extra_args_var.set(profile.extra_args)
+        if profile.target_size_mb:
+            self.target_size_var.set(profile.target_size_mb)
+        self.scene_analysis_var.set(profile.scene_analysis)
+        self.loudnorm_var.set(profile.loudnorm)
+        self.loudness_target_var.set(profile.loudness_target)
+        self.verify_quality_var.set(profile.verify_quality)
+        self.min_ssim_var.set(profile.min_ssim)
+        self.min_vmaf_var.set(profile.min_vmaf)
+        self.transition_var.set(TRANSITIONS.get(profile.transition, "无"))
+        self.transition_duration_var.set(profile.transition_duration)
+        self.container_var.set(CONTAINER_MODES.get(profile.container, CONTAINER_MODES["mp4"]))
+        self.segment_seconds_var.set(profile.segment_seconds)
+        self.thumbnails_var.set(profile.thumbnails)
+        self.watermark_var.set(profile.watermark)
+        self.watermark_position_var.set(profile.watermark_position)
+        self.watermark_scale_var.set(profile.watermark_scale)
+        self.caption_var.set(profile.caption)
+        self.caption_font = profile.caption_font
+        self.renditions_var.set(Rendition.format_spec(profile.renditions))
+        self.profile_name = profile.name
+
+    def load_profile(self):
+        path = filedialog.askopenfilename(filetypes=EncodeProfile.FILE_TYPES)
+        if not path:
+            return
         try:
-            return shlex.split(text)
-        except ValueError:
-            self.log("高级参数解析失败，已忽略。", "warning")
-            return []
+            profile = EncodeProfile.load(path)
+        except ValueError as exc:
+            messagebox.showerror("加载配置失败", str(exc))
+            return
+        ok, msg = profile.validate()
+        if not ok:
+            messagebox.showerror("加载配置失败", f"配置参数无效：{msg}")
+            return
+        self._apply_profile(profile)
+        self.log(f"已加载配置：{profile.name}（{path}）", "success")
 
-    def _run_command(self, cmd):
-        if self.stop_event.is_set():
-            raise RuntimeError("用户已停止任务")
-        self.log("执行命令：" + " ".join(self._quote_cmd(c) for c in cmd), "debug")
-        startupinfo = None
-        creationflags = 0
-        if os.name == "nt":
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            creationflags = subprocess.CREATE_NO_WINDOW
-        output_lines: List[str] = []
+    def save_profile(self):
+        profile = self._build_profile()
+        ok, msg = profile.validate()
+        if not ok:
+            messagebox.showerror("无法保存配置", msg)
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            initialfile=f"{profile.name}.json",
+            filetypes=EncodeProfile.FILE_TYPES,
+        )
+        if not path:
+            return
+        profile.name = Path(path).stem
         try:
-            self.current_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                encoding="utf-8",
-                errors="replace",
-                startupinfo=startupinfo,
-                creationflags=creationflags,
-            )
-            for line in self.current_process.stdout:
-                if self.stop_event.is_set():
-                    self._terminate_current_process()
-                    raise RuntimeError("用户已停止任务")
-                line = line.strip()
-                if line:
-                    output_lines.append(line)
-                    self.log(line, "debug")
-            ret = self.current_process.wait()
-            self.current_process = None
-            if ret != 0:
-                diagnosis = FFmpegErrorAnalyzer.format_diagnosis(output_lines, exit_code=ret)
-                raise RuntimeError(f"FFmpeg 处理失败（退出码 {ret}）\n{diagnosis}")
-        except Exception:
-            self._terminate_current_process()
-            raise
-
-    def _terminate_current_process(self):
-        process = self.current_process
-        if not process or process.poll() is not None:
+            profile.save(path)
+        except OSError as exc:
+            messagebox.showerror("保存配置失败", str(exc))
             return
+        self.profile_name = profile.name
+        self.log(f"已保存配置：{path}", "success")
+
+    # ------------------------------------------------------------------
+    # 处理逻辑
+    # ------------------------------------------------------------------
+    def process_files(self, profile: EncodeProfile, intro_path="", outro_path="", output_dir="", jobs=1):
+        files = self.files.paths()
+        processed_count = 0
         try:
-            process.terminate()
-            process.wait(timeout=3)
-        except Exception:
+            self.log("========== 开始批处理 ==========")
+            self.log(f"配置：{profile.name} | 分辨率：{profile.resolution} | 适配：{profile.fit_mode} | 帧率：{profile.framerate} | 并行：{jobs}")
+            template = self.engine.compile_profile(profile)
+            self.log(f"编码器：{template.plan.encoder} | 命令模板：{template.key}")
+            estimate = self.engine.estimate_batch(files, template, output_dir, intro_path, outro_path, jobs=jobs)
+            self._log_estimate(estimate)
+            if not estimate.ok:
+                self.log("磁盘空间不够，已取消。请换个输出目录或清理磁盘后再开始。", "error")
+                self._queue_status("磁盘空间不够，未开始处理")
+                return
+            # 设置了环境变量时，处理过程中定时把监控指标写成 Prometheus textfile。
+            metrics_file = os.environ.get("VIDEO_TOOL_METRICS_FILE")
+            metrics_stop = start_metrics_textfile(self.engine.metrics, metrics_file) if metrics_file else None
             try:
-                process.kill()
-            except Exception:
-                pass
+                processed_count = self.engine.run_batch(
+                    files, template, output_dir, intro_path, outro_path, jobs=jobs, on_event=self._on_engine_event,
+                )
+            finally:
+                if metrics_stop is not None:
+                    metrics_stop.set()
+
+            # 处理过程中加入的文件也算在这一批里。
+            total = len(self._batch_files)
+            if self.stop_event.is_set():
+                self.log("任务已停止。", "warning")
+                self._queue_status(f"已停止，成功处理 {processed_count}/{total} 个文件")
+            else:
+                self.log("========== 全部处理完成 ==========" , "success")
+                self._queue_status(f"全部完成，成功处理 {processed_count}/{total} 个文件")
+        except Exception as exc:
+            self.log(f"批处理中断：{exc}", "error")
+            self._queue_status("批处理中断，请查看日志")
+        finally:
+            self.ui_queue.put(("buttons", False))
+
+    def _on_engine_event(self, event, input_path, detail):
+        """引擎回调（在工作线程里执行），只往队列里放消息，由主线程更新界面。"""
+        if event == "start":
+            self._queue_tree_status(input_path, "处理中")
+            self._queue_status(f"正在处理：{os.path.basename(input_path)}")
+        elif event == "done":
+            self._queue_tree_status(input_path, "成功")
+            if detail:
+                self.files.set_output(input_path, detail[0])
+            self.log(f"处理完成：{'、'.join(detail)}", "success")
+        elif event == "failed":
+            self._queue_tree_status(input_path, "失败")
+            self.log(f"处理失败：{input_path}\n原因：{detail}", "error")
+        elif event == "requeued":
+            self._queue_tree_status(input_path, "等待")
+            self.log(f"给加急文件让位，稍后重新处理：{os.path.basename(input_path)}", "warning")
+        elif event == "progress":
+            self.ui_queue.put(("progress", detail))
 
     # ------------------------------------------------------------------
     # 工具函数
     # ------------------------------------------------------------------
-    def _make_output_path(self, input_path, output_dir):
-        stem = Path(input_path).stem
-        output_path = os.path.join(output_dir, f"processed_{stem}.mp4")
-        if self.overwrite_var.get() or not os.path.exists(output_path):
-            return output_path
-        counter = 1
-        while True:
-            candidate = os.path.join(output_dir, f"processed_{stem}_{counter}.mp4")
-            if not os.path.exists(candidate):
-                return candidate
-            counter += 1
-
-    def _parse_resolution(self, text):
-        parts = re.split(r"[xX*]", text.replace(" ", ""))
-        return int(parts[0]), int(parts[1])
-
-    def _quote_cmd(self, s):
-        if not isinstance(s, str):
-            s = str(s)
-        return f'"{s}"' if " " in s else s
-
     def _show_ffmpeg_warning(self):
         self.log("未检测到 ffmpeg。请安装 ffmpeg 并加入系统 PATH。", "error")
         messagebox.showwarning(
@@ -1493,18 +6233,147 @@ class VideoProcessorApp:
             elif action == "progress":
                 _, value = item
                 self.progress.configure(value=value)
+            elif action == "duplicates":
+                _, generation, groups = item
+                if generation == self._dedup_generation:
+                    self._show_duplicates(groups)
+            elif action == "ffmpeg_missing":
+                self._show_ffmpeg_warning()
+            elif action == "tools_ready":
+                self.preview_btn.configure(state=tk.NORMAL)
+                self.estimate_btn.configure(state=tk.NORMAL)
+                self.start_btn.configure(state=tk.NORMAL)
             elif action == "buttons":
                 self.start_btn.configure(state=tk.NORMAL)
                 self.stop_btn.configure(state=tk.DISABLED)
+            elif action == "estimate_done":
+                self.estimate_btn.configure(state=tk.NORMAL)
+            elif action == "preview_done":
+                self.preview_btn.configure(state=tk.NORMAL)
+            elif action == "file_view":
+                self._refresh_file_view()
 
         self.master.after(100, self._process_queues)
 
     def _update_tree_status(self, file_path, status):
-        for child in self.tree.get_children():
-            values = self.tree.item(child, "values")
-            if values and len(values) >= 3 and values[2] == file_path:
-                self.tree.item(child, values=(status, values[1], values[2]))
+        row_id = self.files.set_status(file_path, status)
+        if row_id is None:
+            return
+        if self._file_filter() or self._view_sort[0] == "status":
+            # 状态变了，这一行在筛选/排序后的位置也可能变，攒一下再整页刷新。
+            if not self._view_pending:
+                self._view_pending = True
+                self.master.after(200, self._refresh_file_view)
+        elif self.tree.exists(str(row_id)):
+            self.tree.set(str(row_id), "status", status)
+
+    # ------------------------------------------------------------------
+    # 虚拟文件列表
+    # ------------------------------------------------------------------
+    def _file_filter(self):
+        value = self.file_filter_var.get()
+        return "" if value == FILE_FILTERS[0] else value
+
+    def _refresh_file_view(self):
+        """从 FileListStore 取当前一页重建 Treeview，看不见的行不创建控件；选中的行还在这一页时保持选中。"""
+        self._view_pending = False
+        status = self._file_filter()
+        total = self.files.count(status)
+        self._view_offset = max(0, min(self._view_offset, total - self._view_rows))
+        selected = set(self.tree.selection())
+        self.tree.delete(*self.tree.get_children())
+        column, descending = self._view_sort
+        for row_id, state, name, size, duration, group, path in self.files.page(
+            status, column, descending, self._view_offset, self._view_rows,
+        ):
+            shown = "—" if duration is None else (format_seconds(duration) if duration else "未知")
+            self.tree.insert("", tk.END, iid=str(row_id), values=(state, name, format_bytes(size), shown, group, path))
+        self.tree.selection_set([iid for iid in self.tree.get_children() if iid in selected])
+        if total > self._view_rows:
+            self.file_scroll.set(self._view_offset / total, (self._view_offset + self._view_rows) / total)
+        else:
+            self.file_scroll.set(0, 1)
+
+    def _scroll_file_view(self, action, value, unit="units"):
+        """滚动条、滚轮和翻页键的回调，参数同 Tk 的 yview 命令（moveto 比例 / scroll 数量 单位）。"""
+        total = self.files.count(self._file_filter())
+        if action == "moveto":
+            offset = int(float(value) * total)
+        else:
+            offset = self._view_offset + int(value) * (self._view_rows if unit == "pages" else 1)
+        offset = max(0, min(offset, total - self._view_rows))
+        if offset != self._view_offset:
+            self._view_offset = offset
+            self._refresh_file_view()
+        return "break"
+
+    def _step_file_view(self, step):
+        """方向键走到这一页的首行/末行时再往外走一行：翻一行，并选中新露出来的那行。"""
+        children = self.tree.get_children()
+        if not children or self.tree.focus() != children[0 if step < 0 else -1]:
+            return None
+        before = self._view_offset
+        self._scroll_file_view("scroll", step)
+        if self._view_offset == before:
+            return "break"
+        children = self.tree.get_children()
+        edge = children[0 if step < 0 else -1]
+        self.tree.focus(edge)
+        self.tree.selection_set(edge)
+        return "break"
+
+    def _on_file_view_configure(self, event):
+        children = self.tree.get_children()
+        bbox = self.tree.bbox(children[0]) if children else ""
+        top, height = (bbox[1], bbox[3]) if bbox else (25, 20)
+        rows = max(1, (event.height - top) // max(1, height))
+        if rows != self._view_rows:
+            self._view_rows = rows
+            self._refresh_file_view()
+
+    def _sort_file_view(self, column):
+        """点表头排序，再点一次倒序；第三次恢复添加顺序。"""
+        current, descending = self._view_sort
+        if current != column:
+            self._view_sort = (column, False)
+        elif not descending:
+            self._view_sort = (column, True)
+        else:
+            self._view_sort = ("position", False)
+        for name, text in FILE_COLUMNS.items():
+            mark = (" ▼" if self._view_sort[1] else " ▲") if name == self._view_sort[0] else ""
+            self.tree.heading(name, text=text + mark)
+        self._view_offset = 0
+        self._refresh_file_view()
+
+    def _on_file_filter(self, _event=None):
+        self._view_offset = 0
+        self._refresh_file_view()
+
+    def _fill_durations(self):
+        """后台用 ffprobe 补上还没有时长的文件（结果进探测缓存），补完一批刷新一次列表。"""
+        if self._duration_thread and self._duration_thread.is_alive():
+            return
+
+        def work():
+            if not self.tools_ready.wait(timeout=60) or not self.ffprobe_path:
                 return
+            while True:
+                pending = self.files.missing_durations()
+                if not pending:
+                    break
+                for start in range(0, len(pending), 100):
+                    chunk = [path for path in pending[start:start + 100] if path in self.files]
+                    durations = []
+                    for path in chunk:
+                        info = self.engine.probe(path)
+                        durations.append((path, info.duration if info else 0.0))
+                    self.files.set_durations(durations)
+                    self.ui_queue.put(("file_view",))
+            self.engine.probe_index.save()
+
+        self._duration_thread = threading.Thread(target=work, daemon=True)
+        self._duration_thread.start()
 
     def _log_color(self, tag):
         return {
@@ -1519,12 +6388,346 @@ class VideoProcessorApp:
         if self.processing_thread and self.processing_thread.is_alive():
             if messagebox.askyesno("确认停止", "确定要停止当前处理任务吗？\n正在运行的 FFmpeg 进程也会被终止。"):
                 self.stop_event.set()
-                self._terminate_current_process()
+                # 等 FFmpeg 退出可能要几秒，放到后台，界面不卡。
+                threading.Thread(target=self.engine.terminate_processes, daemon=True).start()
                 self.stop_btn.configure(state=tk.DISABLED)
                 self.log("正在停止任务...", "warning")
 
 
-if __name__ == "__main__":
+# ----------------------------------------------------------------------
+# 命令行模式
+# ----------------------------------------------------------------------
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="视频片头片尾批处理工具。不带参数运行时打开图形界面；带参数时按配置文件在命令行批量处理。",
+    )
+    parser.add_argument("inputs", nargs="*", help="要处理的视频文件或文件夹")
+    parser.add_argument("-p", "--profile", help="配置文件（.json / .toml），不填则使用默认的小白推荐参数")
+    parser.add_argument("--intro", default="", help="片头视频")
+    parser.add_argument("--outro", default="", help="片尾视频")
+    parser.add_argument("-o", "--output-dir", help="输出目录")
+    parser.add_argument("--ffmpeg", help="ffmpeg 可执行文件路径，默认从 PATH 查找")
+    parser.add_argument("--no-overwrite", action="store_true", help="输出文件已存在时自动加序号，不覆盖")
+    parser.add_argument("--keep-temp", action="store_true", help="保留临时文件，方便排查问题")
+    parser.add_argument("--no-dedup", action="store_true", help="不按内容去重：内容相同的文件也各自编码一次")
+    parser.add_argument("--verify", action="store_true", help="处理完抽样校验画质（SSIM/PSNR/VMAF），低于配置下限的文件记为失败")
+    parser.add_argument("--thumbnails", action="store_true", help="在每个成品旁边写出封面（.jpg）和缩略图拼图（_sprite.jpg）")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="同时处理的文件数，默认 1")
+    parser.add_argument("--ram-budget", type=int, default=0, metavar="MB", help="所有任务合计的内存预算，默认物理内存的 75%%")
+    parser.add_argument("--vram-budget", type=int, default=0, metavar="MB", help="硬件编码的显存预算，默认读取 NVIDIA 显卡显存的 80%%")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示完整 FFmpeg 命令和输出")
+    plan = parser.add_argument_group("预估（按探测到的时长和码率参数算输出体积、临时空间和耗时）")
+    plan.add_argument("--dry-run", action="store_true", help="只预估每个文件和整批的体积与耗时，不处理")
+    plan.add_argument("--history", action="append", default=[], metavar="metrics.jsonl", help="额外用来校准预估的历史处理记录，可重复；输出目录里的会自动读取")
+    plan.add_argument("--no-space-check", action="store_true", help="磁盘空间预计不够时也照常开始")
+    plan.add_argument("--preview", action="store_true", help="只渲染第一个文件拼接点前后几秒的预览（速度优先预设），打印预览文件路径，不需要 -o")
+    target = parser.add_argument_group("吞吐目标（按实测速度自动在配置的编码预设及更快的档位之间切换）").add_mutually_exclusive_group()
+    target.add_argument("--deadline", metavar="时间", help="整批的完成时间：18:30 这样的时刻，或 90m、2h 这样的时长")
+    target.add_argument("--realtime", type=float, default=0, metavar="倍数", help="整批吞吐至少达到素材时长的几倍速，例如 4")
+    service = parser.add_argument_group("任务服务（给上传服务等程序调用的本地 HTTP/JSON 接口）")
+    service.add_argument("--serve", metavar="地址", help="以服务方式运行，例如 127.0.0.1:8766；-p/-o/--intro/--outro 是任务的默认值，-j 是同时执行的任务数")
+    service.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE, help="最多排队的任务数，超出时提交返回 429")
+    metrics = parser.add_argument_group("监控指标（Prometheus 文本格式，处理过程中实时更新）")
+    metrics.add_argument("--metrics", metavar="地址", help="在 host:port 上提供 GET /metrics，例如 127.0.0.1:9464")
+    metrics.add_argument("--metrics-file", metavar="路径", help="定时写入指标文件，供 node_exporter 的 textfile collector 采集（文件名以 .prom 结尾）")
+    farm = parser.add_argument_group("渲染农场")
+    farm.add_argument("--farm", metavar="地址", help="作为协调端分发任务：host:port 开 HTTP 服务，或填共享目录走文件队列")
+    farm.add_argument("--worker", metavar="地址", help="作为工作进程从协调端领取任务：host:port 或共享目录")
+    farm.add_argument("--spawn-workers", type=int, default=0, metavar="N", help="协调端同时在本机启动 N 个工作进程")
+    farm.add_argument("--lease-seconds", type=int, default=FARM_LEASE_SECONDS, help="租约时长，工作进程超过这么久没有心跳就重新分配任务")
+    return parser
+
+
+def run_cli(args) -> int:
+    def log(message, tag="info"):
+        if tag != "debug" or args.verbose:
+            _print_log(message, tag)
+
+    sweep_orphaned_temp_dirs(log)
+
+    if args.worker:
+        return run_farm_worker_cli(args, log)
+    ffmpeg_path = args.ffmpeg or find_tool("ffmpeg")
+    # 协调端本身不跑 FFmpeg，没装也可以分发任务。
+    if not ffmpeg_path and not args.farm:
+        log("没有检测到 ffmpeg。请先安装 ffmpeg 并加入系统 PATH，或用 --ffmpeg 指定路径。", "error")
+        return 2
+    if not args.output_dir and not args.preview:
+        log("请用 -o 指定输出目录。", "error")
+        return 2
+
+    try:
+        profile = EncodeProfile.load(args.profile) if args.profile else EncodeProfile()
+    except ValueError as exc:
+        log(str(exc), "error")
+        return 2
+    if args.verify:
+        profile = replace(profile, verify_quality=True)
+    if args.thumbnails:
+        profile = replace(profile, thumbnails=True)
+    ok, msg = profile.validate()
+    if not ok:
+        log(f"配置参数无效：{msg}", "error")
+        return 2
+
+    for label, path in (("片头", args.intro), ("片尾", args.outro)):
+        if path and not os.path.isfile(path):
+            log(f"{label}文件不存在：{path}", "error")
+            return 2
+    if args.serve:
+        return run_service_cli(args, ffmpeg_path, profile, log)
+    files = collect_video_files(args.inputs)
+    if not files:
+        log("没有找到要处理的视频文件。", "error")
+        return 2
+
+    engine = VideoEngine(ffmpeg_path, find_tool("ffprobe"), log=log, governor=ResourceGovernor(args.ram_budget, args.vram_budget))
+    engine.overwrite = not args.no_overwrite
+    engine.keep_temp = args.keep_temp
+    engine.dedupe = not args.no_dedup
+    if args.deadline or args.realtime > 0:
+        try:
+            deadline = parse_deadline(args.deadline) if args.deadline else None
+        except ValueError as exc:
+            log(str(exc), "error")
+            return 2
+        engine.throughput = ThroughputController(deadline, args.realtime, log=log)
+    try:
+        template = engine.compile_profile(profile)
+    except (ValueError, RuntimeError) as exc:
+        log(f"配置参数无效：{exc}", "error")
+        return 2
+    log(f"配置：{profile.name} | 编码器：{template.plan.encoder} | 命令模板：{template.key}")
+    if args.farm:
+        return run_farm_coordinator_cli(args, files, template, log)
+    if args.preview:
+        try:
+            print(engine.render_preview(files[0], template, args.intro, args.outro))
+        except Exception as exc:
+            log(f"预览失败：{exc}", "error")
+            return 1
+        finally:
+            engine.probe_index.save()
+        return 0
+    if args.dry_run or not args.no_space_check:
+        estimate = engine.estimate_batch(files, template, args.output_dir, args.intro, args.outro, jobs=args.jobs, history=args.history)
+        if args.dry_run:
+            for item in estimate.files:
+                detail = f"与 {os.path.basename(item.duplicate_of)} 内容相同" if item.duplicate_of else (
+                    f"{format_bytes(item.output_bytes)}，临时 {format_bytes(item.temp_bytes)}，约 {format_seconds(item.seconds)}"
+                    if item.duration > 0 else "读不到时长"
+                )
+                log(f"{os.path.basename(item.input_path)}（{format_seconds(item.duration)}）→ {os.path.basename(item.output_path)}：{detail}")
+        for line in estimate.summary_lines():
+            log(line)
+        for line in estimate.warnings:
+            log(line, "warning")
+        for line in estimate.problems:
+            log(line + ("" if args.dry_run else "已取消；换个输出目录、清理磁盘，或加 --no-space-check 照常开始。"), "error")
+        if args.dry_run or not estimate.ok:
+            return 0 if estimate.ok else 1
+    # 预估只读不写（剩余空间看最近的已存在上级目录），真正开始处理才建输出目录；农场由工作进程各自建。
+    if args.output_dir:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    def on_event(event, input_path, detail):
+        if event == "start":
+            log(f"开始处理：{os.path.basename(input_path)}")
+        elif event == "done":
+            log(f"处理完成：{'、'.join(detail)}", "success")
+        elif event == "failed":
+            log(f"处理失败：{input_path}\n原因：{detail}", "error")
+
+    close_metrics = _start_metrics_exporters(args, engine.metrics, log)
+    if close_metrics is None:
+        return 2
+    try:
+        succeeded = engine.run_batch(files, template, args.output_dir, args.intro, args.outro, jobs=args.jobs, on_event=on_event)
+    except KeyboardInterrupt:
+        log("任务已停止。", "warning")
+        return 130
+    finally:
+        close_metrics()
+    log(f"全部完成，成功 {succeeded}/{len(files)} 个文件", "success" if succeeded == len(files) else "warning")
+    return 0 if succeeded == len(files) else 1
+
+
+def _start_metrics_exporters(args, registry: MetricsRegistry, log):
+    """按 --metrics / --metrics-file 开始导出指标，返回收尾函数；地址无效或端口被占用时返回 None。"""
+    server = stop = None
+    if args.metrics:
+        host, _, port = args.metrics.split("://")[-1].rpartition(":")
+        try:
+            server = start_metrics_server(registry, host or "127.0.0.1", int(port))
+        except (OSError, ValueError) as exc:
+            log(f"指标服务启动失败：{args.metrics}（{exc}）", "error")
+            return None
+        bound_host, bound_port = server.server_address[:2]
+        log(f"监控指标：http://{bound_host}:{bound_port}/metrics")
+    if args.metrics_file:
+        stop = start_metrics_textfile(registry, args.metrics_file)
+        log(f"监控指标写入：{args.metrics_file}")
+
+    def close():
+        if stop is not None:
+            stop.set()
+        if server is not None:
+            server.shutdown()
+
+    return close
+
+
+def _farm_worker_command(address, args):
+    # 打包成 exe 后 sys.executable 就是程序本身。
+    cmd = [sys.executable] if getattr(sys, "frozen", False) else [sys.executable, os.path.abspath(__file__)]
+    cmd += ["--worker", address, "--lease-seconds", str(args.lease_seconds)]
+    if args.ffmpeg:
+        cmd += ["--ffmpeg", args.ffmpeg]
+    if args.keep_temp:
+        cmd.append("--keep-temp")
+    if args.verbose:
+        cmd.append("-v")
+    return cmd
+
+
+def run_farm_coordinator_cli(args, files, template: CommandTemplate, log) -> int:
+    jobs = make_farm_jobs(files, template, args.output_dir, args.intro, args.outro, not args.no_overwrite)
+    server = None
+    if is_http_address(args.farm):
+        host, _, port = args.farm.split("://")[-1].rpartition(":")
+        job_queue = FarmCoordinator(args.lease_seconds, log=log)
+        try:
+            server = start_farm_server(job_queue, host or "127.0.0.1", int(port))
+        except OSError as exc:
+            log(f"协调端启动失败：{exc}", "error")
+            return 2
+        bound_host, bound_port = server.server_address[:2]
+        address = f"{'127.0.0.1' if bound_host in ('', '0.0.0.0') else bound_host}:{bound_port}"
+        log(f"协调端已启动：http://{bound_host}:{bound_port}，共 {len(jobs)} 个任务，工作进程用 --worker {address} 接入")
+    else:
+        job_queue = FileJobQueue(args.farm, args.lease_seconds, log=log)
+        address = os.path.abspath(args.farm)
+        log(f"任务已写入共享队列目录：{address}，共 {len(jobs)} 个任务，工作进程用 --worker {address} 接入")
+    job_queue.submit(jobs)
+
+    workers = [subprocess.Popen(_farm_worker_command(address, args)) for _ in range(max(0, args.spawn_workers))]
+    last = None
+    try:
+        while True:
+            job_queue.reap()
+            status = job_queue.status()
+            online = sum(1 for seen in status["workers"].values() if seen <= args.lease_seconds)
+            summary = (status["done"], status["failed"], status["leased"], online)
+            if summary != last:
+                log(f"进度：完成 {status['done']}/{status['total']}，失败 {status['failed']}，处理中 {status['leased']}，在线工作进程 {online} 个")
+                last = summary
+            if status["finished"]:
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        log("任务已停止。", "warning")
+        return 130
+    finally:
+        # 工作进程要查到“已完成”才会退出，等它们走完再关服务。
+        for worker in workers:
+            try:
+                worker.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.terminate()
+        if server is not None:
+            server.shutdown()
+    log(f"全部完成，成功 {status['done']}/{status['total']} 个文件", "success" if not status["failed"] else "warning")
+    return 0 if not status["failed"] else 1
+
+
+def run_service_cli(args, ffmpeg_path, profile: EncodeProfile, log) -> int:
+    host, _, port = args.serve.split("://")[-1].rpartition(":")
+    if not port.isdigit():
+        log(f"服务地址格式应为 host:port：{args.serve}", "error")
+        return 2
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    service = JobService(
+        ffmpeg_path, find_tool("ffprobe"), profile, args.output_dir, args.intro, args.outro,
+        workers=args.jobs, max_queue=max(1, args.queue_size), overwrite=not args.no_overwrite, keep_temp=args.keep_temp,
+        dedupe=not args.no_dedup, governor=ResourceGovernor(args.ram_budget, args.vram_budget), log=log,
+    )
+    try:
+        server = start_job_service(service, host or "127.0.0.1", int(port))
+    except OSError as exc:
+        log(f"任务服务启动失败：{exc}", "error")
+        return 2
+    bound_host, bound_port = server.server_address[:2]
+    log(f"任务服务已启动：http://{bound_host}:{bound_port}，POST /jobs 提交任务，GET /jobs/<任务号>/events 订阅进度，GET /metrics 看指标")
+    close_metrics = _start_metrics_exporters(args, service.metrics, log)
+    if close_metrics is None:
+        server.shutdown()
+        return 2
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        log("正在停止任务服务...", "warning")
+        service.shutdown()
+        server.shutdown()
+    finally:
+        close_metrics()
+    return 0
+
+
+def run_farm_worker_cli(args, log) -> int:
+    ffmpeg_path = args.ffmpeg or find_tool("ffmpeg")
+    if not ffmpeg_path:
+        log("没有检测到 ffmpeg。请先安装 ffmpeg 并加入系统 PATH，或用 --ffmpeg 指定路径。", "error")
+        return 2
+    import socket
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    if is_http_address(args.worker):
+        job_queue = HttpJobQueue(args.worker)
+    else:
+        job_queue = FileJobQueue(args.worker, args.lease_seconds, log=log)
+    engine = VideoEngine(ffmpeg_path, find_tool("ffprobe"), log=log)
+    engine.keep_temp = args.keep_temp
+    log(f"[{worker_id}] 工作进程已启动，任务来源：{args.worker}")
+    try:
+        succeeded = run_farm_worker(job_queue, engine, worker_id)
+    except KeyboardInterrupt:
+        engine.stop_event.set()
+        engine.terminate_processes()
+        return 130
+    log(f"[{worker_id}] 队列已处理完，本工作进程完成 {succeeded} 个任务")
+    return 0
+
+
+def _import_tk():
+    """打开图形界面前导入 tkinter，绑定到模块级的 tk / ttk / filedialog / messagebox。"""
+    global tk, ttk, filedialog, messagebox
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_cli(build_arg_parser().parse_args(argv))
+    started = time.perf_counter()
+    _import_tk()
     root = tk.Tk()
     app = VideoProcessorApp(root)
+    threading.Thread(target=sweep_orphaned_temp_dirs, args=(app.log,), daemon=True).start()
+    report_path = os.environ.get("VIDEO_TOOL_STARTUP_BENCHMARK")
+    if report_path:
+        # 启动耗时测试（build/benchmark_startup.py）：窗口第一次画完就记下耗时并退出。
+        def report():
+            Path(report_path).write_text(f"{(time.perf_counter() - started) * 1000:.1f}\n", encoding="utf-8")
+            root.destroy()
+
+        root.after(0, lambda: root.after_idle(report))
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())